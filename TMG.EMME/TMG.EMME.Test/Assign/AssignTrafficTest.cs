@@ -22,6 +22,7 @@ using System;
 using System.Collections.Generic;
 using System.Text;
 using System.IO;
+using System.Text.Json;
 using XTMF2;
 
 namespace TMG.Emme.Test.Assign
@@ -120,6 +121,7 @@ namespace TMG.Emme.Test.Assign
                     TollWeight = Helper.CreateParameter(1.0f),
                     LinkCost = Helper.CreateParameter(0.0f),
                     PathAnalyses = Helper.CreateParameters(pathAnalyses),
+                    LinkCostAttribute = Helper.CreateParameter(""),
                 }
             };
             var module = new Emme.Assign.AssignTraffic()
@@ -135,8 +137,189 @@ namespace TMG.Emme.Test.Assign
                 ScenarioNumber = Helper.CreateParameter(1),
                 SOLAFlag = Helper.CreateParameter(true),
                 TrafficClasses = Helper.CreateParameters(trafficClasses),
+                InMemoryLinkCosts = Helper.CreateParameter(false),
             };
             module.Invoke(Helper.Modeller);
         }
+
+        [TestMethod]
+        public void AssignTrafficInMemoryLinkCostParity()
+        {
+            Helper.ImportFrabitztownNetwork(1);
+            Helper.ImportBinaryMatrix(1, 10, Path.GetFullPath("TestFiles/Test.mtx"));
+            // The same link costs from the network calculator and from NumPy. The second class'
+            // toll is an expression, which the in-memory calculation leaves to the network calculator.
+            RunAssignTraffic(false, "@auto_volume", "@lkcost_calc");
+            RunAssignTraffic(true, "@auto_volume", "@lkcost_mem");
+            var linkDomain = Emme.Calculate.CalculateNetworkAttribute.Domains.Link;
+            for (int i = 1; i <= 2; i++)
+            {
+                Assert.IsTrue(Helper.SumNetworkExpression(1, linkDomain, $"@lkcost_calc{i}") > 0.0);
+                Assert.AreEqual(0.0, Helper.SumNetworkExpression(1, linkDomain,
+                    $"abs(@lkcost_calc{i} - @lkcost_mem{i}) > 0.000001"));
+            }
+        }
+
+        [TestMethod]
+        public void AssignTrafficPeriodsModule()
+        {
+            Helper.ImportFrabitztownNetwork(1);
+            Helper.ImportBinaryMatrix(1, 10, Path.GetFullPath("TestFiles/Test.mtx"));
+            var periods = new[]
+            {
+                new Emme.Assign.AssignTraffic.Period()
+                {
+                    Name = "AM",
+                    ScenarioNumber = Helper.CreateParameter(1),
+                    TrafficClasses = Helper.CreateParameters(new[] { CreateTrafficClass("@am_volume", "mf4") }),
+                },
+                new Emme.Assign.AssignTraffic.Period()
+                {
+                    Name = "PM",
+                    ScenarioNumber = Helper.CreateParameter(1),
+                    TrafficClasses = Helper.CreateParameters(new[] { CreateTrafficClass("@pm_volume", "mf5") }),
+                },
+            };
+            var module = new Emme.Assign.AssignTraffic()
+            {
+                Name = "AssignTraffic",
+                BackgroundTransit = Helper.CreateParameter(true),
+                brGap = Helper.CreateParameter(0f),
+                Iterations = Helper.CreateParameter(100),
+                normGap = Helper.CreateParameter(0f),
+                PerformanceFlag = Helper.CreateParameter(true),
+                rGap = Helper.CreateParameter(0f),
+                RunTitle = Helper.CreateParameter("road assignment"),
+                ScenarioNumber = Helper.CreateParameter(1),
+                SOLAFlag = Helper.CreateParameter(true),
+                TrafficClasses = Helper.CreateParameters(new[] { CreateTrafficClass("@auto_volume1", "mf0") }),
+                InMemoryLinkCosts = Helper.CreateParameter(false),
+                Periods = Helper.CreateParameters(periods),
+            };
+            module.Invoke(Helper.Modeller);
+
+            // Both periods are assigned into their own outputs
+            var linkDomain = Emme.Calculate.CalculateNetworkAttribute.Domains.Link;
+            Assert.IsTrue(Helper.SumNetworkExpression(1, linkDomain, "@am_volume") > 0.0);
+            Assert.IsTrue(Helper.SumNetworkExpression(1, linkDomain, "@pm_volume") > 0.0);
+            using var timings = JsonDocument.Parse(module.PeriodTimings);
+            var periodTimings = timings.RootElement.GetProperty("periods");
+            Assert.AreEqual(2, periodTimings.GetArrayLength());
+            Assert.AreEqual("AM", periodTimings[0].GetProperty("period").GetString());
+            Assert.AreEqual("PM", periodTimings[1].GetProperty("period").GetString());
+            foreach (var timing in periodTimings.EnumerateArray())
+            {
+                Assert.AreEqual(1, timing.GetProperty("scenario").GetInt32());
+                Assert.IsTrue(timing.GetProperty("iterations").GetInt32() > 0);
+                Assert.IsTrue(timing.GetProperty("total_seconds").GetDouble() > 0.0);
+            }
+            Assert.IsTrue(timings.RootElement.GetProperty("total_seconds").GetDouble() > 0.0);
+        }
+
+        [TestMethod]
+        public void AssignTrafficPeriodsRejectDuplicateOutputs()
+        {
+            Helper.ImportFrabitztownNetwork(1);
+            Helper.ImportBinaryMatrix(1, 10, Path.GetFullPath("TestFiles/Test.mtx"));
+            // Without their own traffic classes both periods write the shared volume attribute
+            Assert.ThrowsException<EmmeToolRuntimeException>(() =>
+                Helper.Modeller.Run(null, "tmg2.Assign.assign_traffic",
+                JSONParameterBuilder.BuildParameters(writer =>
+                {
+                    writer.WriteBoolean("background_transit", true);
+                    writer.WriteNumber("br_gap", 0);
+                    writer.WriteNumber("iterations", 100);
+                    writer.WriteNumber("norm_gap", 0);
+                    writer.WriteBoolean("performance_flag", true);
+                    writer.WriteNumber("r_gap", 0);
+                    writer.WriteString("run_title", "road assignment");
+                    writer.WriteNumber("scenario_number", 1);
+                    writer.WriteBoolean("sola_flag", true);
+                    writer.WriteStartArray("traffic_classes");
+                    CreateTrafficClass("@auto_volume1", "mf4").WriteParameters(writer);
+                    writer.WriteEndArray();
+                    writer.WriteStartArray("periods");
+                    foreach (var name in new[] { "AM", "PM" })
+                    {
+                        writer.WriteStartObject();
+                        writer.WriteString("name", name);
+                        writer.WriteEndObject();
+                    }
+                    writer.WriteEndArray();
+                }), LogbookLevel.Standard));
+        }
+
+        private static Emme.Assign.AssignTraffic.TrafficClass CreateTrafficClass(string volumeAttribute, string costMatrix)
+        {
+            return new Emme.Assign.AssignTraffic.TrafficClass()
+            {
+                Name = "TrafficClass1",
+                Mode = Helper.CreateParameter('c'),
+                DemandMatrixNumber = Helper.CreateParameter("mf10"),
+                TimeMatrix = Helper.CreateParameter("mf0"),
+                CostMatrix = Helper.CreateParameter(costMatrix),
+                TollMatrix = Helper.CreateParameter("mf0"),
+                PeakHourFactor = Helper.CreateParameter(1f),
+                VolumeAttribute = Helper.CreateParameter(volumeAttribute),
+                LinkTollAttribute = Helper.CreateParameter("@toll"),
+                TollWeight = Helper.CreateParameter(1.0f),
+                LinkCost = Helper.CreateParameter(0.0f),
+                PathAnalyses = Helper.CreateParameters(new Emme.Assign.AssignTraffic.PathAnalysis[0]),
+                LinkCostAttribute = Helper.CreateParameter(""),
+            };
+        }
+
+        private static void RunAssignTraffic(bool inMemoryLinkCosts, string volumeAttribute, string linkCostAttribute)
+        {
+            Assert.IsTrue(
+                Helper.Modeller.Run(null, "tmg2.Assign.assign_traffic",
+                JSONParameterBuilder.BuildParameters(writer =>
+                {
+                    writer.WriteBoolean("background_transit", true);
+                    writer.WriteNumber("br_gap", 0);
+                    writer.WriteNumber("iterations", 100);
+                    writer.WriteNumber("norm_gap", 0);
+                    writer.WriteBoolean("performance_flag", true);
+                    writer.WriteNumber("r_gap", 0);
+                    writer.WriteString("run_title", "road assignment");
+                    writer.WriteNumber("scenario_number", 1);
+                    writer.WriteBoolean("sola_flag", true);
+                    writer.WriteBoolean("in_memory_link_costs", inMemoryLinkCosts);
+                    writer.WriteStartArray("traffic_classes");
+                    writer.WriteStartObject();
+                    writer.WriteString("name", "traffic class 1");
+                    writer.WriteString("mode", "c");
+                    writer.WriteString("demand_matrix", "mf10");
+                    writer.WriteString("time_matrix", "mf0");
+                    writer.WriteString("cost_matrix", "mf0");
+                    writer.WriteString("toll_matrix", "mf0");
+                    writer.WriteNumber("peak_hour_factor", 1);
+                    writer.WriteString("volume_attribute", volumeAttribute + "1");
+                    writer.WriteString("link_toll_attribute", "@toll");
+                    writer.WriteNumber("toll_weight", 1.0);
+                    writer.WriteNumber("link_cost", 0.5);
+                    writer.WriteString("link_cost_attribute", linkCostAttribute + "1");
+                    writer.WriteStartArray("path_analyses");
+                    writer.WriteEndArray();
+                    writer.WriteEndObject();
+                    writer.WriteStartObject();
+                    writer.WriteString("name", "traffic class 2");
+                    writer.WriteString("mode", "c");
+                    writer.WriteString("demand_matrix", "mf10");
+                    writer.WriteString("time_matrix", "mf0");
+                    writer.WriteString("cost_matrix", "mf0");
+                    writer.WriteString("toll_matrix", "mf0");
+                    writer.WriteNumber("peak_hour_factor", 1);
+                    writer.WriteString("volume_attribute", volumeAttribute + "2");
+                    writer.WriteString("link_toll_attribute", "@toll * 2 + 1");
+                    writer.WriteNumber("toll_weight", 1.0);
+                    writer.WriteNumber("link_cost", 0.5);
+                    writer.WriteString("link_cost_attribute", linkCostAttribute + "2");
+                    writer.WriteStartArray("path_analyses");
+                    writer.WriteEndArray();
+                    writer.WriteEndObject();
+                    writer.WriteEndArray();
+                }), LogbookLevel.Standard));
+        }
     }
 }
@@ -22,6 +22,8 @@ using System;
 using System.Collections.Generic;
 using System.Text;
 using System.IO;
+using System.Linq;
+using System.Text.Json;
 using XTMF2;
 
 namespace TMG.Emme.Test.Assign
@@ -131,10 +133,47 @@ namespace TMG.Emme.Test.Assign
         [TestMethod]
         public void AssignTransitModule()
         {
-            Helper.ImportFrabitztownNetwork(2);
-            Helper.ImportBinaryMatrix(2, 10, Path.GetFullPath("TestFiles/Test0.25.mtx"));
-            Helper.RunAssignTraffic(2, "mf0", 11);
-            Helper.RunAssignBoardingPenalty(new[] { 2 });
+            RunAssignTransitModule(2, "newton", 0.001f, "");
+        }
+
+        [TestMethod]
+        public void AssignTransitStepSizeMethods()
+        {
+            // Both searches find the root of the same gradient, so at a tight tolerance they
+            // take the same steps and reach the same gaps
+            var newtonTelemetry = Path.GetFullPath("newton_telemetry.jsonl");
+            var mullerTelemetry = Path.GetFullPath("muller_telemetry.jsonl");
+            RunAssignTransitModule(2, "newton", 1e-6f, newtonTelemetry);
+            RunAssignTransitModule(3, "muller", 1e-6f, mullerTelemetry);
+            var newton = ReadTelemetry(newtonTelemetry);
+            var muller = ReadTelemetry(mullerTelemetry);
+            Assert.AreEqual(newton.Count, muller.Count);
+            for (int i = 0; i < newton.Count; i++)
+            {
+                Assert.AreEqual(newton[i].Lambda, muller[i].Lambda, 1e-4, $"lambda of iteration {i}");
+                Assert.AreEqual(newton[i].RelativeGap, muller[i].RelativeGap,
+                    1e-3 * Math.Max(1.0, Math.Abs(newton[i].RelativeGap)), $"relative gap of iteration {i}");
+            }
+        }
+
+        private static List<(double Lambda, double RelativeGap)> ReadTelemetry(string path)
+        {
+            return File.ReadAllLines(path)
+                .Where(line => !String.IsNullOrWhiteSpace(line))
+                .Select(line =>
+                {
+                    using var row = JsonDocument.Parse(line);
+                    return (row.RootElement.GetProperty("lambda").GetDouble(), row.RootElement.GetProperty("crgap").GetDouble());
+                })
+                .ToList();
+        }
+
+        private static void RunAssignTransitModule(int scenarioNumber, string stepSizeMethod, float stepSizeTolerance, string telemetryFile)
+        {
+            Helper.ImportFrabitztownNetwork(scenarioNumber);
+            Helper.ImportBinaryMatrix(scenarioNumber, 10, Path.GetFullPath("TestFiles/Test0.25.mtx"));
+            Helper.RunAssignTraffic(scenarioNumber, "mf0", 11);
+            Helper.RunAssignBoardingPenalty(new[] { scenarioNumber });
 
             var walkPerceptions = new[]
             {
@@ -193,6 +232,8 @@ namespace TMG.Emme.Test.Assign
                     CongestionExponent = Helper.CreateParameter(5.972385f),
                     CongestionPerception = Helper.CreateParameter(1),
                     TTF = Helper.CreateParameter(4),
+                    CongestionFunction = Helper.CreateParameter("conical"),
+                    CrowdingCurve = Helper.CreateParameter(""),
                 },
                 new Emme.Assign.AssignTransit.TTFDefinition()
                 {
@@ -200,6 +241,8 @@ namespace TMG.Emme.Test.Assign
                     CongestionExponent = Helper.CreateParameter(5.972385f),
                     CongestionPerception = Helper.CreateParameter(1),
                     TTF = Helper.CreateParameter(2),
+                    CongestionFunction = Helper.CreateParameter("conical"),
+                    CrowdingCurve = Helper.CreateParameter(""),
                 },
                 new Emme.Assign.AssignTransit.TTFDefinition()
                 {
@@ -207,6 +250,8 @@ namespace TMG.Emme.Test.Assign
                     CongestionExponent = Helper.CreateParameter(5.972385f),
                     CongestionPerception = Helper.CreateParameter(1),
                     TTF = Helper.CreateParameter(1),
+                    CongestionFunction = Helper.CreateParameter("conical"),
+                    CrowdingCurve = Helper.CreateParameter(""),
                 }
             };
             var module = new Emme.Assign.AssignTransit()
@@ -219,16 +264,23 @@ namespace TMG.Emme.Test.Assign
                 Iterations = Helper.CreateParameter(5),
                 NormalizedGap = Helper.CreateParameter(0.0f),
                 RelativeGap = Helper.CreateParameter(0.0f),
-                ScenarioNumber = Helper.CreateParameter(2),
+                ScenarioNumber = Helper.CreateParameter(scenarioNumber),
                 WalkSpeed = Helper.CreateParameter(4.0f),
                 AssignmentPeriod = Helper.CreateParameter(3.0f),
                 NameString = Helper.CreateParameter(""),
                 CongestedAssignment = Helper.CreateParameter(true),
-                CSVFile = Helper.CreateParameter(""),
+                CSVFile = Helper.CreateParameter(telemetryFile),
                 OriginDistributionLogitScale = Helper.CreateParameter(0.0f),
                 SurfaceTransitSpeed = Helper.CreateParameter(true),
                 WalkAllWayFlag = Helper.CreateParameter(false),
                 XRowTTFRange = Helper.CreateParameter(""),
+                ResumeFromCheckpoint = Helper.CreateParameter(false),
+                WriteCheckpoints = Helper.CreateParameter(true),
+                WarmStartScenario = Helper.CreateParameter(0),
+                WarmStartCheckpoint = Helper.CreateParameter(""),
+                StepSizeMethod = Helper.CreateParameter(stepSizeMethod),
+                StepSizeTolerance = Helper.CreateParameter(stepSizeTolerance),
+                StepSizeMaxPasses = Helper.CreateParameter(0),
                 TransitClasses = Helper.CreateParameters(transitClasses),
                 SurfaceTransitSpeeds = Helper.CreateParameters(surfaceTransitSpeeds),
                 TTFDefinitions = Helper.CreateParameters(ttfDefinitions)
@@ -17,7 +17,10 @@
     along with TMG.EMME for XTMF2.  If not, see <http://www.gnu.org/licenses/>.
 */
 using Microsoft.VisualStudio.TestTools.UnitTesting;
+using System;
+using System.Diagnostics;
 using System.IO;
+using System.Runtime.InteropServices;
 
 namespace TMG.Emme.Test.Export
 {
@@ -82,7 +85,8 @@ namespace TMG.Emme.Test.Export
                 Name = "Importer",
                 ScenarioNumber = Helper.CreateParameter(1, "Const Number"),
                 NetworkPackageFile = Helper.CreateParameter(Path.GetFullPath("TestFiles/test.nwp"), "NWP File Name"),
-                ScenarioDescription = Helper.CreateParameter("From XTMF", "Description")
+                ScenarioDescription = Helper.CreateParameter("From XTMF", "Description"),
+                ExtractionCacheSize = Helper.CreateParameter(0, "Cache Size")
             };
             importNetworkModule.Invoke(Helper.Modeller);
             var importMatrixModule = new Emme.Import.ImportBinaryMatrix()
@@ -105,5 +109,60 @@ namespace TMG.Emme.Test.Export
             };
             module.Invoke(Helper.Modeller);
         }
+
+        [TestMethod]
+        public void ExportBinaryMatrixArrayThroughput()
+        {
+            const int repetitions = 20;
+            Helper.ImportFrabitztownNetwork(1);
+            Helper.ImportBinaryMatrix(1, 1, Path.GetFullPath("TestFiles/Test.mtx"));
+            var filePath = Path.GetFullPath("OutputTestFiles/throughputEBM.mtx");
+            Directory.CreateDirectory(Path.GetDirectoryName(filePath));
+
+            // Write the matrix to disk with the tool and read the file back
+            byte[] fileData = null;
+            var fileWatch = Stopwatch.StartNew();
+            for (int i = 0; i < repetitions; i++)
+            {
+                Assert.IsTrue(Helper.Modeller.Run(null, "tmg2.Export.export_binary_matrix",
+                    JSONParameterBuilder.BuildParameters(writer =>
+                    {
+                        writer.WriteNumber("matrix_type", 4);
+                        writer.WriteNumber("matrix_number", 1);
+                        writer.WriteString("file_location", filePath);
+                        writer.WriteNumber("scenario_number", 1);
+                    }), LogbookLevel.None));
+                fileData = File.ReadAllBytes(filePath);
+            }
+            fileWatch.Stop();
+
+            // Return the same matrix directly over the pipe
+            ModellerArray array = null;
+            var arrayWatch = Stopwatch.StartNew();
+            for (int i = 0; i < repetitions; i++)
+            {
+                Assert.IsTrue(Helper.Modeller.Run(null, "tmg2.Export.export_binary_matrix",
+                    JSONParameterBuilder.BuildParameters(writer =>
+                    {
+                        writer.WriteNumber("matrix_type", 4);
+                        writer.WriteNumber("matrix_number", 1);
+                        writer.WriteBoolean("return_array", true);
+                        writer.WriteNumber("scenario_number", 1);
+                    }), LogbookLevel.None, null, ref array));
+            }
+            arrayWatch.Stop();
+
+            Assert.IsNotNull(array);
+            Assert.AreEqual(2, array.Shape.Length);
+            Assert.AreEqual((long)array.Shape[0] * array.Shape[1], array.Length);
+            // The elements are stored at the end of the binary matrix file
+            var values = array.ToSingleArray();
+            var fileValues = MemoryMarshal.Cast<byte, float>(fileData.AsSpan(fileData.Length - values.Length * sizeof(float)));
+            Assert.IsTrue(fileValues.SequenceEqual(values));
+
+            double megabytes = repetitions * (double)array.Data.Length / (1024 * 1024);
+            Console.WriteLine($"File:  {fileWatch.Elapsed.TotalSeconds:0.000}s, {megabytes / fileWatch.Elapsed.TotalSeconds:0.0} MB/s");
+            Console.WriteLine($"Array: {arrayWatch.Elapsed.TotalSeconds:0.000}s, {megabytes / arrayWatch.Elapsed.TotalSeconds:0.0} MB/s");
+        }
     }
 }
@@ -62,7 +62,8 @@ namespace TMG.Emme.Test.Export
                 Name = "Importer",
                 ScenarioNumber = Helper.CreateParameter(1, "Const Number"),
                 NetworkPackageFile = Helper.CreateParameter(Path.GetFullPath("TestFiles/test.nwp"), "NWP File Name"),
-                ScenarioDescription = Helper.CreateParameter("From XTMF", "Description")
+                ScenarioDescription = Helper.CreateParameter("From XTMF", "Description"),
+                ExtractionCacheSize = Helper.CreateParameter(0, "Cache Size")
             };
             importModule.Invoke(Helper.Modeller);
 
@@ -70,9 +71,85 @@ namespace TMG.Emme.Test.Export
             {
                 ScenarioNumber = Helper.CreateParameter(1),
                 SaveTo = Helper.CreateParameter("OutputTestFiles/Exported.nwp"),
-                Attributes = Helper.CreateParameter("all")
+                Attributes = Helper.CreateParameter("all"),
+                Compression = Helper.CreateParameter("fast")
             };
             module.Invoke(Helper.Modeller);
         }
+
+        [TestMethod]
+        public void ExportNetworkPackageCompressionModes()
+        {
+            Helper.ImportFrabitztownNetwork(1);
+            foreach (var compression in new[] { "stored", "fast", "default", "max" })
+            {
+                var packagePath = Path.GetFullPath($"OutputTestFiles/Exported_{compression}.nwp");
+                Assert.IsTrue(
+                    Helper.Modeller.Run(null, "tmg2.Export.export_network_package",
+                    JSONParameterBuilder.BuildParameters(writer =>
+                        {
+                            writer.WriteString("export_file", packagePath);
+                            writer.WriteNumber("scenario_number", 1);
+                            writer.WriteString("extra_attributes", "all");
+                            writer.WriteString("compression", compression);
+                        }), LogbookLevel.Standard));
+                // Every compression mode must produce a package that can be imported again
+                Assert.IsTrue(
+                    Helper.Modeller.Run(null, "tmg2.Import.import_network_package",
+                     JSONParameterBuilder.BuildParameters(writer =>
+                     {
+                         writer.WriteString("network_package_file", packagePath);
+                         writer.WriteString("scenario_description", "Compression " + compression);
+                         writer.WriteNumber("scenario_number", 2);
+                         writer.WriteString("conflict_option", "PRESERVE");
+                     }), LogbookLevel.Standard));
+            }
+        }
+
+        [TestMethod]
+        public void ExportNetworkPackageResultsRoundTrip()
+        {
+            Helper.ImportFrabitztownNetwork(1);
+            Helper.ImportBinaryMatrix(1, 10, Path.GetFullPath("TestFiles/Test0.25.mtx"));
+            Helper.RunAssignTraffic(1, "mf10", 11);
+            Helper.RunAssignTransit(1, "mf10");
+            var packagePath = Path.GetFullPath("OutputTestFiles/AssignedNetwork.nwp");
+            Assert.IsTrue(
+                Helper.Modeller.Run(null, "tmg2.Export.export_network_package",
+                JSONParameterBuilder.BuildParameters(writer =>
+                    {
+                        writer.WriteString("export_file", packagePath);
+                        writer.WriteNumber("scenario_number", 1);
+                        writer.WriteString("extra_attributes", "all");
+                    }), LogbookLevel.Standard));
+            Assert.IsTrue(
+                Helper.Modeller.Run(null, "tmg2.Import.import_network_package",
+                 JSONParameterBuilder.BuildParameters(writer =>
+                 {
+                     writer.WriteString("network_package_file", packagePath);
+                     writer.WriteString("scenario_description", "Results Round Trip");
+                     writer.WriteNumber("scenario_number", 2);
+                     writer.WriteString("conflict_option", "PRESERVE");
+                 }), LogbookLevel.Standard));
+            // The results files are matched back onto the elements they were exported from, including
+            // the hidden segments at the end of each line. Weighting the volumes catches rows that land
+            // on the wrong element.
+            var link = Emme.Calculate.CalculateNetworkAttribute.Domains.Link;
+            var segment = Emme.Calculate.CalculateNetworkAttribute.Domains.TransitSegment;
+            foreach (var (domain, expression) in new[]
+            {
+                (link, "auto_volume"),
+                (link, "auto_volume * length"),
+                (link, "aux_transit_volume"),
+                (link, "aux_transit_volume * length"),
+                (segment, "transit_volume"),
+                (segment, "transit_volume * (i * 100000 + j)"),
+            })
+            {
+                var exported = Helper.SumNetworkExpression(1, domain, expression);
+                Assert.IsTrue(exported > 0.0, expression);
+                Assert.AreEqual(exported, Helper.SumNetworkExpression(2, domain, expression), 1e-6 * exported, expression);
+            }
+        }
     }
 }
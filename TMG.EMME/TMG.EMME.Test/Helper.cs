@@ -283,6 +283,32 @@ namespace TMG.Emme.Test
                 }), LogbookLevel.Standard));
         }
 
+        /// <summary>
+        /// Evaluates a network calculator expression over every element of the domain.
+        /// </summary>
+        /// <param name="scenarioNumber">The scenario to evaluate the expression on.</param>
+        /// <param name="domain">The network elements to evaluate the expression for.</param>
+        /// <param name="expression">The network calculator expression.</param>
+        /// <returns>The sum of the expression over the elements.</returns>
+        internal static double SumNetworkExpression(int scenarioNumber, Emme.Calculate.CalculateNetworkAttribute.Domains domain, string expression)
+        {
+            string sum = null;
+            Assert.IsTrue(
+                Helper.Modeller.Run(null, "tmg2.Calculate.calculate_network_attribute",
+                JSONParameterBuilder.BuildParameters(writer =>
+                {
+                    writer.WriteNumber("scenario_number", scenarioNumber);
+                    writer.WriteNumber("domain", (int)domain);
+                    writer.WriteString("expression", expression);
+                    writer.WriteString("node_selection", "all");
+                    writer.WriteString("link_selection", "all");
+                    writer.WriteString("transit_line_selection", "all");
+                    writer.WriteString("result", "None");
+                    writer.WriteBoolean("return_sum", true);
+                }), LogbookLevel.Standard, ref sum));
+            return double.Parse(sum, System.Globalization.CultureInfo.InvariantCulture);
+        }
+
         /// <summary>
         /// Creates an array of basic parameters with the given values.
         /// </summary>
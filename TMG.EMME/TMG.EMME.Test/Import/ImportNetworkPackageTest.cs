@@ -19,8 +19,10 @@
 using Microsoft.VisualStudio.TestTools.UnitTesting;
 using System;
 using System.IO;
+using System.IO.Compression;
 using System.Text;
 using System.Text.Json;
+using System.Text.RegularExpressions;
 
 namespace TMG.Emme.Test.Import
 {
@@ -33,6 +35,33 @@ namespace TMG.Emme.Test.Import
             Helper.ImportFrabitztownNetwork(1);
         }
 
+        [TestMethod]
+        public void ImportNetworkPackageExtraAttributes()
+        {
+            // Every line of test.nwp has the default headway attribute, so give them a value to find
+            var packageFile = Path.GetFullPath("OutputTestFiles/ExtraAttributes.nwp");
+            Directory.CreateDirectory(Path.GetDirectoryName(packageFile));
+            File.Copy(Path.GetFullPath("TestFiles/test.nwp"), packageFile, true);
+            using (var archive = ZipFile.Open(packageFile, ZipArchiveMode.Update))
+            {
+                var entry = archive.GetEntry("exatt_transit_lines.241");
+                string contents;
+                using (var reader = new StreamReader(entry.Open()))
+                {
+                    contents = reader.ReadToEnd();
+                }
+                entry.Delete();
+                using (var writer = new StreamWriter(archive.CreateEntry("exatt_transit_lines.241").Open()))
+                {
+                    writer.Write(Regex.Replace(contents, @",0(\r?)$", ",2.5$1", RegexOptions.Multiline));
+                }
+            }
+            Helper.ImportNetwork(4, packageFile);
+            // The exatt files quote and pad the line ids, and the hidden segments have a j node of None
+            Assert.AreEqual(118.0, Helper.SumNetworkExpression(4, Emme.Calculate.CalculateNetworkAttribute.Domains.TransitSegment, "@tstop"), 1e-6);
+            Assert.AreEqual(14 * 2.5, Helper.SumNetworkExpression(4, Emme.Calculate.CalculateNetworkAttribute.Domains.TransitLine, "@ehdw"), 1e-6);
+        }
+
         [TestMethod]
         public void ImportNetworkPackageModule()
         {
@@ -40,10 +69,64 @@ namespace TMG.Emme.Test.Import
             {
                 Name = "Importer",
                 ScenarioNumber = Helper.CreateParameter(3, "Const Number"),
-                NetworkPackageFile = Helper.CreateParameter(Path.GetFullPath("TestFiles/AMTransit.nwp"), "EROWNetwork"),
-                ScenarioDescription = Helper.CreateParameter("From XTMF","Description")
+                NetworkPackageFile = Helper.CreateParameter(Path.GetFullPath("TestFiles/test.nwp"), "Network Package"),
+                ScenarioDescription = Helper.CreateParameter("From XTMF","Description"),
+                ExtractionCacheSize = Helper.CreateParameter(0, "Cache Size")
             };
             importModule.Invoke(Helper.Modeller);
         }
+
+        [TestMethod]
+        public void ImportNetworkPackageRepeated()
+        {
+            // The second and third imports are served from the extraction cache
+            var cacheDirectory = Path.GetFullPath("OutputTestFiles/NetworkPackageCache");
+            if (Directory.Exists(cacheDirectory))
+            {
+                Directory.Delete(cacheDirectory, true);
+            }
+            for (int scenarioNumber = 1; scenarioNumber <= 3; scenarioNumber++)
+            {
+                string returnValue = null;
+                Assert.IsTrue(
+                    Helper.Modeller.Run(null, "tmg2.Import.import_network_package",
+                     JSONParameterBuilder.BuildParameters(writer =>
+                     {
+                         writer.WriteString("network_package_file", Path.GetFullPath("TestFiles/test.nwp"));
+                         writer.WriteString("scenario_description", "Repeated Import");
+                         writer.WriteNumber("scenario_number", scenarioNumber);
+                         writer.WriteString("conflict_option", "PRESERVE");
+                         writer.WriteString("extraction_cache_directory", cacheDirectory);
+                         writer.WriteNumber("extraction_cache_size", 1024);
+                     }), LogbookLevel.Standard, ref returnValue));
+                using var statistics = JsonDocument.Parse(returnValue);
+                int hits = statistics.RootElement.GetProperty("hits").GetInt32();
+                int misses = statistics.RootElement.GetProperty("misses").GetInt32();
+                if (scenarioNumber == 1)
+                {
+                    Assert.IsTrue(misses > 0);
+                }
+                else
+                {
+                    Assert.AreEqual(0, misses);
+                    Assert.IsTrue(hits > 0);
+                }
+            }
+            // The cached imports build the same network as the first one
+            foreach (var (domain, expression) in new[]
+            {
+                (Emme.Calculate.CalculateNetworkAttribute.Domains.Node, "1"),
+                (Emme.Calculate.CalculateNetworkAttribute.Domains.Link, "length"),
+                (Emme.Calculate.CalculateNetworkAttribute.Domains.TransitLine, "hdw"),
+                (Emme.Calculate.CalculateNetworkAttribute.Domains.TransitSegment, "@tstop"),
+            })
+            {
+                var expected = Helper.SumNetworkExpression(1, domain, expression);
+                for (int scenarioNumber = 2; scenarioNumber <= 3; scenarioNumber++)
+                {
+                    Assert.AreEqual(expected, Helper.SumNetworkExpression(scenarioNumber, domain, expression), 1e-6, expression);
+                }
+            }
+        }
     }
 }
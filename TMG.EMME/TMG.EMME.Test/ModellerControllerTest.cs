@@ -29,5 +29,60 @@ namespace TMG.Emme.Test
         {
             var modeller = Helper.Modeller;
         }
+
+        [TestMethod]
+        public void RunBatch()
+        {
+            Helper.ImportFrabitztownNetwork(1);
+            var entries = new[]
+            {
+                new ModellerBatchEntry("tmg2.Copy.copy_scenario", JSONParameterBuilder.BuildParameters(writer =>
+                {
+                    writer.WriteNumber("from_scenario", 1);
+                    writer.WriteNumber("to_scenario", 2);
+                    writer.WriteBoolean("copy_strategy", false);
+                })),
+                new ModellerBatchEntry("tmg2.Calculate.calculate_network_attribute", JSONParameterBuilder.BuildParameters(writer =>
+                {
+                    writer.WriteNumber("scenario_number", 2);
+                    writer.WriteNumber("domain", (int)Emme.Calculate.CalculateNetworkAttribute.Domains.Link);
+                    writer.WriteString("expression", "length");
+                    writer.WriteString("node_selection", "all");
+                    writer.WriteString("link_selection", "all");
+                    writer.WriteString("transit_line_selection", "all");
+                    writer.WriteString("result", "None");
+                    writer.WriteBoolean("return_sum", true);
+                })),
+                new ModellerBatchEntry("tmg2.Delete.delete_scenario", JSONParameterBuilder.BuildParameters(writer =>
+                {
+                    writer.WriteNumber("scenario", 2);
+                })),
+            };
+            var results = Helper.Modeller.RunBatch(null, entries, true);
+            Assert.AreEqual(entries.Length, results.Count);
+            foreach (var result in results)
+            {
+                Assert.IsTrue(result.Succeeded, result.Error);
+            }
+            Assert.IsTrue(float.Parse(results[1].ReturnValue) > 0.0f);
+        }
+
+        [TestMethod]
+        public void RunBatchStopOnError()
+        {
+            var entries = new[]
+            {
+                new ModellerBatchEntry("tmg2.ToolThatDoesNotExist", null),
+                new ModellerBatchEntry("tmg2.Delete.delete_scenario", JSONParameterBuilder.BuildParameters(writer =>
+                {
+                    writer.WriteNumber("scenario", 2);
+                })),
+            };
+            var results = Helper.Modeller.RunBatch(null, entries, true);
+            Assert.AreEqual(2, results.Count);
+            Assert.IsFalse(results[0].Succeeded);
+            Assert.IsNotNull(results[0].Error);
+            Assert.IsTrue(results[1].Skipped);
+        }
     }
 }
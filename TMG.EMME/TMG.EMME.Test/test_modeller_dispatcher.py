@@ -0,0 +1,175 @@
+'''
+    Copyright 2022 Travel Modelling Group, Department of Civil Engineering, University of Toronto
+
+    This file is part of XTMF.
+
+    XTMF is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    XTMF is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with XTMF.  If not, see <http://www.gnu.org/licenses/>.
+'''
+# Tests for ModellerDispatcher.py that run stub workers speaking the bridge protocol,
+# so they need neither Emme nor Windows. Run with: python -m unittest test_modeller_dispatcher
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "TMG.EMME"))
+import ModellerDispatcher as md
+from ModellerTransport import PipeTransport
+
+
+def run_stub_worker(address, databank):
+    """Answer requests like ModellerBridge.py, replying to each tool with 'databank:tool'."""
+    transport = PipeTransport.connect(address)
+    transport.send_signal(md.SignalStart)
+
+    def run(macroName, parameters):
+        if macroName == "fail":
+            transport.send_string(md.SignalRuntimeError, "%s failed" % databank)
+            return False
+        transport.send_string(md.SignalSendPrintMessage, "running %s\n" % macroName)
+        transport.send_float(md.SignalProgressReport, 0.5)
+        time.sleep(json.loads(parameters).get("sleep", 0) if parameters else 0)
+        transport.send_string(md.SignalRunCompleteWithParameter, "%s:%s" % (databank, macroName))
+        return True
+
+    while True:
+        signal = transport.read_int()
+        if signal == md.SignalTermination:
+            break
+        elif signal == md.SignalStartModuleBinaryParameters:
+            macroName, parameters = transport.read_string(), transport.read_string()
+            transport.read_string()
+            run(macroName, parameters)
+        elif signal == md.SignalCheckToolExists:
+            transport.read_string()
+            transport.send_string(md.SignalRunCompleteWithParameter, "True")
+        elif signal == md.SignalStartBatch:
+            count = transport.read_int()
+            stopOnError = transport.read_int() != 0
+            entries = [(transport.read_string(), transport.read_string(), transport.read_string())
+                       for i in range(count)]
+            for macroName, parameters, logbookLevel in entries:
+                if not run(macroName, parameters) and stopOnError:
+                    break
+            transport.send_signal(md.SignalBatchComplete)
+
+
+def stub_launcher(databank, address):
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), address, databank])
+
+
+def exiting_launcher(databank, address):
+    return subprocess.Popen([sys.executable, "-c", "import sys; sys.exit(3)"])
+
+
+def sleeping_launcher(databank, address):
+    return subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+
+
+def parameters(databank=None, sleep=0):
+    values = {"sleep": sleep}
+    if databank is not None:
+        values["databank"] = databank
+    return json.dumps(values)
+
+
+class Recorder(object):
+    """Collects the messages the dispatcher forwards to XTMF."""
+
+    def __init__(self):
+        self.messages = []
+        self.lock = threading.Lock()
+
+    def __call__(self, signal, payload):
+        with self.lock:
+            self.messages.append((signal, payload))
+
+    def payloads(self, signal):
+        return [payload for s, payload in self.messages if s == signal]
+
+
+class ModellerDispatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dispatcher = md.BridgeDispatcher(["First", "Second"], stub_launcher, connect_timeout=30)
+
+    def tearDown(self):
+        self.dispatcher.close()
+
+    def test_routes_by_databank(self):
+        forward = Recorder()
+        self.dispatcher.run_tool("tool", parameters("second"), "ALL", forward)
+        self.dispatcher.run_tool("tool", parameters(), "ALL", forward)
+        self.dispatcher.run_tool("tool", parameters("missing"), "ALL", forward)
+        self.assertEqual(["Second:tool", "First:tool"], forward.payloads(md.SignalRunCompleteWithParameter))
+        self.assertEqual(1, len(forward.payloads(md.SignalRuntimeError)))
+        self.assertIn("[Second] running tool\n", forward.payloads(md.SignalSendPrintMessage))
+
+    def test_batch_runs_databanks_in_parallel(self):
+        entries = [("a", parameters("first", 1.0), "ALL"), ("b", parameters("second", 1.0), "ALL"),
+                   ("c", parameters("first"), "ALL")]
+        start = time.time()
+        results = self.dispatcher.run_batch(entries, False, Recorder())
+        self.assertLess(time.time() - start, 1.9)
+        self.assertEqual([(md.SignalRunCompleteWithParameter, "First:a"),
+                          (md.SignalRunCompleteWithParameter, "Second:b"),
+                          (md.SignalRunCompleteWithParameter, "First:c")], results)
+
+    def test_batch_stops_on_error(self):
+        entries = [("fail", parameters("second"), "ALL"), ("a", parameters("first"), "ALL")]
+        results = self.dispatcher.run_batch(entries, True, Recorder())
+        self.assertEqual((md.SignalRuntimeError, "Second failed"), results[0])
+        self.assertIsNone(results[1])
+
+    def test_serve(self):
+        xtmf, dispatcher = socket.socketpair()
+        transport = PipeTransport.from_socket(xtmf)
+        server = threading.Thread(target=md.serve, args=(PipeTransport.from_socket(dispatcher), self.dispatcher))
+        server.start()
+        try:
+            self.assertEqual((md.SignalStart, None), md.read_message(transport))
+            transport.send_signal(md.SignalStartModuleBinaryParameters)
+            transport.send_request_strings(None, ["tool", parameters("second"), "ALL"])
+            messages = []
+            while not messages or messages[-1][0] not in md._FINAL_SIGNALS:
+                messages.append(md.read_message(transport))
+            self.assertEqual((md.SignalRunCompleteWithParameter, "Second:tool"), messages[-1])
+            transport.send_signal(md.SignalTermination)
+        finally:
+            server.join()
+            transport.close()
+        self.assertEqual(0, len(self.dispatcher.workers))
+
+
+class WorkerStartupTest(unittest.TestCase):
+
+    def test_worker_that_exits_before_connecting(self):
+        start = time.time()
+        with self.assertRaises(IOError) as context:
+            md.BridgeDispatcher(["First"], exiting_launcher, connect_timeout=None)
+        self.assertIn("exited with code 3", str(context.exception))
+        self.assertLess(time.time() - start, 10)
+
+    def test_worker_that_does_not_connect(self):
+        with self.assertRaises(IOError) as context:
+            md.BridgeDispatcher(["First"], sleeping_launcher, connect_timeout=1)
+        self.assertIn("did not connect within 1 seconds", str(context.exception))
+
+
+if __name__ == "__main__":
+    run_stub_worker(sys.argv[1], sys.argv[2])
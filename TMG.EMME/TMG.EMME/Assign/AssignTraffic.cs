@@ -69,6 +69,54 @@ namespace TMG.Emme.Assign
         [SubModule(Name = "Traffic Classes", Description = "", Index = 10)]
         public IFunction<TrafficClass>[] TrafficClasses;
 
+        [Parameter(Name = "In Memory Link Costs", DefaultValue = "false", Description = "Set this to true to compute the link costs of all classes in memory instead of with one network calculation per class.",
+            Index = 11)]
+        public IFunction<bool> InMemoryLinkCosts;
+
+        [SubModule(Name = "Periods", Description = "Time periods to assign in one run that shares its setup. Each period overrides the scenario and, if it has any, the traffic classes. Leave empty to assign a single period.",
+            Index = 12, Required = false)]
+        public IFunction<Period>[] Periods;
+
+        /// <summary>
+        /// The JSON timing summary of each period from the last run with periods.
+        /// </summary>
+        public string PeriodTimings { get; private set; }
+
+        [Module(Name = "Period", Description = "A time period of a multi-period road assignment.",
+        DocumentationLink = "http://tmg.utoronto.ca/doc/2.0")]
+        public class Period : BaseFunction<Period>
+        {
+            [Parameter(Name = "Scenario Number", DefaultValue = "0", Description = "The scenario number to assign this period on.",
+                Index = 0)]
+            public IFunction<int> ScenarioNumber;
+
+            [SubModule(Name = "Traffic Classes", Description = "The traffic classes of this period. Leave empty to use the assignment's traffic classes.",
+                Index = 1, Required = false)]
+            public IFunction<TrafficClass>[] TrafficClasses;
+
+            public override Period Invoke()
+            {
+                return this;
+            }
+
+            public void WriteParameters(System.Text.Json.Utf8JsonWriter writer)
+            {
+                writer.WriteStartObject();
+                writer.WriteString("name", Name);
+                writer.WriteNumber("scenario_number", ScenarioNumber.Invoke());
+                if (TrafficClasses != null && TrafficClasses.Length > 0)
+                {
+                    writer.WriteStartArray("traffic_classes");
+                    foreach (var trafficClass in TrafficClasses)
+                    {
+                        trafficClass.Invoke().WriteParameters(writer);
+                    }
+                    writer.WriteEndArray();
+                }
+                writer.WriteEndObject();
+            }
+        }
+
         [Module(Name = "Traffic Class", Description = "",
         DocumentationLink = "http://tmg.utoronto.ca/doc/2.0")]
         public class TrafficClass : XTMF2.IModule
@@ -116,6 +164,10 @@ namespace TMG.Emme.Assign
             [SubModule(Name = "Path Analysis", Description = "", Index = 9, Required = false)]
             public IFunction<PathAnalysis>[] PathAnalyses;
 
+            [Parameter(Name = "Link Cost Attribute", DefaultValue = "", Description = "The link attribute to keep the generalized link cost of this class in. Leave empty to use a temporary attribute.",
+                Index = 10)]
+            public IFunction<string> LinkCostAttribute;
+
             public string Name { get; set; }
 
             public bool RuntimeValidation(ref string error)
@@ -137,6 +189,7 @@ namespace TMG.Emme.Assign
                 writer.WriteString("link_toll_attribute", LinkTollAttribute.Invoke());
                 writer.WriteNumber("toll_weight", TollWeight.Invoke());
                 writer.WriteNumber("link_cost", LinkCost.Invoke());
+                writer.WriteString("link_cost_attribute", LinkCostAttribute.Invoke());
                 writer.WriteStartArray("path_analyses");
                 foreach (var pathAnalysis in PathAnalyses)
                 {
@@ -217,6 +270,8 @@ namespace TMG.Emme.Assign
 
         public override void Invoke(ModellerController context)
         {
+            bool hasPeriods = Periods != null && Periods.Length > 0;
+            string returnValue = null;
             context.Run(this, "tmg2.Assign.assign_traffic", JSONParameterBuilder.BuildParameters(writer =>
             {
                 writer.WriteNumber("scenario_number", ScenarioNumber.Invoke());
@@ -228,13 +283,24 @@ namespace TMG.Emme.Assign
                 writer.WriteBoolean("sola_flag", SOLAFlag.Invoke());
                 writer.WriteBoolean("background_transit", BackgroundTransit.Invoke());
                 writer.WriteString("run_title", RunTitle.Invoke());
+                writer.WriteBoolean("in_memory_link_costs", InMemoryLinkCosts.Invoke());
                 writer.WriteStartArray("traffic_classes");
                 foreach (var trafficClass in TrafficClasses)
                 {
                     trafficClass.Invoke().WriteParameters(writer);
                 }
                 writer.WriteEndArray();
-            }), LogbookLevel.Standard);
+                if (hasPeriods)
+                {
+                    writer.WriteStartArray("periods");
+                    foreach (var period in Periods)
+                    {
+                        period.Invoke().WriteParameters(writer);
+                    }
+                    writer.WriteEndArray();
+                }
+            }), LogbookLevel.Standard, ref returnValue);
+            PeriodTimings = hasPeriods ? returnValue : null;
         }
 
     }
@@ -83,7 +83,7 @@ namespace TMG.Emme.Assign
             Index = 29)]
         public IFunction<bool> CongestedAssignment;
 
-        [Parameter(Name = "CSV File", Description = "A link to the csv file that will specify iterational information",
+        [Parameter(Name = "CSV File", Description = "A file to write per-iteration convergence and timing information to. Use a .jsonl extension for JSON lines, otherwise CSV is written.",
             Index = 30)]
         public IFunction<string> CSVFile;
 
@@ -103,6 +103,34 @@ namespace TMG.Emme.Assign
             Index = 35)]
         public IFunction<string> XRowTTFRange;
 
+        [Parameter(Name = "Resume From Checkpoint", DefaultValue = "false", Description = "Set to TRUE to continue a congested assignment from the last iteration completed by a previous run of the same scenario.",
+            Index = 39)]
+        public IFunction<bool> ResumeFromCheckpoint;
+
+        [Parameter(Name = "Write Checkpoints", DefaultValue = "false", Description = "Set to TRUE to write a checkpoint next to the strategy files after every congested iteration, so the assignment can be resumed.",
+            Index = 40)]
+        public IFunction<bool> WriteCheckpoints;
+
+        [Parameter(Name = "Warm Start Scenario", DefaultValue = "0", Description = "The scenario whose stored transit volumes set the congestion of the initial assignment and start the averaged segment volumes. Enter 0 to start uncongested.",
+            Index = 41)]
+        public IFunction<int> WarmStartScenario;
+
+        [Parameter(Name = "Warm Start Checkpoint", DefaultValue = "", Description = "A congested assignment checkpoint file whose volumes set the congestion of the initial assignment and start the averaged segment volumes. Overrides the warm start scenario. Leave empty to not use it.",
+            Index = 42)]
+        public IFunction<string> WarmStartCheckpoint;
+
+        [Parameter(Name = "Step Size Method", DefaultValue = "newton", Description = "The search for the congested step size: newton, bracket or muller.",
+            Index = 43)]
+        public IFunction<string> StepSizeMethod;
+
+        [Parameter(Name = "Step Size Tolerance", DefaultValue = "0.001", Description = "The step length (or bracket width) at which the step size search stops.",
+            Index = 44)]
+        public IFunction<float> StepSizeTolerance;
+
+        [Parameter(Name = "Step Size Max Passes", DefaultValue = "0", Description = "The maximum number of passes of the step size search over the segments. Enter 0 for the default of the method.",
+            Index = 45)]
+        public IFunction<int> StepSizeMaxPasses;
+
         [SubModule(Name = "Transit Classes", Description = "The classes for this multi-class assignment.", Index = 36)]
         public IFunction<TransitClass>[] TransitClasses;
 
@@ -317,6 +345,14 @@ namespace TMG.Emme.Assign
             [Parameter(Name = "TTF", Description = "The TTF number to assign to. 1 would mean TTF1.",
                 Index = 2)]
             public IFunction<int> TTF;
+
+            [Parameter(Name = "Congestion Function", DefaultValue = "conical", Description = "The congestion function to apply to this TTF: conical, bpr or piecewise_linear.",
+                Index = 3)]
+            public IFunction<string> CongestionFunction;
+
+            [Parameter(Name = "Crowding Curve", DefaultValue = "", Description = "For piecewise_linear, the v/c:congestion break points of the crowding curve, separated by commas (e.g. 0.5:0,1.0:0.3,1.5:1.2).",
+                Index = 4)]
+            public IFunction<string> CrowdingCurve;
             public string Name { get; set; }
 
             public bool RuntimeValidation(ref string error)
@@ -330,6 +366,8 @@ namespace TMG.Emme.Assign
                 writer.WriteNumber("congestion_exponent", CongestionExponent.Invoke());
                 writer.WriteNumber("congestion_perception", CongestionPerception.Invoke());
                 writer.WriteNumber("ttf", TTF.Invoke());
+                writer.WriteString("congestion_function", CongestionFunction.Invoke());
+                writer.WriteString("crowding_curve", CrowdingCurve.Invoke());
                 writer.WriteEndObject();
             }
         }
@@ -355,6 +393,13 @@ namespace TMG.Emme.Assign
                 writer.WriteBoolean("surface_transit_speed", SurfaceTransitSpeed.Invoke());
                 writer.WriteBoolean("walk_all_way_flag", WalkAllWayFlag.Invoke());
                 writer.WriteString("xrow_ttf_range", XRowTTFRange.Invoke());
+                writer.WriteBoolean("resume_from_checkpoint", ResumeFromCheckpoint.Invoke());
+                writer.WriteBoolean("write_checkpoints", WriteCheckpoints.Invoke());
+                writer.WriteNumber("warm_start_scenario", WarmStartScenario.Invoke());
+                writer.WriteString("warm_start_checkpoint", WarmStartCheckpoint.Invoke());
+                writer.WriteString("step_size_method", StepSizeMethod.Invoke());
+                writer.WriteNumber("step_size_tolerance", StepSizeTolerance.Invoke());
+                writer.WriteNumber("step_size_max_passes", StepSizeMaxPasses.Invoke());
                 writer.WriteStartArray("transit_classes");
                 foreach (var transitClass in TransitClasses)
                 {
@@ -40,6 +40,10 @@ namespace TMG.Emme.Export
             Index = 2)]
         public IFunction<string> SaveTo;
 
+        [Parameter(Name = "Compression", DefaultValue = "default", Description = "How to compress the package: 'stored', 'fast', 'default' or 'max'.",
+            Index = 3)]
+        public IFunction<string> Compression;
+
         public override void Invoke(ModellerController context)
         {
             context.Run(this, "tmg2.Export.export_network_package", JSONParameterBuilder.BuildParameters(writer =>
@@ -47,6 +51,7 @@ namespace TMG.Emme.Export
                         writer.WriteString("export_file", Path.GetFullPath(SaveTo.Invoke()));
                         writer.WriteNumber("scenario_number", ScenarioNumber.Invoke());
                         writer.WriteString("extra_attributes", Attributes.Invoke());
+                        writer.WriteString("compression", Compression.Invoke());
                     }), LogbookLevel.Standard);
         }
     }
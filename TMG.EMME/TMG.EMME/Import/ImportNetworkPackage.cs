@@ -45,6 +45,10 @@ namespace TMG.Emme.Import
             Description = "A description for the imported scenario.")]
         public IFunction<string> ScenarioDescription;
 
+        [Parameter(DefaultValue = "0", Index = 3, Name = "Extraction Cache Size",
+            Description = "The size in MB of the cache of extracted network packages kept in the temporary directory, for runs that import the same package repeatedly. Enter 0 to disable the cache.")]
+        public IFunction<int> ExtractionCacheSize;
+
         private string GetParameters()
         {
             return JSONParameterBuilder.BuildParameters(writer =>
@@ -53,6 +57,7 @@ namespace TMG.Emme.Import
                 writer.WriteNumber("scenario_number", ScenarioNumber.Invoke());
                 writer.WriteString("scenario_description", ScenarioDescription.Invoke());
                 writer.WriteString("conflict_option", "OVERWRITE");
+                writer.WriteNumber("extraction_cache_size", ExtractionCacheSize.Invoke());
             });
         }
     }
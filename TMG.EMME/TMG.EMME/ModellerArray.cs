@@ -0,0 +1,164 @@
+﻿/*
+    Copyright 2022 University of Toronto
+
+    This file is part of TMG.EMME for XTMF2.
+
+    TMG.EMME for XTMF2 is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    TMG.EMME for XTMF2 is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with TMG.EMME for XTMF2.  If not, see <http://www.gnu.org/licenses/>.
+*/
+using System;
+using System.IO;
+using System.Runtime.InteropServices;
+
+namespace TMG.Emme
+{
+    /// <summary>
+    /// A numeric array returned from an EMME tool through the ModellerBridge.
+    /// </summary>
+    public sealed class ModellerArray
+    {
+        /// <summary>
+        /// The numpy type string of the elements, for example "&lt;f4" for 32-bit floats.
+        /// </summary>
+        public string DataType { get; }
+
+        /// <summary>
+        /// The length of each dimension of the array.
+        /// </summary>
+        public int[] Shape { get; }
+
+        /// <summary>
+        /// The raw little-endian elements in row-major order.
+        /// </summary>
+        public byte[] Data { get; }
+
+        public ModellerArray(string dataType, int[] shape, byte[] data)
+        {
+            DataType = dataType;
+            Shape = shape;
+            Data = data;
+        }
+
+        /// <summary>
+        /// The total number of elements in the array.
+        /// </summary>
+        public long Length => Data.LongLength / ElementSize;
+
+        /// <summary>
+        /// The size of each element in bytes.
+        /// </summary>
+        public int ElementSize => int.Parse(DataType.Substring(2));
+
+        /// <summary>
+        /// Read the array's elements as the given type.
+        /// </summary>
+        /// <typeparam name="T">The element type, which must match the array's DataType.</typeparam>
+        /// <returns>A copy of the elements.</returns>
+        public T[] ToArray<T>() where T : unmanaged
+        {
+            if (GetClrType() != typeof(T))
+            {
+                throw new InvalidOperationException($"An array of type {DataType} can not be read as {typeof(T).Name}.");
+            }
+            return MemoryMarshal.Cast<byte, T>(Data).ToArray();
+        }
+
+        /// <summary>
+        /// Read the array's elements, converting them to single precision floats.
+        /// </summary>
+        /// <returns>The elements as floats.</returns>
+        public float[] ToSingleArray()
+        {
+            var type = GetClrType();
+            if (type == typeof(float))
+            {
+                return ToArray<float>();
+            }
+            var ret = new float[Length];
+            var span = Data.AsSpan();
+            if (type == typeof(double))
+            {
+                var values = MemoryMarshal.Cast<byte, double>(span);
+                for (int i = 0; i < ret.Length; i++) ret[i] = (float)values[i];
+            }
+            else if (type == typeof(int))
+            {
+                var values = MemoryMarshal.Cast<byte, int>(span);
+                for (int i = 0; i < ret.Length; i++) ret[i] = values[i];
+            }
+            else if (type == typeof(long))
+            {
+                var values = MemoryMarshal.Cast<byte, long>(span);
+                for (int i = 0; i < ret.Length; i++) ret[i] = values[i];
+            }
+            else if (type == typeof(byte) || type == typeof(bool))
+            {
+                for (int i = 0; i < ret.Length; i++) ret[i] = span[i];
+            }
+            else
+            {
+                throw new NotSupportedException($"An array of type {DataType} can not be converted to floats.");
+            }
+            return ret;
+        }
+
+        private Type GetClrType()
+        {
+            return DataType.Substring(1) switch
+            {
+                "f4" => typeof(float),
+                "f8" => typeof(double),
+                "i1" => typeof(sbyte),
+                "i2" => typeof(short),
+                "i4" => typeof(int),
+                "i8" => typeof(long),
+                "u1" => typeof(byte),
+                "u2" => typeof(ushort),
+                "u4" => typeof(uint),
+                "u8" => typeof(ulong),
+                "b1" => typeof(bool),
+                _ => throw new NotSupportedException($"EMME returned an array of unsupported type {DataType}.")
+            };
+        }
+
+        /// <summary>
+        /// Read an array sent by the ModellerBridge, after its signal.
+        /// </summary>
+        internal static ModellerArray Read(BinaryReader reader)
+        {
+            var dataType = reader.ReadString();
+            var shape = new int[reader.ReadInt32()];
+            for (int i = 0; i < shape.Length; i++)
+            {
+                shape[i] = reader.ReadInt32();
+            }
+            var length = reader.ReadInt64();
+            if (length > Array.MaxLength)
+            {
+                throw new InvalidDataException($"The array returned from EMME is {length} bytes, which is too large to receive.");
+            }
+            var data = new byte[length];
+            int position = 0;
+            while (position < data.Length)
+            {
+                int read = reader.Read(data, position, data.Length - position);
+                if (read <= 0)
+                {
+                    throw new EndOfStreamException();
+                }
+                position += read;
+            }
+            return new ModellerArray(dataType, shape, data);
+        }
+    }
+}
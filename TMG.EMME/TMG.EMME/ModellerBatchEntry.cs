@@ -0,0 +1,45 @@
+﻿/*
+    Copyright 2022 University of Toronto
+
+    This file is part of TMG.EMME for XTMF2.
+
+    TMG.EMME for XTMF2 is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    TMG.EMME for XTMF2 is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with TMG.EMME for XTMF2.  If not, see <http://www.gnu.org/licenses/>.
+*/
+namespace TMG.Emme
+{
+    /// <summary>
+    /// A tool to run as part of a batch sent to the ModellerBridge.
+    /// </summary>
+    public sealed class ModellerBatchEntry
+    {
+        public string MacroName { get; }
+        public string JsonParameters { get; }
+        public LogbookLevel Level { get; }
+
+        /// <summary>
+        /// The databank whose worker runs the tool when the bridge is a dispatcher,
+        /// or null to use the databank of the surrounding RunOnDatabank call.
+        /// </summary>
+        public string Databank { get; }
+
+        public ModellerBatchEntry(string macroName, string jsonParameters, LogbookLevel level = LogbookLevel.Standard,
+            string databank = null)
+        {
+            MacroName = macroName;
+            JsonParameters = jsonParameters;
+            Level = level;
+            Databank = databank;
+        }
+    }
+}
@@ -0,0 +1,82 @@
+﻿/*
+    Copyright 2022 University of Toronto
+
+    This file is part of TMG.EMME for XTMF2.
+
+    TMG.EMME for XTMF2 is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    TMG.EMME for XTMF2 is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with TMG.EMME for XTMF2.  If not, see <http://www.gnu.org/licenses/>.
+*/
+namespace TMG.Emme
+{
+    /// <summary>
+    /// The outcome of one tool in a batch run by the ModellerBridge.
+    /// </summary>
+    public sealed class ModellerBatchResult
+    {
+        /// <summary>
+        /// The entry that this result is for.
+        /// </summary>
+        public ModellerBatchEntry Entry { get; }
+
+        /// <summary>
+        /// True if the tool ran to completion.
+        /// </summary>
+        public bool Succeeded { get; }
+
+        /// <summary>
+        /// True if the tool was not run because an earlier tool in the batch failed.
+        /// </summary>
+        public bool Skipped { get; }
+
+        /// <summary>
+        /// The value returned by the tool as a string, if any.
+        /// </summary>
+        public string ReturnValue { get; }
+
+        /// <summary>
+        /// The numeric array returned by the tool, if any.
+        /// </summary>
+        public ModellerArray ReturnArray { get; }
+
+        /// <summary>
+        /// The error reported by the bridge if the tool failed.
+        /// </summary>
+        public string Error { get; }
+
+        private ModellerBatchResult(ModellerBatchEntry entry, bool succeeded, bool skipped, string returnValue,
+            ModellerArray returnArray, string error)
+        {
+            Entry = entry;
+            Succeeded = succeeded;
+            Skipped = skipped;
+            ReturnValue = returnValue;
+            ReturnArray = returnArray;
+            Error = error;
+        }
+
+        internal static ModellerBatchResult Success(ModellerBatchEntry entry, string returnValue = null, ModellerArray returnArray = null)
+        {
+            return new ModellerBatchResult(entry, true, false, returnValue, returnArray, null);
+        }
+
+        internal static ModellerBatchResult Failure(ModellerBatchEntry entry, string error)
+        {
+            return new ModellerBatchResult(entry, false, false, null, null, error);
+        }
+
+        internal static ModellerBatchResult NotRun(ModellerBatchEntry entry)
+        {
+            return new ModellerBatchResult(entry, false, true, null, null, null);
+        }
+    }
+}
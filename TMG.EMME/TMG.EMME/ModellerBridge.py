@@ -22,9 +22,7 @@ import os
 import glob
 import time
 import math
-import array
 import inspect
-import six
 import timeit
 import traceback as _traceback
 from inro.emme.desktop import app as _app
@@ -34,13 +32,21 @@ from threading import Thread
 import threading
 import time
 from contextlib import contextmanager
+from collections import OrderedDict
 import json
+import numpy as _np
+from ModellerTransport import PipeTransport
+from ModellerProfiler import ToolProfiler, ToolTimings
 
 class ProgressTimer(Thread):
     def __init__(self, delegateFunction, XtmfBridge):
         self._stopped = False
         self.delegateFunction = delegateFunction
         self.bridge = XtmfBridge
+        # The last progress sent to XTMF and when, and a newer value waiting on the minimum interval
+        self._lastSent = None
+        self._lastSentTime = 0.0
+        self._pending = None
         Thread.__init__(self)
         self.run = self._run
     
@@ -48,11 +54,35 @@ class ProgressTimer(Thread):
         while not self._stopped:
             progressTuple = self.delegateFunction()
             if progressTuple is not None and progressTuple[2] is not None:
-                self.bridge.ReportProgress((float(progressTuple[2]) - progressTuple[0]) / (progressTuple[1] - progressTuple[0]))
+                self._update((float(progressTuple[2]) - progressTuple[0]) / (progressTuple[1] - progressTuple[0]))
             time.sleep(0.01667)
+        # Make sure XTMF sees the last progress the tool reached
+        if self._pending is not None:
+            self._send(self._pending)
     
+    def _update(self, progress):
+        counters = self.bridge.MessageCounters
+        if progress == self._lastSent:
+            self._pending = None
+            counters["progress_suppressed"] += 1
+        elif time.time() - self._lastSentTime < self.bridge.ProgressMinimumInterval:
+            self._pending = progress
+            counters["progress_suppressed"] += 1
+        else:
+            self._send(progress)
+
+    def _send(self, progress):
+        self.bridge.ReportProgress(progress)
+        self.bridge.MessageCounters["progress_sent"] += 1
+        self._lastSent = progress
+        self._lastSentTime = time.time()
+        self._pending = None
+
     def stop(self):
         self._stopped = True
+        # Wait for the final report so it can not arrive after the tool's result
+        if self.is_alive():
+            self.join()
 
 # A Stream that does nothing
 class NullStream:
@@ -63,16 +93,55 @@ class NullStream:
      def write(self, data): 
          pass
 
-# A Stream which redirects print statements to XTMF Console
+# A Stream which redirects print statements to XTMF Console, sending them in batches
 class RedirectToXTMFConsole:
     def __init__(self, xtmfBridge):
         self.bridge = xtmfBridge
+        self._buffer = []
+        self._bufferedSize = 0
+        self._bufferedLines = 0
+        self._lock = threading.Lock()
+        flusher = Thread(target=self._flushPeriodically)
+        flusher.daemon = True
+        flusher.start()
     
     def write(self, data):
-        self.bridge.SendPrintSignal(str(data))
+        data = str(data)
+        if len(data) == 0:
+            return
+        self._lock.acquire()
+        try:
+            self.bridge.MessageCounters["console_writes"] += 1
+            self._buffer.append(data)
+            self._bufferedSize += len(data)
+            self._bufferedLines += data.count('\n')
+            if (self._bufferedSize >= self.bridge.ConsoleMaxBatchSize
+                    or self._bufferedLines >= self.bridge.ConsoleMaxBatchLines):
+                self._flush()
+        finally:
+            self._lock.release()
 
     def flush(self):
-        pass
+        self._lock.acquire()
+        try:
+            self._flush()
+        finally:
+            self._lock.release()
+
+    def _flush(self):
+        if len(self._buffer) == 0:
+            return
+        text = ''.join(self._buffer)
+        self._buffer = []
+        self._bufferedSize = 0
+        self._bufferedLines = 0
+        self.bridge.MessageCounters["console_messages"] += 1
+        self.bridge.SendPrintSignal(text)
+
+    def _flushPeriodically(self):
+        while True:
+            time.sleep(self.bridge.ConsoleFlushInterval)
+            self.flush()
 
 def RedirectLogbookWrite(name, attributes=None, value=None):
     pass
@@ -123,11 +192,40 @@ class XTMFBridge:
     SignalStartModuleBinaryParameters = 14
     """Signal to XTMF saying that the current tool is not compatible with XTMF2"""
     SignalIncompatibleTool = 15
+    """Tell XTMF that we have successfully ran the requested tool and are returning a numeric array"""
+    SignalRunCompleteWithArray = 16
+    """XTMF is sending a list of tools to run back to back"""
+    SignalStartBatch = 17
+    """Tell XTMF that every result for the batch of tools has been sent"""
+    SignalBatchComplete = 18
+
+    """The number of constructed tools to keep for reuse, only tools that set reusable = True are kept"""
+    ToolCacheSize = 32
+    """The minimum number of seconds between progress reports, overridden by XTMF_BRIDGE_PROGRESS_INTERVAL"""
+    ProgressMinimumInterval = 0.1
+    """The number of seconds between flushes of buffered console output, overridden by XTMF_BRIDGE_CONSOLE_INTERVAL"""
+    ConsoleFlushInterval = 0.25
+    """Buffered console output is sent as soon as it reaches this many characters or lines"""
+    ConsoleMaxBatchSize = 16384
+    ConsoleMaxBatchLines = 200
         
     """Initialize the bridge so that the tools that we run will not accidentally access the standard I/O"""
     def __init__(self, databank, TheEmmeEnvironmentXMTF):
         self.CachedLogbookWrite = _m.logbook_write
         self.CachedLogbookTrace = _m.logbook_trace
+        self.PerformanceMode = False
+        # Tool namespaces are only requested from Modeller again when a lookup misses
+        self.ToolNamespaces = None
+        # Constructed tools that opted in to reuse by namespace, least recently used first
+        self.ToolCache = OrderedDict()
+        self.CallMetrics = {"calls": 0, "namespace_misses": 0, "tool_cache_hits": 0,
+                            "tool_cache_misses": 0, "overhead_seconds": 0.0}
+        self.MessageCounters = {"progress_sent": 0, "progress_suppressed": 0,
+                                "console_writes": 0, "console_messages": 0}
+        # In performance mode tools can also be profiled, writing their profiles to this directory
+        self.Timings = ToolTimings()
+        self.ProfileDirectory = os.environ.get("XTMF_BRIDGE_PROFILE_DIRECTORY")
+        self.Profiler = None
         
         # Redirect sys.stdout
         sys.stdin.close()
@@ -139,109 +237,109 @@ class XTMFBridge:
                 self.SwitchToDatabank(TheEmmeEnvironmentXMTF, databank)
             self.Modeller = inro.modeller.Modeller(TheEmmeEnvironmentXMTF)
             _m.logbook_write("Activated modeller from ModellerBridge for XTMF")
+            # The environment settings are read once Modeller is up so that bad values can be reported
+            self.ProgressMinimumInterval = self.ReadEnvironmentFloat("XTMF_BRIDGE_PROGRESS_INTERVAL",
+                                                                     self.ProgressMinimumInterval)
+            self.ConsoleFlushInterval = self.ReadEnvironmentFloat("XTMF_BRIDGE_CONSOLE_INTERVAL",
+                                                                  self.ConsoleFlushInterval)
+            if self.ProfileDirectory:
+                self.Profiler = self.CreateProfiler()
         except:
             #Terminate the bridge if we are unable to
             terminate = True
 
-        self.XTMFPipe = open('\\\\.\\pipe\\' + pipeName, 'w+b', 0)
+        self.Transport = PipeTransport.connect(pipeName)
         #sys.stdout = NullStream()
         self.IOLock = threading.Lock()
         sys.stdin = None
-        sys.stdout = RedirectToXTMFConsole(self)
+        self.Console = RedirectToXTMFConsole(self)
+        sys.stdout = self.Console
         if terminate:
             exit(-1)
         return
           
     def ReadString(self):
-        length = self.ReadInt()
-        try:
-            stringArray = array.array('u')
-            stringArray.fromfile(self.XTMFPipe, length)
-            return str(stringArray.tounicode()) 
-        except:
-            return str(stringArray.tounicode())
+        return self.Transport.read_string()
 
     def ReadInt(self):
-        intArray = array.array('l')
-        intArray.fromfile(self.XTMFPipe, 1)
-        return intArray.pop()
+        return self.Transport.read_int()
     
     def IsWhitespace(self, c):
         return (c == ' ') or (c == '\t') or (c == '\s')
     
     def CreateTool(self, toolName):
-        return self.Modeller.tool(toolName)
+        tool = self.ToolCache.pop(toolName, None)
+        if tool is None:
+            self.CallMetrics["tool_cache_misses"] += 1
+            tool = self.Modeller.tool(toolName)
+            # Most tools keep per-run state on the instance, so only those that declare otherwise are reused
+            if not getattr(tool, "reusable", False):
+                return tool
+            if len(self.ToolCache) >= self.ToolCacheSize:
+                self.ToolCache.popitem(last=False)
+        else:
+            self.CallMetrics["tool_cache_hits"] += 1
+        self.ToolCache[toolName] = tool
+        return tool
+
+    def ToolNamespaceExists(self, namespace):
+        if self.ToolNamespaces is not None and namespace in self.ToolNamespaces:
+            return True
+        self.CallMetrics["namespace_misses"] += 1
+        self.ToolNamespaces = set(self.Modeller.tool_namespaces())
+        return namespace in self.ToolNamespaces
     
     def SendString(self, stringToSend):
-        msg = array.array('u', six.text_type(stringToSend))
-        length = len(msg) * msg.itemsize
-        tempLength = length
-        bytes = 0
-        #figure out how many bytes we are going to need to store the length
-        #string
-        while tempLength > 0:
-            tempLength = tempLength >> 7
-            bytes += 1
-        lengthArray = array.array('B')
-        if length <= 0:
-            lengthArray.append(0)
-        else:
-            tempLength = length
-            for i in range(bytes):
-                current = int(tempLength >> 7)
-                current = int(current << 7)
-                diff = tempLength - current
-                if tempLength < 128:
-                    lengthArray.append(diff)
-                else:
-                    lengthArray.append(diff + 128)
-                tempLength = tempLength >> 7
-        lengthArray.tofile(self.XTMFPipe)
-        msg.tofile(self.XTMFPipe)
+        self.Transport.send_string(None, stringToSend)
         return
     
     def SendToolDoesNotExistError(self, namespace):
         self.IOLock.acquire()
-        self.SendSignal(self.SignalSendToolDoesNotExistsError)
-        self.SendString("A tool with the following namespace could not be found: %s" % namespace)
+        self.Transport.send_string(self.SignalSendToolDoesNotExistsError, "A tool with the following namespace could not be found: %s" % namespace)
         self.IOLock.release()
         return
 
     def SendIncompatibleTool(self, namespace):
         self.IOLock.acquire()
-        self.SendSignal(self.SignalIncompatibleTool)
-        self.SendString("The tool with the following namespace did not have an entry point for XTMF2: %s" % namespace)
+        self.Transport.send_string(self.SignalIncompatibleTool, "The tool with the following namespace did not have an entry point for XTMF2: %s" % namespace)
         self.IOLock.release()
 
     def SendParameterError(self, problem):
         self.IOLock.acquire()
-        self.SendSignal(self.SignalParameterError)
-        self.SendString(problem)
+        self.Transport.send_string(self.SignalParameterError, problem)
         self.IOLock.release()
         return
         
     def SendRuntimeError(self, problem):
         self.IOLock.acquire()
-        self.SendSignal(self.SignalRuntimeError)
-        self.SendString(problem)
+        self.Transport.send_string(self.SignalRuntimeError, problem)
         self.IOLock.release()
         return
     
     def SendSuccess(self):
         self.IOLock.acquire()
-        intArray = array.array('l')
-        intArray.append(self.SignalRunComplete)
-        intArray.tofile(self.XTMFPipe)
+        self.Transport.send_signal(self.SignalRunComplete)
         self.IOLock.release()
         return
     
     def SendReturnSuccess(self, returnValue):
         self.IOLock.acquire()
-        self.SendSignal(self.SignalRunCompleteWithParameter)
-        self.SendString(str(returnValue))
+        self.Transport.send_string(self.SignalRunCompleteWithParameter, str(returnValue))
         self.IOLock.release()
         return
 
+    def SendArrayReturnSuccess(self, returnArray):
+        returnArray = _np.ascontiguousarray(returnArray)
+        if returnArray.dtype.byteorder == '>':
+            returnArray = returnArray.astype(returnArray.dtype.newbyteorder('<'))
+        self.IOLock.acquire()
+        try:
+            self.Transport.send_array(self.SignalRunCompleteWithArray, returnArray.dtype.str,
+                                      returnArray.shape, returnArray)
+        finally:
+            self.IOLock.release()
+        return
+
     def SignalToolExists(self):
         self.IOLock.acquire()
         self.SendSignal(self.SignalCheckToolExists)
@@ -249,30 +347,24 @@ class XTMFBridge:
         return
     
     def SendSignal(self, signal):
-        intArray = array.array('l')
-        intArray.append(signal)
-        intArray.tofile(self.XTMFPipe)
+        self.Transport.send_signal(signal)
         return
     
     def SendPrintSignal(self, stringToPrint):
         self.IOLock.acquire()
-        self.SendSignal(self.SignalSendPrintMessage)
-        self.SendString(stringToPrint)
+        self.Transport.send_string(self.SignalSendPrintMessage, stringToPrint)
         self.IOLock.release()
         return
 
     def ReportProgress(self, progress):
         self.IOLock.acquire()
-        self.SendSignal(self.SignalProgressReport)
-        floatArray = array.array('f')
-        floatArray.append(float(progress))
-        floatArray.tofile(self.XTMFPipe)
+        self.Transport.send_float(self.SignalProgressReport, progress)
         self.IOLock.release()   
         return
 
     def EnsureModellerToolExists(self, macroName):
         for i in range(1, 10):
-            if macroName in self.Modeller.tool_namespaces():       
+            if self.ToolNamespaceExists(macroName):
                 return True
             time.sleep(1)
         _m.logbook_write("A tool with the following namespace could not be found: %s" % macroName)
@@ -280,23 +372,43 @@ class XTMFBridge:
         return False
     
     def ExecuteModule(self):
-        macroName = None
-        parameterString = None
+        macroName = self.ReadString()
+        parameterString = self.ReadString()
+        logbook_level = self.ReadString()
+        self.RunModule(macroName, parameterString, logbook_level, True)
+        return
+
+    def ExecuteBatch(self):
+        entryCount = self.ReadInt()
+        stopOnError = self.ReadInt() != 0
+        # Read the whole plan before running anything so XTMF is free to wait on the results
+        entries = [(self.ReadString(), self.ReadString(), self.ReadString()) for i in range(entryCount)]
+        for macroName, parameterString, logbook_level in entries:
+            if not self.RunModule(macroName, parameterString, logbook_level, False) and stopOnError:
+                break
+        self.IOLock.acquire()
+        self.SendSignal(self.SignalBatchComplete)
+        self.IOLock.release()
+        return
+
+    def RunModule(self, macroName, parameterString, logbook_level, signalToolExists):
+        """Run a tool, sending XTMF its result. Returns False if the tool could not be run or failed."""
         timer = None
         # run the module here
         try:
-            #figure out how long the macro's name is
-            macroName = self.ReadString()
-            parameterString = self.ReadString()
-            logbook_level = self.ReadString()
+            callStart = timeit.default_timer()
             if not self.EnsureModellerToolExists(macroName):
-                return
-            self.SignalToolExists()
+                return False
+            if signalToolExists:
+                self.SignalToolExists()
+            lookupSeconds = timeit.default_timer() - callStart
 
+            createStart = timeit.default_timer()
             tool = self.CreateTool(macroName)
+            createSeconds = timeit.default_timer() - createStart
             if 'run_xtmf' not in dir(tool):
                 self.SendIncompatibleTool(macroName)
-                return
+                return False
             nameSpace = {'tool':tool, 'parameters':json.loads(parameterString)}
             callString = 'tool.run_xtmf(parameters)'
             
@@ -316,23 +428,37 @@ class XTMFBridge:
             else:
                 # Enable everything for debugging
                 _m.logbook_level(_m.LogbookLevel.TRACE | _m.LogbookLevel.LOG | _m.LogbookLevel.COOKIE | _m.LogbookLevel.ATTRIBUTE | _m.LogbookLevel.VALUE)
+            runStart = timeit.default_timer()
             try:
-                ret = eval(callString, nameSpace, None)
+                with self.ProfileTool(macroName):
+                    ret = eval(callString, nameSpace, None)
             finally:
                 _m.logbook_level(previous_logbook_level)
+            runSeconds = timeit.default_timer() - runStart
             
             if timer != None:
                 timer.stop()
             
             nameSpace = None
-            if ret == None: 
+            # Anything the tool printed needs to reach XTMF before its result
+            self.Console.flush()
+            if ret is None: 
                 self.SendSuccess()
+            elif isinstance(ret, _np.ndarray):
+                self.SendArrayReturnSuccess(ret)
             else:
                 self.SendReturnSuccess(ret)
+            if self.PerformanceMode:
+                self.RecordCallMetrics(macroName, lookupSeconds, createSeconds, runSeconds,
+                                       timeit.default_timer() - callStart)
+            return True
         except Exception as inst:
             if timer != None:
                 timer.stop()
-            _m.logbook_write("We are in the exception code for ExecuteModule")
+            # Do not reuse a tool that failed part way through a run
+            if macroName != None:
+                self.ToolCache.pop(macroName, None)
+            _m.logbook_write("We are in the exception code for RunModule")
             if(macroName != None):
                 _m.logbook_write("Macro Name: " + macroName)
             else:
@@ -350,9 +476,10 @@ class XTMFBridge:
             stackList.reverse()
             for file, line, func, text in stackList:
                 msg += "\n  File '%s', line %s, in %s" % (file, line, func)
+            self.Console.flush()
             self.SendRuntimeError(msg)
             print (msg)
-        return
+        return False
 
     def SwitchToDatabank(self, emmeApplication, databankName):
         databankName = databankName.lower()
@@ -362,43 +489,113 @@ class XTMFBridge:
                 return
         self.SendRuntimeError("The databank " + databankName + " does not exist!")
     
+    @contextmanager
+    def ProfileTool(self, macroName):
+        if self.PerformanceMode and self.Profiler is not None:
+            with self.Profiler.profile(macroName):
+                yield
+        else:
+            yield
+
+    def RecordCallMetrics(self, macroName, lookupSeconds, createSeconds, runSeconds, totalSeconds):
+        overhead = totalSeconds - runSeconds
+        self.Timings.record(macroName, runSeconds)
+        self.CallMetrics["calls"] += 1
+        self.CallMetrics["overhead_seconds"] += overhead
+        _m.logbook_write("%s: %.4f seconds to run, %.4f seconds of bridge overhead "
+                         "(lookup %.4f, tool creation %.4f)"
+                         % (macroName, runSeconds, overhead, lookupSeconds, createSeconds))
+        _m.logbook_write("Bridge totals: %(calls)d calls, %(overhead_seconds).3f seconds overhead, "
+                         "%(namespace_misses)d namespace refreshes, tool cache %(tool_cache_hits)d hits / "
+                         "%(tool_cache_misses)d misses" % self.CallMetrics)
+        self.LogMessageCounters()
+
+    def LogMessageCounters(self):
+        counters = self.MessageCounters
+        _m.logbook_write("Bridge messages: %d progress reports sent, %d suppressed; %d console writes sent as %d messages, %d suppressed"
+                         % (counters["progress_sent"], counters["progress_suppressed"], counters["console_writes"],
+                            counters["console_messages"], counters["console_writes"] - counters["console_messages"]))
+
     def Run(self, performanceMode):
         _m.logbook_write("Activated modeller from ModellerBridge for XTMF")
+        self.PerformanceMode = performanceMode
         if performanceMode:
             _m.logbook_write("Performance Testing Activated")
+        self.ToolNamespaces = set(self.Modeller.tool_namespaces())
         exit = False
         self.SendSignal(self.SignalStart)
         while(not exit):
             input = self.ReadInt()
             if input == self.SignalTermination:
                 _m.logbook_write("Exiting on termination signal from XTMF")
+                self.LogMessageCounters()
+                if self.PerformanceMode:
+                    self.DumpTimings()
                 exit = True
             elif input == self.SignalStartModule:
                 exit = True
                 self.SendSignal(self.SignalTermination)
             elif input == self.SignalStartModuleBinaryParameters:
-                if performanceMode:
-                    t = timeit.Timer(self.ExecuteModule).timeit(1)
-                    _m.logbook_write(str(t) + " seconds to execute.")
-                else:
-                    self.ExecuteModule()
+                self.ExecuteModule()
             elif input == self.SignalCheckToolExists:
                 self.CheckToolExists()
+            elif input == self.SignalStartBatch:
+                self.ExecuteBatch()
             else:
                 #If we do not understand what XTMF is saying quietly die
                 exit = True
                 _m.logbook_write("Exiting on bad input \"" + input + "\"")
                 self.SendSignal(self.SignalTermination)
+        self.ClearScratchPool()
         return
 
+    def ClearScratchPool(self):
+        # The toolbox keeps idle scratch matrices in the databank for reuse until the bridge exits
+        try:
+            self.Modeller.module("tmg2.utilities.general_utilities").SCRATCH_POOL.clear()
+        except Exception:
+            _m.logbook_write("Unable to delete the idle scratch matrices: " + _traceback.format_exc())
+
+    def DumpTimings(self):
+        summary = self.Timings.summary()
+        with _m.logbook_trace("Tool run times"):
+            for namespace in sorted(summary):
+                timing = summary[namespace]
+                _m.logbook_write("%s: %d runs, p50 %.3fs, p95 %.3fs, max %.3fs"
+                                 % (namespace, timing["count"], timing["p50"], timing["p95"], timing["max"]))
+        if self.ProfileDirectory:
+            if not os.path.isdir(self.ProfileDirectory):
+                os.makedirs(self.ProfileDirectory)
+            with open(os.path.join(self.ProfileDirectory, "tool_timings.json"), "w") as timingFile:
+                json.dump(summary, timingFile, indent=2, sort_keys=True)
+
     def CheckToolExists(self):
         ns = self.ReadString()
-        ret = ns in self.Modeller.tool_namespaces()
+        ret = self.ToolNamespaceExists(ns)
         if ret == False:
             _m.logbook_write("Unable to find a tool named " + ns)
         self.SendReturnSuccess(ret)
         return
     
+    def ReadEnvironmentFloat(self, name, default):
+        value = os.environ.get(name)
+        if value is None:
+            return default
+        try:
+            return float(value)
+        except ValueError:
+            _m.logbook_write("Ignoring %s, '%s' is not a number. Using %s instead." % (name, value, default))
+            return default
+
+    def CreateProfiler(self):
+        mode = os.environ.get("XTMF_BRIDGE_PROFILER", "cprofile").strip().lower()
+        if mode not in ToolProfiler.MODES:
+            _m.logbook_write("Unknown XTMF_BRIDGE_PROFILER mode '%s', expected one of %s. Using cprofile instead."
+                             % (mode, ", ".join(ToolProfiler.MODES)))
+            mode = "cprofile"
+        return ToolProfiler(self.ProfileDirectory, mode,
+                            os.environ.get("XTMF_BRIDGE_PROFILE_TOOLS", "").split(","))
+
     def DisableLogbook(self):
         _m.logbook_write = RedirectLogbookWrite
         _m.logbook_trace = RedirectLogbookTrace
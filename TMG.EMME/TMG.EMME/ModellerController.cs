@@ -17,11 +17,13 @@
     along with TMG.EMME for XTMF2.  If not, see <http://www.gnu.org/licenses/>.
 */
 using System;
+using System.Collections.Generic;
 using System.Diagnostics;
 using System.IO;
 using System.IO.Pipes;
 using System.Reflection;
 using System.Text;
+using System.Text.Json.Nodes;
 using System.Threading;
 using System.Threading.Tasks;
 using XTMF2;
@@ -37,6 +39,12 @@ namespace TMG.Emme
         private Process _emme;
         private NamedPipeServerStream _emmePipe;
 
+        /// <summary>
+        /// The databank that tools run from the current flow of execution are sent to
+        /// when the bridge is a dispatcher with worker databanks.
+        /// </summary>
+        private readonly AsyncLocal<string> _targetDatabank = new AsyncLocal<string>();
+
         #region SignalCodes
 
         /// <summary>
@@ -104,11 +112,26 @@ namespace TMG.Emme
         /// </summary>
         private const int SignalIncompatibleTool = 15;
 
+        /// <summary>
+        /// We receive this when the Bridge has completed its module run and is returning a numeric array
+        /// </summary>
+        private const int SignalRunCompleteWithArray = 16;
+
+        /// <summary>
+        /// We will send this signal to run a list of tools back to back
+        /// </summary>
+        private const int SignalStartBatch = 17;
+
+        /// <summary>
+        /// We receive this once the bridge has sent the results for every tool in a batch that it ran
+        /// </summary>
+        private const int SignalBatchComplete = 18;
+
         #endregion
 
         public ModellerController(IModule caller, string projectFile, string pipeName,
             bool performanceAnalysis = false, string userInitials = "XTMF", bool launchInNewProcess = true, 
-            string databank = null, string emmePath = null)
+            string databank = null, string emmePath = null, string profileDirectory = null, string[] workerDatabanks = null)
         {
             if (!projectFile.EndsWith(".emp") | !File.Exists(projectFile))
             {
@@ -137,7 +160,10 @@ namespace TMG.Emme
             // The Entry assembly will be the XTMF.GUI or XTMF.RemoteClient
             var codeBase = typeof(ModellerController).GetTypeInfo().Assembly.Location;
             // When EMME is installed it will link the .py to their python interpreter properly
-            string argumentString = AddQuotes(Path.Combine(Path.GetDirectoryName(codeBase), "ModellerBridge.py"));
+            // With worker databanks a dispatcher runs one bridge per databank in parallel behind this pipe
+            bool useDispatcher = workerDatabanks != null && workerDatabanks.Length > 0;
+            string argumentString = AddQuotes(Path.Combine(Path.GetDirectoryName(codeBase),
+                useDispatcher ? "ModellerDispatcher.py" : "ModellerBridge.py"));
             _emmePipe = new NamedPipeServerStream(pipeName, PipeDirection.InOut, 1, PipeTransmissionMode.Byte, PipeOptions.Asynchronous);
             try
             {
@@ -152,7 +178,11 @@ namespace TMG.Emme
                {
                    //The first argument that gets passed into the Bridge is the name of the Emme project file
                    argumentString += " " + AddQuotes(projectFile) + " " + userInitials + " " + (performanceAnalysis ? 1 : 0) + " \"" + pipeName + "\"";
-                   if (!String.IsNullOrWhiteSpace(databank))
+                   if (useDispatcher)
+                   {
+                       argumentString += " " + AddQuotes(String.Join(",", workerDatabanks));
+                   }
+                   else if (!String.IsNullOrWhiteSpace(databank))
                    {
                        argumentString += " " + AddQuotes(databank);
                    }
@@ -164,6 +194,11 @@ namespace TMG.Emme
                        _emme = new Process();
                        var startInfo = new ProcessStartInfo(pythonPath, argumentString);
                        startInfo.Environment["PATH"] += ";" + pythonLib + ";" + Path.Combine(emmePath, "programs");
+                       if (performanceAnalysis && !String.IsNullOrWhiteSpace(profileDirectory))
+                       {
+                           // The bridge writes a profile of each tool run into this directory
+                           startInfo.Environment["XTMF_BRIDGE_PROFILE_DIRECTORY"] = Path.GetFullPath(profileDirectory);
+                       }
                        _emme.StartInfo = startInfo;
                        _emme.StartInfo.CreateNoWindow = false;
                        _emme.StartInfo.UseShellExecute = false;
@@ -203,7 +238,7 @@ namespace TMG.Emme
             Dispose(false);
         }
 
-        private bool WaitForEmmeResponce(IModule caller, ref string returnValue, Action<float> updateProgress)
+        private bool WaitForEmmeResponce(IModule caller, ref string returnValue, ref ModellerArray returnArray, Action<float> updateProgress)
         {
             // now we need to wait
             try
@@ -228,6 +263,11 @@ namespace TMG.Emme
                                 returnValue = reader.ReadString();
                                 return true;
                             }
+                        case SignalRunCompleteWithArray:
+                            {
+                                returnArray = ModellerArray.Read(reader);
+                                return true;
+                            }
                         case SignalTermination:
                             {
                                 throw new XTMFRuntimeException(caller, "The EMME ModellerBridge panicked and unexpectedly shutdown.");
@@ -304,6 +344,23 @@ namespace TMG.Emme
         }
 
         public bool Run(IModule caller, string macroName, string jsonParameters, LogbookLevel level, Action<float> progressUpdate, ref string returnValue)
+        {
+            ModellerArray unused = null;
+            return Run(caller, macroName, jsonParameters, level, progressUpdate, ref returnValue, ref unused);
+        }
+
+        /// <summary>
+        /// Run a tool that returns a numeric array, such as a matrix, directly over the pipe.
+        /// </summary>
+        /// <param name="returnArray">The array returned by the tool, or null if it did not return one.</param>
+        public bool Run(IModule caller, string macroName, string jsonParameters, LogbookLevel level, Action<float> progressUpdate, ref ModellerArray returnArray)
+        {
+            string unused = null;
+            return Run(caller, macroName, jsonParameters, level, progressUpdate, ref unused, ref returnArray);
+        }
+
+        private bool Run(IModule caller, string macroName, string jsonParameters, LogbookLevel level, Action<float> progressUpdate,
+            ref string returnValue, ref ModellerArray returnArray)
         {
             lock (this)
             {
@@ -313,29 +370,10 @@ namespace TMG.Emme
                     // clear out all of the old input before starting
                     using var writer = new BinaryWriter(_emmePipe, Encoding.Unicode, true);
                     writer.Write(SignalStartModuleBinaryParameters);
-                    writer.Write(macroName.Length);
-                    writer.Write(macroName.ToCharArray());
-                    if (jsonParameters == null)
-                    {
-                        writer.Write((int)0);
-                    }
-                    else
-                    {
-                        writer.Write(jsonParameters.Length);
-                        writer.Write(jsonParameters.ToCharArray());
-                    }
-                    var logbookLevel = level switch
-                    {
-                        LogbookLevel.Standard => LogbookStandard,
-                        LogbookLevel.Debug => LogbookDebug,
-                        LogbookLevel.None => LogbookNone,
-                        _ => LogbookStandard
-                    };
-                    writer.Write(logbookLevel.Length);
-                    writer.Write(logbookLevel);
+                    WriteToolRequest(writer, macroName, jsonParameters, level, _targetDatabank.Value);
                     writer.Flush();
                     // make sure the tool exists before continuing
-                    if (!WaitForEmmeResponce(caller, ref returnValue, progressUpdate))
+                    if (!WaitForEmmeResponce(caller, ref returnValue, ref returnArray, progressUpdate))
                     {
                         // if the tool does not exist, we have failed!
                         return false;
@@ -345,10 +383,187 @@ namespace TMG.Emme
                 {
                     throw new XTMFRuntimeException(caller, "I/O Connection with EMME while sending data, with:\r\n" + e.Message);
                 }
-                return WaitForEmmeResponce(caller, ref returnValue, progressUpdate);
+                return WaitForEmmeResponce(caller, ref returnValue, ref returnArray, progressUpdate);
             }
         }
 
+        /// <summary>
+        /// Run a list of tools back to back with a single request to the bridge.
+        /// Failures are reported in the results instead of being thrown.
+        /// </summary>
+        /// <param name="caller">The module requesting the tools be run.</param>
+        /// <param name="entries">The tools to run, in order.</param>
+        /// <param name="stopOnError">If true, the tools after the first failure are skipped.</param>
+        /// <param name="progressUpdate">Receives the progress of the tool that is currently running.</param>
+        /// <returns>One result for each entry, in the same order.</returns>
+        public IReadOnlyList<ModellerBatchResult> RunBatch(IModule caller, IReadOnlyList<ModellerBatchEntry> entries, bool stopOnError,
+            Action<float> progressUpdate = null)
+        {
+            lock (this)
+            {
+                var results = new List<ModellerBatchResult>(entries.Count);
+                try
+                {
+                    EnsureWriteAvailable(caller);
+                    using (var writer = new BinaryWriter(_emmePipe, Encoding.Unicode, true))
+                    {
+                        writer.Write(SignalStartBatch);
+                        writer.Write(entries.Count);
+                        writer.Write(stopOnError ? 1 : 0);
+                        foreach (var entry in entries)
+                        {
+                            WriteToolRequest(writer, entry.MacroName, entry.JsonParameters, entry.Level,
+                                entry.Databank ?? _targetDatabank.Value);
+                        }
+                        writer.Flush();
+                    }
+                    using var reader = new BinaryReader(_emmePipe, Encoding.Unicode, true);
+                    while (true)
+                    {
+                        int result = reader.ReadInt32();
+                        switch (result)
+                        {
+                            case SignalStart:
+                                {
+                                    continue;
+                                }
+                            case SignalRunComplete:
+                                {
+                                    results.Add(ModellerBatchResult.Success(entries[results.Count]));
+                                    break;
+                                }
+                            case SignalRunCompleteWithParameter:
+                                {
+                                    results.Add(ModellerBatchResult.Success(entries[results.Count], returnValue: reader.ReadString()));
+                                    break;
+                                }
+                            case SignalRunCompleteWithArray:
+                                {
+                                    results.Add(ModellerBatchResult.Success(entries[results.Count], returnArray: ModellerArray.Read(reader)));
+                                    break;
+                                }
+                            case SignalParameterError:
+                                {
+                                    results.Add(ModellerBatchResult.Failure(entries[results.Count], "EMME Parameter Error: " + reader.ReadString()));
+                                    break;
+                                }
+                            case SignalRuntimeError:
+                                {
+                                    results.Add(ModellerBatchResult.Failure(entries[results.Count], "EMME Runtime " + reader.ReadString()));
+                                    break;
+                                }
+                            case SignalToolDoesNotExistError:
+                            case SignalIncompatibleTool:
+                                {
+                                    results.Add(ModellerBatchResult.Failure(entries[results.Count], reader.ReadString()));
+                                    break;
+                                }
+                            case SignalSentPrintMessage:
+                                {
+                                    Console.Write(reader.ReadString());
+                                    break;
+                                }
+                            case SignalProgressReport:
+                                {
+                                    var progress = reader.ReadSingle();
+                                    progressUpdate?.Invoke(progress);
+                                    break;
+                                }
+                            case SignalBatchComplete:
+                                {
+                                    for (int i = results.Count; i < entries.Count; i++)
+                                    {
+                                        results.Add(ModellerBatchResult.NotRun(entries[i]));
+                                    }
+                                    return results;
+                                }
+                            case SignalTermination:
+                                {
+                                    throw new XTMFRuntimeException(caller, "The EMME ModellerBridge panicked and unexpectedly shutdown.");
+                                }
+                            default:
+                                {
+                                    throw new XTMFRuntimeException(caller, "Unknown message passed back from the EMME ModellerBridge.  Signal number " + result);
+                                }
+                        }
+                    }
+                }
+                catch (EndOfStreamException)
+                {
+                    throw new XTMFRuntimeException(caller, "We were unable to communicate with EMME.  Please make sure you have an active EMME license.  If the problem persists, sometimes rebooting has helped fix this issue with EMME.");
+                }
+                catch (IOException e)
+                {
+                    throw new XTMFRuntimeException(caller, "I/O Connection with EMME ended while running a batch of tools, with:\r\n" + e.Message);
+                }
+            }
+        }
+
+        /// <summary>
+        /// Run the given action with every tool it runs sent to the worker holding the databank.
+        /// This only changes where tools run when the controller was started with worker databanks.
+        /// </summary>
+        /// <param name="databank">The databank to run the tools on, or null for the first worker.</param>
+        /// <param name="action">The action that runs the tools.</param>
+        public void RunOnDatabank(string databank, Action action)
+        {
+            var previous = _targetDatabank.Value;
+            _targetDatabank.Value = String.IsNullOrWhiteSpace(databank) ? null : databank;
+            try
+            {
+                action();
+            }
+            finally
+            {
+                _targetDatabank.Value = previous;
+            }
+        }
+
+        /// <summary>
+        /// Add the databank that the dispatcher routes the tool to into its JSON parameters.
+        /// A databank already in the parameters is kept.
+        /// </summary>
+        private static string AddDatabank(string jsonParameters, string databank)
+        {
+            if (databank == null || jsonParameters == null
+                || !(JsonNode.Parse(jsonParameters) is JsonObject parameters)
+                || parameters.ContainsKey("databank"))
+            {
+                return jsonParameters;
+            }
+            parameters["databank"] = databank;
+            return parameters.ToJsonString();
+        }
+
+        /// <summary>
+        /// Write the name, parameters and logbook level for a tool to run
+        /// </summary>
+        private static void WriteToolRequest(BinaryWriter writer, string macroName, string jsonParameters, LogbookLevel level,
+            string databank)
+        {
+            jsonParameters = AddDatabank(jsonParameters, databank);
+            writer.Write(macroName.Length);
+            writer.Write(macroName.ToCharArray());
+            if (jsonParameters == null)
+            {
+                writer.Write((int)0);
+            }
+            else
+            {
+                writer.Write(jsonParameters.Length);
+                writer.Write(jsonParameters.ToCharArray());
+            }
+            var logbookLevel = level switch
+            {
+                LogbookLevel.Standard => LogbookStandard,
+                LogbookLevel.Debug => LogbookDebug,
+                LogbookLevel.None => LogbookNone,
+                _ => LogbookStandard
+            };
+            writer.Write(logbookLevel.Length);
+            writer.Write(logbookLevel);
+        }
+
         private string AddQuotes(string fileName)
         {
             return String.Concat("\"", fileName, "\"");
@@ -0,0 +1,407 @@
+'''
+    Copyright 2022 Travel Modelling Group, Department of Civil Engineering, University of Toronto
+
+    This file is part of XTMF.
+
+    XTMF is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    XTMF is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with XTMF.  If not, see <http://www.gnu.org/licenses/>.
+'''
+# Runs several ModellerBridge workers, one for each databank, behind a single XTMF pipe.
+#
+# XTMF talks to the dispatcher exactly as it would to ModellerBridge.py. Each request is
+# routed to the worker that holds the databank named by the tool's "databank" parameter,
+# or to the first worker when the parameter is not given. ModellerController adds that
+# parameter to the tools run inside a "Run On Databank" module or from batch entries
+# that name a databank. Batches that do not stop on
+# errors run in parallel, one worker per databank, while each worker only ever runs one
+# tool at a time. Console output from the workers is prefixed with their databank and
+# their progress reports are merged into one.
+#
+# Workers connect back over a localhost socket, so the dispatcher can be exercised
+# against stub workers that speak the bridge protocol without Emme. A worker that exits
+# or does not connect within the connect timeout stops the dispatcher from starting.
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from ModellerTransport import PipeTransport
+
+# Signal numbers, matching ModellerBridge.py and ModellerController.cs
+SignalStart = 0
+SignalTermination = 1
+SignalRunComplete = 3
+SignalParameterError = 4
+SignalRuntimeError = 5
+SignalProgressReport = 7
+SignalRunCompleteWithParameter = 8
+SignalCheckToolExists = 9
+SignalSendToolDoesNotExistsError = 10
+SignalSendPrintMessage = 11
+SignalStartModuleBinaryParameters = 14
+SignalIncompatibleTool = 15
+SignalRunCompleteWithArray = 16
+SignalStartBatch = 17
+SignalBatchComplete = 18
+
+# Seconds to wait for a worker to connect when XTMF_DISPATCHER_CONNECT_TIMEOUT is not set
+DefaultConnectTimeout = 600.0
+# Seconds between checks that a worker that has not connected yet is still running
+_ACCEPT_POLL_INTERVAL = 0.5
+
+# Messages from a bridge that carry a string
+_STRING_SIGNALS = frozenset([SignalParameterError, SignalRuntimeError, SignalRunCompleteWithParameter,
+                             SignalSendToolDoesNotExistsError, SignalSendPrintMessage, SignalIncompatibleTool])
+# Messages that finish a request to a bridge
+_FINAL_SIGNALS = frozenset([SignalTermination, SignalRunComplete, SignalParameterError, SignalRuntimeError,
+                            SignalRunCompleteWithParameter, SignalSendToolDoesNotExistsError,
+                            SignalIncompatibleTool, SignalRunCompleteWithArray, SignalBatchComplete])
+_SUCCESS_SIGNALS = frozenset([SignalRunComplete, SignalRunCompleteWithParameter, SignalRunCompleteWithArray])
+
+
+def read_message(transport):
+    """Read one message sent by a bridge, returning (signal, payload)."""
+    signal = transport.read_int()
+    if signal in _STRING_SIGNALS:
+        return signal, transport.read_response_string()
+    elif signal == SignalProgressReport:
+        return signal, transport.read_response_float()
+    elif signal == SignalRunCompleteWithArray:
+        return signal, transport.read_response_array()
+    return signal, None
+
+
+def send_message(transport, signal, payload):
+    """Send a message in the form read by read_message."""
+    if signal in _STRING_SIGNALS:
+        transport.send_string(signal, payload)
+    elif signal == SignalProgressReport:
+        transport.send_float(signal, payload)
+    elif signal == SignalRunCompleteWithArray:
+        dtype, shape, data = payload
+        transport.send_array(signal, dtype, shape, data)
+    else:
+        transport.send_signal(signal)
+
+
+def bridge_launcher(project_file, user_initials, performance_mode):
+    """Returns a launcher that starts ModellerBridge.py workers for the given Emme project."""
+    bridge = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ModellerBridge.py")
+
+    def launch(databank, address):
+        return subprocess.Popen([sys.executable, bridge, project_file, user_initials,
+                                 "1" if performance_mode else "0", address, databank])
+    return launch
+
+
+class BridgeWorker(object):
+    """A bridge process that owns one databank. Hold lock while making requests to it."""
+
+    def __init__(self, databank, launcher, connect_timeout=None):
+        self.databank = databank
+        self.lock = threading.Lock()
+        self.at_line_start = True
+        self.process = None
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            listener.bind(("127.0.0.1", 0))
+            listener.listen(1)
+            listener.settimeout(_ACCEPT_POLL_INTERVAL)
+            self.process = launcher(databank, "tcp:127.0.0.1:%d" % listener.getsockname()[1])
+            connection = self._accept(listener, connect_timeout)
+        finally:
+            listener.close()
+        connection.settimeout(None)
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.transport = PipeTransport.from_socket(connection)
+        signal = self.transport.read_int()
+        if signal != SignalStart:
+            raise IOError("The worker for databank '%s' did not start correctly, it sent signal %d"
+                          % (databank, signal))
+
+    def _accept(self, listener, connect_timeout):
+        """
+        Wait for the worker to connect, giving up if its process exits first or
+        connect_timeout seconds pass. A connect_timeout of None waits for as long as
+        the process is running.
+        """
+        start = time.time()
+        while True:
+            try:
+                return listener.accept()[0]
+            except socket.timeout:
+                pass
+            code = self.process.poll() if self.process is not None else None
+            if code is not None:
+                raise IOError("The worker for databank '%s' exited with code %d before connecting"
+                              % (self.databank, code))
+            if connect_timeout is not None and time.time() - start >= connect_timeout:
+                if self.process is not None:
+                    self.process.kill()
+                    self.process.wait()
+                raise IOError("The worker for databank '%s' did not connect within %g seconds"
+                              % (self.databank, connect_timeout))
+
+    def request(self, signal, ints, strings, on_message):
+        """
+        Send a request and pass every message of the reply to on_message until
+        the final one, which is returned as (signal, payload).
+        """
+        if signal is not None:
+            self.transport.send_signal(signal)
+        for value in ints:
+            self.transport.send_signal(value)
+        self.transport.send_request_strings(None, strings)
+        return self.read_until_final(on_message)
+
+    def read_until_final(self, on_message):
+        while True:
+            message = read_message(self.transport)
+            if message[0] in _FINAL_SIGNALS:
+                return message
+            on_message(self, message)
+
+    def close(self):
+        try:
+            self.transport.send_signal(SignalTermination)
+            self.transport.close()
+        except (IOError, OSError):
+            pass
+        if self.process is not None:
+            self.process.wait()
+
+
+class BridgeDispatcher(object):
+    """Routes tool requests to one bridge worker per databank."""
+
+    def __init__(self, databanks, launcher, connect_timeout=None):
+        names = [databank.lower() for databank in databanks]
+        if len(names) == 0:
+            raise ValueError("At least one databank is required to start the dispatcher")
+        if len(set(names)) != len(names):
+            raise ValueError("Each databank can only be held by one worker: %s" % ", ".join(databanks))
+        self.workers = OrderedDict()
+        self._forward_lock = threading.Lock()
+        self._progress = {}
+        # Emme takes a while to start, so bring the workers up together
+        started = {}
+        errors = []
+
+        def start(databank):
+            try:
+                started[databank.lower()] = BridgeWorker(databank, launcher, connect_timeout)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=start, args=(databank,)) for databank in databanks]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for name in names:
+            if name in started:
+                self.workers[name] = started[name]
+        if errors:
+            self.close()
+            raise errors[0]
+
+    def worker_for(self, parameters):
+        """Find the worker for a tool's JSON parameters, or None if its databank is not held by any worker."""
+        databank = None
+        try:
+            values = json.loads(parameters) if parameters else None
+            if isinstance(values, dict):
+                databank = values.get("databank")
+        except ValueError:
+            pass
+        if not databank:
+            return next(iter(self.workers.values()))
+        return self.workers.get(str(databank).lower())
+
+    def run_tool(self, macroName, parameters, logbookLevel, forward):
+        """Run one tool, forwarding the whole reply including the result."""
+        worker = self.worker_for(parameters)
+        if worker is None:
+            forward(SignalRuntimeError, self._missing_databank(parameters))
+            return
+        with worker.lock:
+            result = self._guard(worker, lambda: worker.request(
+                SignalStartModuleBinaryParameters, [], [macroName, parameters, logbookLevel],
+                self._relay(forward)))
+        self._finish_progress(worker)
+        forward(*result)
+
+    def check_tool_exists(self, namespace, forward):
+        worker = next(iter(self.workers.values()))
+        with worker.lock:
+            result = self._guard(worker, lambda: worker.request(
+                SignalCheckToolExists, [], [namespace], self._relay(forward)))
+        forward(*result)
+
+    def run_batch(self, entries, stopOnError, forward):
+        """
+        Run (macroName, parameters, logbookLevel) entries, returning one result per entry
+        in order, or None for entries that were not run. When stopping on errors the
+        entries run one after another; otherwise each databank's entries run in order
+        on its worker while the workers run in parallel.
+        """
+        results = [None] * len(entries)
+        groups = OrderedDict()
+        for index, entry in enumerate(entries):
+            worker = self.worker_for(entry[1])
+            if worker is None:
+                results[index] = (SignalRuntimeError, self._missing_databank(entry[1]))
+                if stopOnError:
+                    return results
+                continue
+            if stopOnError:
+                self._run_group(worker, [(index, entry)], results, forward)
+                if results[index][0] not in _SUCCESS_SIGNALS:
+                    return results
+            else:
+                groups.setdefault(worker, []).append((index, entry))
+        threads = [threading.Thread(target=self._run_group, args=(worker, group, results, forward))
+                   for worker, group in groups.items()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def _run_group(self, worker, group, results, forward):
+        strings = []
+        for index, entry in group:
+            strings.extend(entry)
+        relay = self._relay(forward)
+        with worker.lock:
+            try:
+                worker.transport.send_signal(SignalStartBatch)
+                worker.transport.send_signal(len(group))
+                worker.transport.send_signal(0)
+                worker.transport.send_request_strings(None, strings)
+                for index, entry in group:
+                    message = worker.read_until_final(relay)
+                    if message[0] == SignalBatchComplete:
+                        break
+                    results[index] = message
+                else:
+                    worker.read_until_final(relay)
+            except (EOFError, IOError, OSError):
+                for index, entry in group:
+                    if results[index] is None:
+                        results[index] = (SignalRuntimeError, self._worker_failed(worker))
+        self._finish_progress(worker)
+
+    def close(self):
+        for worker in self.workers.values():
+            worker.close()
+        self.workers.clear()
+
+    def _relay(self, forward):
+        def on_message(worker, message):
+            signal, payload = message
+            if signal == SignalSendPrintMessage:
+                forward(signal, self._prefix_lines(worker, payload))
+            elif signal == SignalProgressReport:
+                forward(signal, self._merge_progress(worker, payload))
+            else:
+                forward(signal, payload)
+        return on_message
+
+    def _prefix_lines(self, worker, text):
+        prefix = "[%s] " % worker.databank
+        lines = text.split("\n")
+        for i in range(len(lines)):
+            # A trailing empty piece is the start of a line that has not been written yet
+            if i == len(lines) - 1 and lines[i] == "":
+                break
+            if i > 0 or worker.at_line_start:
+                lines[i] = prefix + lines[i]
+        worker.at_line_start = text.endswith("\n")
+        return "\n".join(lines)
+
+    def _merge_progress(self, worker, progress):
+        with self._forward_lock:
+            self._progress[worker] = progress
+            return sum(self._progress.values()) / len(self._progress)
+
+    def _finish_progress(self, worker):
+        with self._forward_lock:
+            self._progress.pop(worker, None)
+
+    def _guard(self, worker, request):
+        try:
+            return request()
+        except (EOFError, IOError, OSError):
+            return SignalRuntimeError, self._worker_failed(worker)
+
+    def _worker_failed(self, worker):
+        return "The EMME worker for databank '%s' stopped responding." % worker.databank
+
+    def _missing_databank(self, parameters):
+        return "No EMME worker holds the databank requested by the parameters: %s" % parameters
+
+
+def serve(transport, dispatcher):
+    """Answer XTMF's requests over transport until it asks the dispatcher to terminate."""
+    send_lock = threading.Lock()
+
+    def forward(signal, payload):
+        with send_lock:
+            send_message(transport, signal, payload)
+
+    forward(SignalStart, None)
+    try:
+        while True:
+            signal = transport.read_int()
+            if signal == SignalTermination:
+                break
+            elif signal == SignalStartModuleBinaryParameters:
+                macroName = transport.read_string()
+                parameters = transport.read_string()
+                logbookLevel = transport.read_string()
+                dispatcher.run_tool(macroName, parameters, logbookLevel, forward)
+            elif signal == SignalCheckToolExists:
+                dispatcher.check_tool_exists(transport.read_string(), forward)
+            elif signal == SignalStartBatch:
+                entryCount = transport.read_int()
+                stopOnError = transport.read_int() != 0
+                entries = [(transport.read_string(), transport.read_string(), transport.read_string())
+                           for i in range(entryCount)]
+                for result in dispatcher.run_batch(entries, stopOnError, forward):
+                    if result is None:
+                        break
+                    forward(*result)
+                forward(SignalBatchComplete, None)
+            else:
+                forward(SignalTermination, None)
+                break
+    finally:
+        dispatcher.close()
+
+
+if __name__ == "__main__":
+    # 1: Emme project file, 2: User initials, 3: Performance flag, 4: Pipe name,
+    # 5: Comma separated databanks, one worker is started for each
+    args = sys.argv
+    projectFile = args[1]
+    userInitials = args[2]
+    performanceFlag = bool(int(args[3]))
+    pipeName = args[4]
+    databanks = [databank for databank in args[5].split(",") if databank]
+    connectTimeout = float(os.environ.get("XTMF_DISPATCHER_CONNECT_TIMEOUT", DefaultConnectTimeout))
+    dispatcher = BridgeDispatcher(databanks, bridge_launcher(projectFile, userInitials, performanceFlag),
+                                  connect_timeout=connectTimeout)
+    serve(PipeTransport.connect(pipeName), dispatcher)
@@ -0,0 +1,211 @@
+'''
+    Copyright 2022 Travel Modelling Group, Department of Civil Engineering, University of Toronto
+
+    This file is part of XTMF.
+
+    XTMF is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    XTMF is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with XTMF.  If not, see <http://www.gnu.org/licenses/>.
+'''
+# Profiling support for ModellerBridge.py's performance mode
+#
+# ToolProfiler writes, for each profiled tool run, either a cProfile .pstats file
+# or nothing but samples, along with a collapsed-stack text file ("frame;frame;frame count"
+# per line) that can be fed directly to flamegraph.pl or speedscope.
+# ToolTimings keeps a rolling window of run times per tool namespace.
+import cProfile
+import math
+import os
+import pstats
+import re
+import sys
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+# Collapsed stacks from cProfile are written in microseconds
+_COLLAPSED_UNITS_PER_SECOND = 1000000
+# Deep or recursive call graphs are cut off at this many frames
+_MAX_STACK_DEPTH = 128
+
+
+class ToolTimings(object):
+    """Keeps the most recent run times of each tool namespace."""
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._samples = {}
+        self._counts = {}
+
+    def record(self, namespace, seconds):
+        samples = self._samples.get(namespace)
+        if samples is None:
+            samples = self._samples[namespace] = deque(maxlen=self.window)
+        samples.append(seconds)
+        self._counts[namespace] = self._counts.get(namespace, 0) + 1
+
+    def summary(self):
+        """Returns {namespace: {count, p50, p95, max}}, with times in seconds over the rolling window."""
+        ret = {}
+        for namespace, samples in self._samples.items():
+            ordered = sorted(samples)
+            ret[namespace] = {
+                "count": self._counts[namespace],
+                "p50": _percentile(ordered, 0.5),
+                "p95": _percentile(ordered, 0.95),
+                "max": ordered[-1],
+            }
+        return ret
+
+
+def _percentile(ordered, fraction):
+    # Nearest-rank percentile of an already sorted list
+    return ordered[max(0, int(math.ceil(fraction * len(ordered))) - 1)]
+
+
+class ToolProfiler(object):
+    """Profiles tool runs, writing the results for each run to a directory."""
+
+    MODES = ("cprofile", "sampling")
+
+    def __init__(self, directory, mode="cprofile", namespaces=None, interval=0.005):
+        """
+        directory is where the profiles are written. mode is either 'cprofile'
+        for deterministic profiling or 'sampling' to sample the tool's stack every
+        interval seconds. namespaces limits profiling to the given tool namespaces
+        and the tools below them, with None or an empty list profiling every tool.
+        """
+        if mode not in self.MODES:
+            raise ValueError("Unknown profiler mode '%s', expected one of %s" % (mode, ", ".join(self.MODES)))
+        self.directory = directory
+        self.mode = mode
+        self.namespaces = [n.strip() for n in (namespaces or []) if n.strip()]
+        self.interval = interval
+        self._runs = {}
+
+    def wants(self, namespace):
+        if len(self.namespaces) == 0:
+            return True
+        for prefix in self.namespaces:
+            if namespace == prefix or namespace.startswith(prefix + "."):
+                return True
+        return False
+
+    @contextmanager
+    def profile(self, namespace):
+        """Profile the code run within the context, if the namespace is selected."""
+        if not self.wants(namespace):
+            yield None
+            return
+        base_path = self._output_path(namespace)
+        if self.mode == "sampling":
+            sampler = StackSampler(threading.current_thread().ident, self.interval)
+            sampler.start()
+            try:
+                yield base_path
+            finally:
+                sampler.stop()
+                _write_collapsed(sampler.stacks, base_path + ".collapsed.txt")
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield base_path
+            finally:
+                profiler.disable()
+                profiler.dump_stats(base_path + ".pstats")
+                _write_collapsed(collapse_stats(pstats.Stats(profiler)), base_path + ".collapsed.txt")
+
+    def _output_path(self, namespace):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        run = self._runs.get(namespace, 0) + 1
+        self._runs[namespace] = run
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", namespace)
+        return os.path.join(self.directory, "%s.%d" % (safe_name, run))
+
+
+class StackSampler(threading.Thread):
+    """Samples the stack of another thread, counting each distinct stack seen."""
+
+    def __init__(self, thread_id, interval):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                labels = []
+                while frame is not None:
+                    labels.append(_label(frame.f_code.co_filename, frame.f_code.co_firstlineno, frame.f_code.co_name))
+                    frame = frame.f_back
+                labels.reverse()
+                stack = ";".join(labels)
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def collapse_stats(stats):
+    """
+    Rebuilds approximate call stacks from a pstats.Stats call graph. The time
+    spent in each function along a path is its cumulative time split between its
+    callers by the time each caller's calls took. Returns {stack: microseconds}.
+    """
+    entries = stats.stats
+    children = {}
+    for function, (cc, nc, tt, ct, callers) in entries.items():
+        for caller, caller_stats in callers.items():
+            children.setdefault(caller, []).append((function, caller_stats[3]))
+    collapsed = {}
+
+    def walk(function, stack, seconds):
+        tt, ct = entries[function][2], entries[function][3]
+        # Paths too short to show up in the output are not worth following
+        if ct <= 0.0 or seconds * _COLLAPSED_UNITS_PER_SECOND < 1.0:
+            return
+        stack = stack + [_label(*function)]
+        self_seconds = seconds * min(1.0, tt / ct)
+        key = ";".join(stack)
+        collapsed[key] = collapsed.get(key, 0.0) + self_seconds
+        if len(stack) >= _MAX_STACK_DEPTH:
+            return
+        for child, edge_seconds in children.get(function, ()):
+            label = _label(*child)
+            if label in stack or child not in entries:
+                continue
+            walk(child, stack, seconds * edge_seconds / ct)
+
+    for function, (cc, nc, tt, ct, callers) in entries.items():
+        if len(callers) == 0:
+            walk(function, [], ct)
+    return dict((stack, int(round(seconds * _COLLAPSED_UNITS_PER_SECOND)))
+                for stack, seconds in collapsed.items())
+
+
+def _label(filename, line, name):
+    return ("%s:%d(%s)" % (os.path.basename(filename), line, name)).replace(";", ":")
+
+
+def _write_collapsed(stacks, path):
+    with open(path, "w") as writer:
+        for stack, count in sorted(stacks.items()):
+            if count > 0:
+                writer.write("%s %d\n" % (stack, count))
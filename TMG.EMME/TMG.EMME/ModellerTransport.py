@@ -0,0 +1,258 @@
+'''
+    Copyright 2022 Travel Modelling Group, Department of Civil Engineering, University of Toronto
+
+    This file is part of XTMF.
+
+    XTMF is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    XTMF is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with XTMF.  If not, see <http://www.gnu.org/licenses/>.
+'''
+# Framed binary transport between ModellerBridge.py and ModellerController.cs
+#
+# The wire format matches .Net's BinaryReader / BinaryWriter with Encoding.Unicode:
+#   signals          little-endian int32
+#   progress         little-endian float32 following the signal
+#   outgoing strings 7-bit encoded byte length followed by UTF-16LE bytes
+#   incoming strings int32 character count followed by UTF-16LE characters
+#   arrays           type string (as above), int32 rank, int32 per dimension,
+#                    int64 byte length, then the raw little-endian elements
+#
+# This module does not depend on Modeller so it can be driven over an os.pipe
+# or socket.socketpair outside of Emme. The read_response_* and send_request_*
+# methods speak the controller's side of the protocol, for ModellerDispatcher.py.
+import io
+import codecs
+import socket
+import struct
+
+try:
+    _text_type = unicode
+except NameError:
+    _text_type = str
+
+_INT32 = struct.Struct("<i")
+_INT32_FLOAT32 = struct.Struct("<if")
+_INT64 = struct.Struct("<q")
+_FLOAT32 = struct.Struct("<f")
+# A 32-bit length never needs more than five bytes once 7-bit encoded
+_MAX_LENGTH_PREFIX = 5
+
+
+class PipeTransport(object):
+    """Reads and writes XTMF bridge messages, sending each message with a single write."""
+
+    def __init__(self, reader, writer=None, initial_capacity=4096):
+        """
+        reader and writer are binary streams supporting readinto and write.
+        When writer is None the reader is used for both directions.
+        """
+        self.reader = reader
+        self.writer = writer if writer is not None else reader
+        self._send_buffer = bytearray(initial_capacity)
+        self._receive_buffer = bytearray(initial_capacity)
+        self._int_buffer = bytearray(_INT32.size)
+
+    @classmethod
+    def open_named_pipe(cls, pipe_name):
+        """Connect to the Windows named pipe that XTMF is listening on."""
+        return cls(open('\\\\.\\pipe\\' + pipe_name, 'w+b', 0))
+
+    @classmethod
+    def connect(cls, address):
+        """
+        Connect to XTMF, or a dispatcher, given either the name of a Windows
+        named pipe or a 'tcp:host:port' address.
+        """
+        if address.startswith("tcp:"):
+            host, port = address[len("tcp:"):].rsplit(":", 1)
+            sock = socket.create_connection((host, int(port)))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return cls.from_socket(sock)
+        return cls.open_named_pipe(address)
+
+    @classmethod
+    def from_file_descriptors(cls, read_fd, write_fd):
+        """Wrap a pair of raw file descriptors, for example from os.pipe()."""
+        return cls(io.open(read_fd, 'rb', buffering=0, closefd=False),
+                   io.open(write_fd, 'wb', buffering=0, closefd=False))
+
+    @classmethod
+    def from_socket(cls, sock):
+        """Wrap a connected socket, for example one end of socket.socketpair(). The transport takes ownership of it."""
+        stream = sock.makefile('rwb', buffering=0)
+        # The socket stays open until the stream is closed
+        sock.close()
+        return cls(stream)
+
+    def close(self):
+        self.reader.close()
+        if self.writer is not self.reader:
+            self.writer.close()
+
+    # Sending
+
+    def send_signal(self, signal):
+        buffer = self._reserve(_INT32.size)
+        _INT32.pack_into(buffer, 0, signal)
+        self._write(buffer, _INT32.size)
+
+    def send_float(self, signal, value):
+        buffer = self._reserve(_INT32_FLOAT32.size)
+        _INT32_FLOAT32.pack_into(buffer, 0, signal, float(value))
+        self._write(buffer, _INT32_FLOAT32.size)
+
+    def send_string(self, signal, text):
+        """Send a string, preceded by the signal unless signal is None."""
+        payload = _text_type(text).encode("utf-16-le")
+        length = len(payload)
+        buffer = self._reserve(_INT32.size + _MAX_LENGTH_PREFIX + length)
+        offset = 0
+        if signal is not None:
+            _INT32.pack_into(buffer, 0, signal)
+            offset = _INT32.size
+        offset = _write_7bit_length(buffer, offset, length)
+        buffer[offset:offset + length] = payload
+        self._write(buffer, offset + length)
+
+    def send_array(self, signal, dtype, shape, data):
+        """
+        Send a numeric array. dtype is the numpy type string (for example '<f4'),
+        shape the size of each dimension and data a contiguous buffer of the
+        little-endian elements. The header is framed like any other message while
+        the elements are written straight from data without being copied.
+        """
+        type_name = _text_type(dtype).encode("utf-16-le")
+        payload = memoryview(data)
+        if payload.ndim != 1 or payload.itemsize != 1:
+            payload = payload.cast("B")
+        header_size = _INT32.size + _MAX_LENGTH_PREFIX + len(type_name) \
+            + _INT32.size * (1 + len(shape)) + _INT64.size
+        buffer = self._reserve(header_size)
+        _INT32.pack_into(buffer, 0, signal)
+        offset = _write_7bit_length(buffer, _INT32.size, len(type_name))
+        buffer[offset:offset + len(type_name)] = type_name
+        offset += len(type_name)
+        _INT32.pack_into(buffer, offset, len(shape))
+        offset += _INT32.size
+        for dimension in shape:
+            _INT32.pack_into(buffer, offset, dimension)
+            offset += _INT32.size
+        _INT64.pack_into(buffer, offset, len(payload))
+        offset += _INT64.size
+        self._write(buffer, offset, flush=False)
+        self._write(payload, len(payload))
+
+    def send_request_string(self, text):
+        """Send a string the way ModellerController does, as an int32 character count and UTF-16LE characters."""
+        payload = _text_type(text if text is not None else u"").encode("utf-16-le")
+        buffer = self._reserve(_INT32.size + len(payload))
+        _INT32.pack_into(buffer, 0, len(payload) // 2)
+        buffer[_INT32.size:_INT32.size + len(payload)] = payload
+        self._write(buffer, _INT32.size + len(payload))
+
+    def send_request_strings(self, signal, texts):
+        """Send a signal followed by several request strings with a single write."""
+        payloads = [_text_type(text if text is not None else u"").encode("utf-16-le") for text in texts]
+        size = _INT32.size * (1 + len(payloads)) + sum(len(payload) for payload in payloads)
+        buffer = self._reserve(size)
+        offset = 0
+        if signal is not None:
+            _INT32.pack_into(buffer, 0, signal)
+            offset = _INT32.size
+        for payload in payloads:
+            _INT32.pack_into(buffer, offset, len(payload) // 2)
+            offset += _INT32.size
+            buffer[offset:offset + len(payload)] = payload
+            offset += len(payload)
+        self._write(buffer, offset)
+
+    def _reserve(self, size):
+        if len(self._send_buffer) < size:
+            self._send_buffer = bytearray(max(size, len(self._send_buffer) * 2))
+        return self._send_buffer
+
+    def _write(self, buffer, size, flush=True):
+        view = memoryview(buffer)[:size]
+        # Unbuffered streams may accept only part of the frame
+        while len(view) > 0:
+            written = self.writer.write(view)
+            if written is None:
+                break
+            view = view[written:]
+        if flush:
+            self.writer.flush()
+
+    # Receiving
+
+    def read_int(self):
+        self._read_exactly(memoryview(self._int_buffer))
+        return _INT32.unpack_from(self._int_buffer, 0)[0]
+
+    def read_string(self):
+        size = self.read_int() * 2
+        if size <= 0:
+            return u""
+        if len(self._receive_buffer) < size:
+            self._receive_buffer = bytearray(max(size, len(self._receive_buffer) * 2))
+        view = memoryview(self._receive_buffer)[:size]
+        self._read_exactly(view)
+        return codecs.utf_16_le_decode(view)[0]
+
+    def read_response_string(self):
+        """Read a string sent by the bridge, a 7-bit encoded byte length and UTF-16LE bytes."""
+        size = 0
+        shift = 0
+        while True:
+            self._read_exactly(memoryview(self._int_buffer)[:1])
+            byte = self._int_buffer[0]
+            size |= (byte & 0x7F) << shift
+            shift += 7
+            if byte < 0x80:
+                break
+        if size == 0:
+            return u""
+        if len(self._receive_buffer) < size:
+            self._receive_buffer = bytearray(max(size, len(self._receive_buffer) * 2))
+        view = memoryview(self._receive_buffer)[:size]
+        self._read_exactly(view)
+        return codecs.utf_16_le_decode(view)[0]
+
+    def read_response_float(self):
+        self._read_exactly(memoryview(self._int_buffer))
+        return _FLOAT32.unpack_from(self._int_buffer, 0)[0]
+
+    def read_response_array(self):
+        """Read an array sent with send_array, returning (dtype, shape, data)."""
+        dtype = self.read_response_string()
+        shape = tuple(self.read_int() for i in range(self.read_int()))
+        length_buffer = bytearray(_INT64.size)
+        self._read_exactly(memoryview(length_buffer))
+        data = bytearray(_INT64.unpack_from(length_buffer, 0)[0])
+        self._read_exactly(memoryview(data))
+        return dtype, shape, data
+
+    def _read_exactly(self, view):
+        while len(view) > 0:
+            read = self.reader.readinto(view)
+            if not read:
+                raise EOFError("The XTMF pipe was closed while reading a message")
+            view = view[read:]
+
+
+def _write_7bit_length(buffer, offset, value):
+    """Write value the way .Net's BinaryWriter.Write7BitEncodedInt does, returning the new offset."""
+    while value >= 0x80:
+        buffer[offset] = (value & 0x7F) | 0x80
+        value >>= 7
+        offset += 1
+    buffer[offset] = value
+    return offset + 1
@@ -0,0 +1,45 @@
+﻿/*
+    Copyright 2022 University of Toronto
+
+    This file is part of TMG.EMME for XTMF2.
+
+    TMG.EMME for XTMF2 is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    TMG.EMME for XTMF2 is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with TMG.EMME for XTMF2.  If not, see <http://www.gnu.org/licenses/>.
+*/
+using XTMF2;
+
+namespace TMG.Emme
+{
+    [Module(Name = "Run On Databank", Description = "Runs the contained modules with their EMME tools sent to the worker that holds"
+        + " the given databank. This only has an effect when the modeller was started with worker databanks.",
+        DocumentationLink = "http://tmg.utoronto.ca/doc/2.0")]
+    public class RunOnDatabank : BaseAction<ModellerController>
+    {
+        [Parameter(Name = "Databank", Description = "The name of the databank, as given in the modeller's worker databanks.", Index = 0)]
+        public IFunction<string> Databank;
+
+        [SubModule(Name = "To Run", Description = "The modules to run on the databank, in order.", Index = 1)]
+        public IAction<ModellerController>[] ToRun;
+
+        public override void Invoke(ModellerController context)
+        {
+            context.RunOnDatabank(Databank.Invoke(), () =>
+            {
+                foreach (var module in ToRun)
+                {
+                    module.Invoke(context);
+                }
+            });
+        }
+    }
+}
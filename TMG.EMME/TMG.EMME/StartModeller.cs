@@ -0,0 +1,84 @@
+﻿/*
+    Copyright 2022 University of Toronto
+
+    This file is part of TMG.EMME for XTMF2.
+
+    TMG.EMME for XTMF2 is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    TMG.EMME for XTMF2 is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with TMG.EMME for XTMF2.  If not, see <http://www.gnu.org/licenses/>.
+*/
+using System;
+using XTMF2;
+
+namespace TMG.Emme
+{
+    [Module(Name = "Start Modeller", Description = "Starts a bridge to EMME Modeller for the given project. With worker databanks"
+        + " a dispatcher starts one bridge per databank so tools on different databanks can run in parallel.",
+        DocumentationLink = "http://tmg.utoronto.ca/doc/2.0")]
+    public class StartModeller : BaseFunction<ModellerController>, IDisposable
+    {
+        [Parameter(Name = "Project File", Description = "The EMME project file (*.emp) to open.", Index = 0)]
+        public IFunction<string> ProjectFile;
+
+        [Parameter(Name = "User Initials", DefaultValue = "XTMF", Description = "The initials to record in the logbook.", Index = 1)]
+        public IFunction<string> UserInitials;
+
+        [Parameter(Name = "Performance Analysis", DefaultValue = "false",
+            Description = "Set to true to profile each tool that the bridge runs.", Index = 2)]
+        public IFunction<bool> PerformanceAnalysis;
+
+        [Parameter(Name = "EMME Path", DefaultValue = "",
+            Description = "The EMME installation directory. Leave blank to use the EMMEPATH environment variable.", Index = 3)]
+        public IFunction<string> EmmePath;
+
+        [Parameter(Name = "Profile Directory", DefaultValue = "",
+            Description = "The directory to write a profile of each tool run into when Performance Analysis is on. Leave blank to only log the profiles.",
+            Index = 4)]
+        public IFunction<string> ProfileDirectory;
+
+        [Parameter(Name = "Worker Databanks", DefaultValue = "",
+            Description = "A comma separated list of databanks to start one worker for each. Leave blank to run a single bridge.",
+            Index = 5)]
+        public IFunction<string> WorkerDatabanks;
+
+        private ModellerController _modeller;
+
+        public override ModellerController Invoke()
+        {
+            lock (this)
+            {
+                if (_modeller == null)
+                {
+                    var workerDatabanks = WorkerDatabanks.Invoke()
+                        .Split(',', StringSplitOptions.RemoveEmptyEntries | StringSplitOptions.TrimEntries);
+                    var emmePath = EmmePath.Invoke();
+                    var profileDirectory = ProfileDirectory.Invoke();
+                    _modeller = new ModellerController(this, ProjectFile.Invoke(), Guid.NewGuid().ToString(),
+                        PerformanceAnalysis.Invoke(), UserInitials.Invoke(),
+                        emmePath: String.IsNullOrWhiteSpace(emmePath) ? null : emmePath,
+                        profileDirectory: String.IsNullOrWhiteSpace(profileDirectory) ? null : profileDirectory,
+                        workerDatabanks: workerDatabanks.Length > 0 ? workerDatabanks : null);
+                }
+                return _modeller;
+            }
+        }
+
+        public void Dispose()
+        {
+            lock (this)
+            {
+                _modeller?.Dispose();
+                _modeller = null;
+            }
+        }
+    }
+}
@@ -40,6 +40,10 @@ Toll-Based Road Assignment
 
     V 2.0.2 Updated to receive JSON file parameters from Python API call
 
+    V 2.1.0 Added a multi-period batch mode that shares setup between periods
+
+    V 2.1.1 Added the optional link_cost_attribute of a traffic class to keep its link costs
+
 """
 
 from inspect import Parameter
@@ -48,10 +52,13 @@ from pydoc import describe
 from tabnanny import check
 import inro.modeller as _m
 import traceback as _traceback
-from contextlib import contextmanager
+from contextlib import contextmanager, ExitStack
 import multiprocessing
 import random
 import json
+import re
+import time
+import numpy as np
 
 _m.InstanceType = object
 _m.ListType = list
@@ -64,16 +71,18 @@ _bank = _MODELLER.emmebank
 _util = _MODELLER.module("tmg2.utilities.general_utilities")
 EMME_VERSION = _util.get_emme_version(tuple)
 
-matrix_calc_tool = _MODELLER.tool("inro.emme.matrix_calculation.matrix_calculator")
 network_calculation_tool = _MODELLER.tool("inro.emme.network_calculation.network_calculator")
 traffic_assignment_tool = _MODELLER.tool("inro.emme.traffic_assignment.sola_traffic_assignment")
 extra_parameter_tool = _MODELLER.tool("inro.emme.traffic_assignment.set_extra_function_parameters")
 
 delete_matrix = _MODELLER.tool("inro.emme.data.matrix.delete_matrix")
 
+# A toll that the in-memory link cost calculation can read directly as a link attribute
+_ATTRIBUTE_NAME = re.compile(r"^@?\w+$")
+
 
 class AssignTraffic(_m.Tool()):
-    version = "2.0.2"
+    version = "2.1.1"
     tool_run_msg = ""
     # For progress reporting, enter the integer number of tasks here
     number_of_tasks = 4
@@ -101,6 +110,11 @@ class AssignTraffic(_m.Tool()):
         return pb.render()
 
     def __call__(self, parameters):
+        if "periods" in parameters:
+            try:
+                return self._execute_periods(parameters)
+            except Exception as e:
+                raise Exception(_util.format_reverse_stack())
         scenario = _util.load_scenario(parameters["scenario_number"])
         try:
             self._execute(scenario, parameters)
@@ -108,6 +122,11 @@ class AssignTraffic(_m.Tool()):
             raise Exception(_util.format_reverse_stack())
 
     def run_xtmf(self, parameters):
+        if "periods" in parameters:
+            try:
+                return self._execute_periods(parameters)
+            except Exception as e:
+                raise Exception(_util.format_reverse_stack())
         scenario = _util.load_scenario(parameters["scenario_number"])
 
         try:
@@ -127,6 +146,51 @@ class AssignTraffic(_m.Tool()):
             - temp_attributes_list: keeps track of all temporary attributes created and deletes
                 them at the at the end of each run (including when code catches an error)
         """
+        with _util.temporary_matrix_manager() as temp_matrix_list:
+            with _util.temporary_attribute_manager(scenario) as temp_attribute_list:
+                setup = self._new_scenario_setup(temp_attribute_list)
+                self._run_period(scenario, parameters, temp_matrix_list, setup, {})
+
+    def _execute_periods(self, parameters):
+        """
+        Runs several time periods in one call. Each block in parameters["periods"] overrides
+        the shared parameters for its period, e.g. its scenario_number and traffic_classes.
+        Temporary matrices are created once and reused by every period, while the temporary
+        attributes, transit background traffic and link costs are only computed the first
+        time a scenario is seen (link costs again if a class' cost definition changes).
+
+        Returns: A JSON string with the timing summary of each period.
+        """
+        periods = self._load_periods(parameters)
+        batch_start = time.perf_counter()
+        timings = []
+        with _trace("Multi-period road assignment (%s v%s)" % (self.__class__.__name__, self.version)):
+            with _util.temporary_matrix_manager() as temp_matrix_list, ExitStack() as attribute_managers:
+                scenario_setups = {}
+                shared_matrices = {}
+                for name, period_parameters in periods:
+                    period_start = time.perf_counter()
+                    scenario = _util.load_scenario(period_parameters["scenario_number"])
+                    if scenario.number not in scenario_setups:
+                        temp_attribute_list = attribute_managers.enter_context(
+                            _util.temporary_attribute_manager(scenario)
+                        )
+                        scenario_setups[scenario.number] = self._new_scenario_setup(temp_attribute_list)
+                    timing = self._run_period(
+                        scenario,
+                        period_parameters,
+                        temp_matrix_list,
+                        scenario_setups[scenario.number],
+                        shared_matrices,
+                    )
+                    timing["period"] = name
+                    timing["scenario"] = scenario.number
+                    timing["total_seconds"] = time.perf_counter() - period_start
+                    timings.append(timing)
+                    print("Period %s assigned in %.1f seconds." % (name, timing["total_seconds"]))
+        return json.dumps({"periods": timings, "total_seconds": time.perf_counter() - batch_start})
+
+    def _run_period(self, scenario, parameters, temp_matrix_list, setup, shared_matrices):
         load_input_matrix_list = self._load_input_matrices(parameters, "demand_matrix")
         load_output_matrix_dict = self._load_output_matrices(
             parameters,
@@ -136,101 +200,147 @@ class AssignTraffic(_m.Tool()):
             name="%s (%s v%s)" % (parameters["run_title"], self.__class__.__name__, self.version),
             attributes=self._load_atts(scenario, parameters),
         ):
+            setup_start = time.perf_counter()
             self._tracker.reset()
-            with _util.temporary_matrix_manager() as temp_matrix_list:
-                demand_matrix_list = self._init_input_matrices(load_input_matrix_list, temp_matrix_list)
-                cost_matrix_list = self._init_output_matrices(
-                    load_output_matrix_dict,
-                    temp_matrix_list,
-                    matrix_name="cost_matrix",
-                    description="",
-                )
-                time_matrix_list = self._init_output_matrices(
-                    load_output_matrix_dict,
-                    temp_matrix_list,
-                    matrix_name="time_matrix",
-                    description="",
-                )
-                toll_matrix_list = self._init_output_matrices(
-                    load_output_matrix_dict,
-                    temp_matrix_list,
-                    matrix_name="toll_matrix",
-                    description="",
-                )
-                peak_hour_matrix_list = self._init_temp_peak_hour_matrix(parameters, temp_matrix_list)
-                self._tracker.complete_subtask()
+            demand_matrix_list = self._init_input_matrices(load_input_matrix_list, temp_matrix_list)
+            cost_matrix_list = self._init_output_matrices(
+                load_output_matrix_dict,
+                temp_matrix_list,
+                matrix_name="cost_matrix",
+                description="",
+                shared_matrices=shared_matrices,
+            )
+            time_matrix_list = self._init_output_matrices(
+                load_output_matrix_dict,
+                temp_matrix_list,
+                matrix_name="time_matrix",
+                description="",
+                shared_matrices=shared_matrices,
+            )
+            toll_matrix_list = self._init_output_matrices(
+                load_output_matrix_dict,
+                temp_matrix_list,
+                matrix_name="toll_matrix",
+                description="",
+                shared_matrices=shared_matrices,
+            )
+            self._tracker.complete_subtask()
 
-                with _util.temporary_attribute_manager(scenario) as temp_attribute_list:
-                    time_attribute_list = self._create_time_attribute_list(
-                        scenario, demand_matrix_list, temp_attribute_list
-                    )
-                    cost_attribute_list = self._create_cost_attribute_list(
-                        scenario, demand_matrix_list, temp_attribute_list
-                    )
-                    transit_attribute_list = self.create_transit_traffic_attribute_list(
-                        scenario, demand_matrix_list, temp_attribute_list
-                    )
-                    # Create volume attributes
-                    for tc in parameters["traffic_classes"]:
-                        self._create_volume_attribute(scenario, tc["volume_attribute"])
-                    # Calculate transit background traffic
-                    self._calculate_transit_background_traffic(scenario, parameters)
-                    # Calculate applied toll factor
-                    applied_toll_factor_list = self._calculate_applied_toll_factor(parameters)
-                    # Calculate link costs
-                    self._calculate_link_cost(
-                        scenario,
-                        parameters,
+            time_attribute_list = self._create_time_attribute_list(scenario, demand_matrix_list, setup)
+            cost_attribute_list = self._create_cost_attribute_list(scenario, parameters, demand_matrix_list, setup)
+            transit_attribute_list = self.create_transit_traffic_attribute_list(scenario, demand_matrix_list, setup)
+            # Create volume attributes
+            for tc in parameters["traffic_classes"]:
+                self._create_volume_attribute(scenario, tc["volume_attribute"])
+            # Calculate transit background traffic
+            self._calculate_transit_background_traffic(scenario, parameters, setup)
+            # Calculate applied toll factor
+            applied_toll_factor_list = self._calculate_applied_toll_factor(parameters)
+            # Calculate link costs
+            self._calculate_link_cost(
+                scenario,
+                parameters,
+                demand_matrix_list,
+                applied_toll_factor_list,
+                cost_attribute_list,
+                setup,
+            )
+            # Calculate peak hour matrix
+            peak_hour_matrix_list = self._calculate_peak_hour_matrices(
+                scenario,
+                parameters,
+                demand_matrix_list,
+                temp_matrix_list,
+                shared_matrices,
+            )
+            self._tracker.complete_subtask()
+            assignment_start = time.perf_counter()
+
+            # Assign traffic to road network
+            with _m.logbook_trace("Running Road Assignments."):
+                completed_path_analysis = False
+                if completed_path_analysis is False:
+                    attributes = self._load_attribute_list(parameters, demand_matrix_list)
+                    attribute_list = attributes[0]
+                    volume_attribute_list = attributes[1]
+                    mode_list = self._load_mode_list(parameters)
+
+                    sola_spec = self._get_primary_SOLA_spec(
                         demand_matrix_list,
+                        peak_hour_matrix_list,
                         applied_toll_factor_list,
+                        mode_list,
+                        volume_attribute_list,
                         cost_attribute_list,
-                    )
-                    # Calculate peak hour matrix
-                    self._calculate_peak_hour_matrices(
-                        scenario,
+                        time_matrix_list,
+                        attribute_list,
+                        None,
+                        None,
+                        None,
+                        None,
+                        None,
+                        None,
+                        None,
                         parameters,
-                        demand_matrix_list,
-                        peak_hour_matrix_list,
                     )
-                    self._tracker.complete_subtask()
+                    report = self._tracker.run_tool(traffic_assignment_tool, sola_spec, scenario=scenario)
+                checked = self._load_stopping_criteria(report)
+                number = checked[0]
+                stopping_criterion = checked[1]
+                value = checked[2]
+
+                print("Primary assignment complete at %s iterations." % number)
+                print("Stopping criterion was %s with a value of %s." % (stopping_criterion, value))
+        return {
+            "setup_seconds": assignment_start - setup_start,
+            "assignment_seconds": time.perf_counter() - assignment_start,
+            "iterations": number,
+            "stopping_criterion": stopping_criterion,
+            "stopping_value": value,
+        }
 
-                    # Assign traffic to road network
-                    with _m.logbook_trace("Running Road Assignments."):
-                        completed_path_analysis = False
-                        if completed_path_analysis is False:
-                            attributes = self._load_attribute_list(parameters, demand_matrix_list)
-                            attribute_list = attributes[0]
-                            volume_attribute_list = attributes[1]
-                            mode_list = self._load_mode_list(parameters)
-
-                            sola_spec = self._get_primary_SOLA_spec(
-                                demand_matrix_list,
-                                peak_hour_matrix_list,
-                                applied_toll_factor_list,
-                                mode_list,
-                                volume_attribute_list,
-                                cost_attribute_list,
-                                time_matrix_list,
-                                attribute_list,
-                                None,
-                                None,
-                                None,
-                                None,
-                                None,
-                                None,
-                                None,
-                                parameters,
-                            )
-                            report = self._tracker.run_tool(traffic_assignment_tool, sola_spec, scenario=scenario)
-                        checked = self._load_stopping_criteria(report)
-                        number = checked[0]
-                        stopping_criterion = checked[1]
-                        value = checked[2]
-
-                        print("Primary assignment complete at %s iterations." % number)
-                        print("Stopping criterion was %s with a value of %s." % (stopping_criterion, value))
+    def _new_scenario_setup(self, temp_attribute_list):
+        """The temporary attributes and computed link data of a scenario, shared by its periods"""
+        return {
+            "temp_attribute_list": temp_attribute_list,
+            "time_attribute": None,
+            "transit_attribute": None,
+            "cost_attributes": [],
+            "link_cost_specs": [],
+            "background_transit": False,
+        }
 
     # ---LOAD - SUB FUNCTIONS -----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+    def _load_periods(self, parameters):
+        """
+        Merges each period block over the shared parameters and checks that no two periods
+        write their volumes or output matrices to the same place.
+        """
+        shared = {key: value for key, value in parameters.items() if key != "periods"}
+        periods = []
+        written = {}
+        for i, block in enumerate(parameters["periods"]):
+            period_parameters = dict(shared)
+            period_parameters.update(block)
+            name = str(block.get("name", i + 1))
+            outputs = []
+            scenario_number = period_parameters["scenario_number"]
+            for tc in period_parameters["traffic_classes"]:
+                outputs.append("volume attribute %s of scenario %s" % (tc["volume_attribute"], scenario_number))
+                outputs.extend(
+                    "matrix %s" % tc[matrix_name]
+                    for matrix_name in ["cost_matrix", "time_matrix", "toll_matrix"]
+                    if tc[matrix_name] != "mf0"
+                )
+            for output in outputs:
+                if output in written and written[output] != name:
+                    raise Exception(
+                        "Period '%s' writes %s, which is also written by period '%s'" % (name, output, written[output])
+                    )
+                written[output] = name
+            periods.append((name, period_parameters))
+        return periods
+
     def _load_atts(self, scenario, parameters):
         traffic_classes = parameters["traffic_classes"]
         time_matrix_ids = [mtx["time_matrix"] for mtx in traffic_classes]
@@ -332,9 +442,8 @@ class AssignTraffic(_m.Tool()):
         input_matrix_list = []
         for mtx in load_input_matrix_list:
             if mtx == None:
-                mtx = _util.initialize_matrix(matrix_type="FULL")
+                mtx = temp_matrix_list.lease(matrix_type="FULL")
                 input_matrix_list.append(_bank.matrix(mtx.id))
-                temp_matrix_list.append(mtx)
             else:
                 input_matrix_list.append(mtx)
         return input_matrix_list
@@ -345,72 +454,78 @@ class AssignTraffic(_m.Tool()):
         temp_matrix_list,
         matrix_name="",
         description="",
+        shared_matrices=None,
     ):
         """
         - Checks the dictionary of all load matrices in load_output_matrix_dict,
             for None, create a temporary matrix and initialize
+        - Temporary matrices already in shared_matrices are reused instead of created
         - Returns a list of all input matrices provided
         """
+        if shared_matrices is None:
+            shared_matrices = {}
         output_matrix_list = []
         desc = "AUTO %s FOR CLASS" % (matrix_name.upper())
         if matrix_name in load_output_matrix_dict.keys():
-            for mtx in load_output_matrix_dict[matrix_name]:
+            for i, mtx in enumerate(load_output_matrix_dict[matrix_name]):
                 if mtx == None:
-                    matrix = _util.initialize_matrix(
-                        name=matrix_name,
-                        description=description if description != "" else desc,
-                    )
+                    matrix = shared_matrices.get((matrix_name, i))
+                    if matrix is None:
+                        matrix = temp_matrix_list.lease(
+                            name=matrix_name,
+                            description=description if description != "" else desc,
+                        )
+                        shared_matrices[(matrix_name, i)] = matrix
                     output_matrix_list.append(matrix)
-                    temp_matrix_list.append(matrix)
                 else:
                     output_matrix_list.append(mtx)
         else:
             raise Exception('Output matrix name "%s" provided does not exist', matrix_name)
         return output_matrix_list
 
-    def _init_temp_peak_hour_matrix(self, parameters, temp_matrix_list):
-        peak_hour_matrix_list = []
-        traffic_classes = parameters["traffic_classes"]
-        for tc in traffic_classes:
-            peak_hour_matrix = _util.initialize_matrix(
-                default=tc["peak_hour_factor"],
-                description="Peak hour matrix",
-            )
-            peak_hour_matrix_list.append(peak_hour_matrix)
-            temp_matrix_list.append(peak_hour_matrix)
-        return peak_hour_matrix_list
-
     # ---CREATE - SUB FUNCTIONS-----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 
-    def _create_time_attribute_list(self, scenario, demand_matrix_list, temp_attribute_list):
-        time_attribute_list = []
-        time_attribute = _util.create_temp_attribute(
-            scenario, "ltime", "LINK", default_value=0.0, assignment_type="traffic"
-        )
-        time_attribute_list = len(demand_matrix_list) * [time_attribute]
-        for att in time_attribute_list:
-            temp_attribute_list.append(att)
+    def _create_time_attribute_list(self, scenario, demand_matrix_list, setup):
+        if setup["time_attribute"] is None:
+            setup["time_attribute"] = _util.create_temp_attribute(
+                scenario, "ltime", "LINK", default_value=0.0, assignment_type="traffic"
+            )
+            setup["temp_attribute_list"].append(setup["time_attribute"])
+        time_attribute_list = len(demand_matrix_list) * [setup["time_attribute"]]
         return time_attribute_list
 
-    def _create_cost_attribute_list(self, scenario, demand_matrix_list, temp_attribute_list):
-        cost_attribute_list = []
-        count = 0
-        while count < len(demand_matrix_list):
+    def _create_cost_attribute_list(self, scenario, parameters, demand_matrix_list, setup):
+        cost_attributes = setup["cost_attributes"]
+        while len(cost_attributes) < len(demand_matrix_list):
             cost_attribute = _util.create_temp_attribute(
                 scenario, "lkcst", "LINK", default_value=0.0, assignment_type="traffic"
             )
-            cost_attribute_list.append(cost_attribute)
-            temp_attribute_list.append(cost_attribute)
-            count += 1
+            cost_attributes.append(cost_attribute)
+            setup["link_cost_specs"].append(None)
+            setup["temp_attribute_list"].append(cost_attribute)
+        cost_attribute_list = cost_attributes[: len(demand_matrix_list)]
+        # A class can keep its link costs in a named attribute instead of a temporary one
+        for i, tc in enumerate(parameters["traffic_classes"]):
+            link_cost_attribute = (tc.get("link_cost_attribute") or "").strip()
+            if link_cost_attribute != "":
+                cost_attribute_list[i] = self._create_link_cost_attribute(scenario, link_cost_attribute)
         return cost_attribute_list
 
-    def create_transit_traffic_attribute_list(self, scenario, demand_matrix_list, temp_attribute_list):
-        t_traffic_attribute = _util.create_temp_attribute(
-            scenario, "tvph", "LINK", default_value=0.0, assignment_type="traffic"
-        )
-        transit_traffic_attribute_list = len(demand_matrix_list) * [t_traffic_attribute]
-        for att in transit_traffic_attribute_list:
-            temp_attribute_list.append(att)
+    def _create_link_cost_attribute(self, scenario, link_cost_attribute):
+        link_cost_attribute_at = scenario.extra_attribute(link_cost_attribute)
+        if link_cost_attribute_at is None:
+            link_cost_attribute_at = scenario.create_extra_attribute("LINK", link_cost_attribute, default_value=0)
+        elif link_cost_attribute_at.type != "LINK":
+            raise Exception("Link Cost Attribute '%s' is not a link type attribute" % link_cost_attribute)
+        return link_cost_attribute_at
+
+    def create_transit_traffic_attribute_list(self, scenario, demand_matrix_list, setup):
+        if setup["transit_attribute"] is None:
+            setup["transit_attribute"] = _util.create_temp_attribute(
+                scenario, "tvph", "LINK", default_value=0.0, assignment_type="traffic"
+            )
+            setup["temp_attribute_list"].append(setup["transit_attribute"])
+        transit_traffic_attribute_list = len(demand_matrix_list) * [setup["transit_attribute"]]
         return transit_traffic_attribute_list
 
     def _create_volume_attribute(self, scenario, volume_attribute):
@@ -434,42 +549,117 @@ class AssignTraffic(_m.Tool()):
         demand_matrix_list,
         applied_toll_factor_list,
         cost_attribute_list,
+        setup,
     ):
         with _trace("Calculating link costs"):
-            for i in range(len(demand_matrix_list)):
-                network_calculation_tool(
-                    self._get_link_cost_calc_spec(
-                        cost_attribute_list[i].id,
-                        parameters["traffic_classes"][i]["link_cost"],
-                        parameters["traffic_classes"][i]["link_toll_attribute"],
-                        applied_toll_factor_list[i],
-                    ),
-                    scenario=scenario,
+            specs = [
+                self._get_link_cost_calc_spec(
+                    cost_attribute_list[i].id,
+                    parameters["traffic_classes"][i]["link_cost"],
+                    parameters["traffic_classes"][i]["link_toll_attribute"],
+                    applied_toll_factor_list[i],
                 )
+                for i in range(len(demand_matrix_list))
+            ]
+            # An earlier period on this scenario may have already computed the same costs
+            pending = [i for i, spec in enumerate(specs) if setup["link_cost_specs"][i] != spec]
+            calculated = []
+            if pending and parameters.get("in_memory_link_costs", False):
+                calculated = self._calculate_link_cost_in_memory(
+                    scenario, parameters, pending, applied_toll_factor_list, cost_attribute_list
+                )
+            for i in pending:
+                if i not in calculated:
+                    network_calculation_tool(specs[i], scenario=scenario)
+            for i in pending:
+                setup["link_cost_specs"][i] = specs[i]
             self._tracker.complete_subtask()
 
-    def _calculate_peak_hour_matrices(self, scenario, parameters, demand_matrix_list, peak_hour_matrix_list):
+    def _calculate_link_cost_in_memory(
+        self, scenario, parameters, class_indices, applied_toll_factor_list, cost_attribute_list
+    ):
+        """
+        Computes the generalized cost of the given classes from a single read of the link
+        lengths and toll attributes, and writes every cost attribute back in one call.
+        Follows the same (length * link_cost + toll) * perception as the network calculator.
+        Classes whose toll is neither a number nor a link attribute of the scenario, such as
+        an expression, are left to the network calculator.
+
+        Returns: The indices of the classes whose cost was calculated.
+        """
+        traffic_classes = parameters["traffic_classes"]
+        link_attributes = set(scenario.attributes("LINK"))
+        toll_names = {}
+        for i in class_indices:
+            name = traffic_classes[i]["link_toll_attribute"].strip()
+            if self._is_number(name) or (_ATTRIBUTE_NAME.match(name) and name in link_attributes):
+                toll_names[i] = name
+        class_indices = [i for i in class_indices if i in toll_names]
+        if not class_indices:
+            return class_indices
+        toll_names = [toll_names[i] for i in class_indices]
+        toll_attributes = sorted({name for name in toll_names if not self._is_number(name)})
+        package = scenario.get_attribute_values("LINK", ["length"] + toll_attributes)
+        length = np.array(package[1], dtype=np.float64)
+        tolls = {name: np.array(table, dtype=np.float64) for name, table in zip(toll_attributes, package[2:])}
+        costs = []
+        for i, toll_name in zip(class_indices, toll_names):
+            toll = tolls[toll_name] if toll_name in tolls else float(toll_name)
+            costs.append((length * traffic_classes[i]["link_cost"] + toll) * applied_toll_factor_list[i])
+        cost_attributes = [cost_attribute_list[i].id for i in class_indices]
+        scenario.set_attribute_values("LINK", cost_attributes, [package[0]] + costs)
+        return class_indices
+
+    @staticmethod
+    def _is_number(value):
+        try:
+            float(value)
+        except ValueError:
+            return False
+        return True
+
+    def _calculate_peak_hour_matrices(
+        self, scenario, parameters, demand_matrix_list, temp_matrix_list, shared_matrices=None
+    ):
+        """
+        Returns the matrix each class assigns. A class with a peak hour factor of 1 assigns its
+        demand matrix directly. Otherwise its demand is scaled in memory and written once to a
+        scratch matrix, shared by any other class with the same demand and factor.
+        """
+        if shared_matrices is None:
+            shared_matrices = {}
+        peak_hour_matrix_list = []
+        scaled_matrices = {}
         with _trace("Calculting peak hour matrix"):
-            for i in range(len(demand_matrix_list)):
-                matrix_calc_tool(
-                    self._get_peak_hour_spec(
-                        peak_hour_matrix_list[i].id,
-                        demand_matrix_list[i].id,
-                        parameters["traffic_classes"][i]["peak_hour_factor"],
-                    ),
-                    scenario=scenario,
-                    num_processors=self.number_of_processors,
-                )
+            for i, demand_matrix in enumerate(demand_matrix_list):
+                peak_hour_factor = float(parameters["traffic_classes"][i]["peak_hour_factor"])
+                if peak_hour_factor == 1.0:
+                    peak_hour_matrix_list.append(demand_matrix)
+                    continue
+                key = (demand_matrix.id, peak_hour_factor)
+                if key not in scaled_matrices:
+                    peak_hour_matrix = shared_matrices.get(("peak_hour_matrix", len(scaled_matrices)))
+                    if peak_hour_matrix is None:
+                        peak_hour_matrix = temp_matrix_list.lease(description="Peak hour matrix")
+                        shared_matrices[("peak_hour_matrix", len(scaled_matrices))] = peak_hour_matrix
+                    data = demand_matrix.get_data(scenario.number)
+                    data.from_numpy(data.to_numpy() * peak_hour_factor)
+                    peak_hour_matrix.set_data(data, scenario.number)
+                    scaled_matrices[key] = peak_hour_matrix
+                peak_hour_matrix_list.append(scaled_matrices[key])
             self._tracker.complete_subtask()
+        return peak_hour_matrix_list
 
-    def _calculate_transit_background_traffic(self, scenario, parameters):
+    def _calculate_transit_background_traffic(self, scenario, parameters, setup):
         if parameters["background_transit"] == True:
             if int(scenario.element_totals["transit_lines"]) > 0:
                 with _trace("Calculating transit background traffic"):
-                    network_calculation_tool(
-                        self._get_transit_bg_spec(),
-                        scenario=scenario,
-                    )
+                    if setup["background_transit"] is False:
+                        network_calculation_tool(
+                            self._get_transit_bg_spec(),
+                            scenario=scenario,
+                        )
+                        setup["background_transit"] = True
                     extra_parameter_tool(el1="@tvph")
                     self._tracker.complete_subtask()
         else:
@@ -599,15 +789,6 @@ class AssignTraffic(_m.Tool()):
             "type": "NETWORK_CALCULATION",
         }
 
-    def _get_peak_hour_spec(self, peak_hour_matrix_id, demand_matrix_id, peak_hour_factor):
-        return {
-            "expression": demand_matrix_id + "*" + str(peak_hour_factor),
-            "result": peak_hour_matrix_id,
-            "constraint": {"by_value": None, "by_zone": None},
-            "aggregation": {"origins": None, "destinations": None},
-            "type": "MATRIX_CALCULATION",
-        }
-
     @_m.method(return_type=_m.TupleType)
     def percent_completed(self):
         return self._tracker.get_progress()
@@ -46,11 +46,12 @@ TMG Transit Assignment Tool
     V 2.0.2 Updated to receive JSON file parameters from Python API call
 """
 import enum
-import math
+import os
 import traceback as _traceback
 import time as _time
 import multiprocessing
 
+import numpy as np
 from numpy import percentile
 import inro.modeller as _m
 import csv
@@ -68,12 +69,13 @@ _db_utils = _MODELLER.module("inro.emme.utility.database_utilities")
 _tmg_tpb = _MODELLER.module("tmg2.utilities.TMG_tool_page_builder")
 network_calc_tool = _MODELLER.tool("inro.emme.network_calculation.network_calculator")
 extended_assignment_tool = _MODELLER.tool("inro.emme.transit_assignment.extended_transit_assignment")
-matrix_calc_tool = _MODELLER.tool("inro.emme.matrix_calculation.matrix_calculator")
 matrix_results_tool = _MODELLER.tool("inro.emme.transit_assignment.extended.matrix_results")
 strategy_analysis_tool = _MODELLER.tool("inro.emme.transit_assignment.extended.strategy_based_analysis")
-net_edit = _MODELLER.module("tmg2.utilities.network_editing")
+_ct = _MODELLER.module("tmg2.utilities.congested_transit")
 null_pointer_exception = _util.null_pointer_exception
 EMME_VERSION = _util.get_emme_version(tuple)
+# Placeholder in extraction plans for the temporary attribute holding timtr-@ccost
+_UNCONGESTED_IN_VEHICLE_TIMES = "timtr-@ccost"
 
 
 class AssignTransit(_m.Tool()):
@@ -87,6 +89,11 @@ class AssignTransit(_m.Tool()):
         self.connector_logit_truncation = 0.05
         self.consider_total_impedance = True
         self.use_logit_connector_choice = True
+        # Set to True to evaluate segment costs with the pure-Python reference loops
+        self.use_reference_kernel = False
+        # Set to True to check every step size against the Muller search at the step size tolerance
+        self.check_step_size = False
+        self._class_demand_cache = {}
 
     def page(self):
         pb = _tmg_tpb.TmgToolPageBuilder(
@@ -139,6 +146,7 @@ class AssignTransit(_m.Tool()):
             attributes=self._load_atts(scenario, parameters),
         ):
             self._tracker.reset()
+            self._class_demand_cache = {}
             with _util.temporary_matrix_manager() as temp_matrix_list:
                 # Initialize matrices with matrix ID = "mf0" not loaded in load_input_matrix_list
                 demand_matrix_list = self._init_input_matrices(load_input_matrix_list, temp_matrix_list)
@@ -292,9 +300,8 @@ class AssignTransit(_m.Tool()):
         input_matrix_list = []
         for mtx in load_input_matrix_list:
             if mtx == None:
-                mtx = _util.initialize_matrix(matrix_type="FULL")
+                mtx = temp_matrix_list.lease(matrix_type="FULL")
                 input_matrix_list.append(_bank.matrix(mtx.id))
-                temp_matrix_list.append(mtx)
             else:
                 input_matrix_list.append(mtx)
         return input_matrix_list
@@ -308,20 +315,19 @@ class AssignTransit(_m.Tool()):
         for transit_class in transit_classes:
             matrix_id = transit_class["impedance_matrix"]
             if matrix_id != "mf0":
-                _util.initialize_matrix(
+                matrix = _util.initialize_matrix(
                     id=matrix_id,
                     description="Transit Perceived Travel times for %s" % transit_class["name"],
                 )
                 impedance_matrix_list.append(matrix)
             else:
                 _write("Creating temporary Impedance Matrix for class %s" % transit_class["name"])
-                matrix = _util.initialize_matrix(
+                matrix = temp_matrix_list.lease(
                     default=0.0,
                     description="Temporary Impedance for class %s" % transit_class["name"],
                     matrix_type="FULL",
                 )
                 impedance_matrix_list.append(matrix)
-                temp_matrix_list.append(matrix)
         return impedance_matrix_list
 
     def _init_output_matrices(
@@ -347,13 +353,12 @@ class AssignTransit(_m.Tool()):
                 else:
                     if matrix_name == "impedance_matrix":
                         _write('Creating Temporary Impedance Matrix "%s"', matrix_name)
-                        matrix = _util.initialize_matrix(
+                        matrix = temp_matrix_list.lease(
                             default=0.0,
                             description=description if description != "" else desc,
                             matrix_type="FULL",
                         )
                         output_matrix_list.append(matrix)
-                        temp_matrix_list.append(matrix)
                     else:
                         output_matrix_list.append(mtx)
         else:
@@ -527,54 +532,29 @@ class AssignTransit(_m.Tool()):
     def _set_base_speed(self, scenario, parameters, stsu_att, stsu_ttf_map, ttfs_changed, ttfs_xrow):
         erow_defined = self._check_attributes_and_get_erow(scenario)
         self._set_up_line_attributes(scenario, parameters, stsu_att)
-        network = scenario.get_network()
-        for line in network.transit_lines():
-            index = int(line[stsu_att.id])
-            if index > 0.0:
-                stsu = parameters["surface_transit_speeds"][index - 1]
-                default_duration = float(stsu["default_duration"])
-                correlation = float(stsu["transit_auto_correlation"])
-                erow_speed_global = float(stsu["global_erow_speed"])
-            else:
-                continue
-            segments = line.segments()
-            number_of_segments = segments.__length_hint__()
-            for segment in segments:
-                if segment.allow_alightings is True and segment.allow_boardings is True:
-                    segment.dwell_time = 0.01
-                else:
-                    segment.dwell_time = 0.0
-
-                if segment.j_node is None:
-                    break
-
-                segment_number = segment.number
-                segment.transit_time_func = stsu_ttf_map[segment.transit_time_func]
-                time = segment.link.auto_time
-
-                if time > 0.0:
-                    if segment.transit_time_func in ttfs_xrow:
-                        if erow_defined is True and segment["@erow_speed"] > 0.0:
-                            segment.data1 = segment["@erow_speed"]
-                        else:
-                            segment.data1 = erow_speed_global
-                    else:
-                        segment.data1 = (segment.link.length * 60.0) / (time * correlation)
-                if time <= 0.0:
-                    if erow_defined is True and segment["@erow_speed"] > 0.0:
-                        segment.data1 = segment["@erow_speed"]
-                    else:
-                        if segment_number <= 1 or segment_number >= (number_of_segments - 1):
-                            segment.data1 = 20
-                        else:
-                            segment.data1 = erow_speed_global
-                if segment_number == 0:
-                    continue
-                segment.dwell_time = (segment["@tstop"] * default_duration) / 60
-        data = network.get_attribute_values("TRANSIT_SEGMENT", ["dwell_time", "transit_time_func", "data1"])
-        scenario.set_attribute_values("TRANSIT_SEGMENT", ["dwell_time", "transit_time_func", "data1"], data)
+        stsu_model = self._build_surface_transit_speed_model(scenario, parameters, stsu_att, ["auto_time"])
+        stsu_model.base_speeds(scenario, stsu_ttf_map, ttfs_xrow, erow_defined)
         ttfs_changed.append(True)
 
+    def _build_surface_transit_speed_model(self, scenario, parameters, stsu_att, link_attributes=(), index=None):
+        """
+        Builds the vectorized surface transit speed model. Without an index, one is laid
+        out from a partial network of the scenario's transit lines.
+        """
+        if index is None:
+            network = scenario.get_partial_network(
+                ["LINK", "TRANSIT_SEGMENT", "TRANSIT_LINE", "TRANSIT_VEHICLE"], include_attributes=False
+            )
+            link_attributes = ["length"] + list(link_attributes)
+            network.set_attribute_values("LINK", link_attributes, scenario.get_attribute_values("LINK", link_attributes))
+            package = scenario.get_attribute_values("TRANSIT_SEGMENT", ["transit_time_func"])
+            index = _ct.SegmentIndex(
+                network, package[0], len(package[1]), capacity_attribute=None, link_attributes=link_attributes
+            )
+        return _ct.SurfaceTransitSpeedModel(
+            scenario, index, parameters["surface_transit_speeds"], stsu_att.id, parameters["assignment_period"]
+        )
+
     def _process_ttfs_xrow(self, parameters):
         ttfs_xrow = set()
         parameter_xrow_range = parameters["xrow_ttf_range"].split(",")
@@ -676,8 +656,9 @@ class AssignTransit(_m.Tool()):
                         )
                     alphas = congested_assignment[1]
                     strategies = congested_assignment[0]
-                    network = congested_assignment[2]
-            self._save_results(scenario, parameters, network, alphas, strategies, stsu_att)
+                    state = congested_assignment[2]
+                    stsu_model = congested_assignment[3]
+            self._save_results(scenario, parameters, state, stsu_model, alphas, strategies)
             trace.write(
                 name="TMG Congested Transit Assignment",
                 attributes={"assign_end_time": scenario.transit_assignment_timestamp},
@@ -716,6 +697,7 @@ class AssignTransit(_m.Tool()):
                 walk_time_perception_attribute_list,
             )
         else:
+            stsu_model = self._build_surface_transit_speed_model(scenario, parameters, stsu_att)
             for itr in range(0, max(1, parameters["iterations"])):
                 self._run_spec_uncongested(
                     scenario,
@@ -726,8 +708,11 @@ class AssignTransit(_m.Tool()):
                     impedance_matrix_list,
                     walk_time_perception_attribute_list,
                 )
-                network = scenario.get_network()
-                network = self._surface_transit_speed_update(scenario, parameters, network, 1, stsu_att)
+                values = stsu_model.index.read(scenario, ["transit_volume", "transit_boardings", "dwell_time"])
+                dwell_time, _ = stsu_model.dwell_times(
+                    values["transit_volume"], values["transit_boardings"], values["dwell_time"], 1
+                )
+                stsu_model.index.write(scenario, ["dwell_time"], [dwell_time])
 
     def _run_congested_assignment(
         self,
@@ -741,90 +726,296 @@ class AssignTransit(_m.Tool()):
         effective_headway_attribute_list,
         walk_time_perception_attribute_list,
     ):
-        for iteration in range(0, parameters["iterations"] + 1):
+        checkpoint_path = self._get_checkpoint_path(scenario)
+        write_checkpoints = parameters.get("write_checkpoints", False)
+        resume_from_checkpoint = parameters.get("resume_from_checkpoint", False)
+        fingerprint = None
+        if write_checkpoints or resume_from_checkpoint:
+            fingerprint = _ct.checkpoint_fingerprint(
+                [self._get_class_demand(scenario, demand_matrix) for demand_matrix in demand_matrix_list],
+                parameters["ttf_definitions"],
+            )
+        first_iteration = 0
+        converged = False
+        warm_start = None
+        last_iteration = None
+        if resume_from_checkpoint:
+            checkpoint = _ct.read_checkpoint(checkpoint_path)
+            if checkpoint is None:
+                print("No checkpoint found at %s, starting from iteration 0" % checkpoint_path)
+            else:
+                (
+                    strategies,
+                    alphas,
+                    state,
+                    stsu_model,
+                    assigned_class_demand,
+                    average_impedance,
+                ) = self._resume_from_checkpoint(scenario, parameters, stsu_att, checkpoint, fingerprint)
+                assigned_total_demand = sum(assigned_class_demand)
+                first_iteration = int(checkpoint["iteration"]) + 1
+                converged = bool(checkpoint["converged"])
+                print("Resuming from iteration %d" % first_iteration)
+        telemetry = _ct.TelemetryWriter(parameters["csvfile"], append=first_iteration > 0)
+        for iteration in range(first_iteration, parameters["iterations"] + 1):
+            if converged:
+                break
             with _trace("Iteration %d" % iteration):
                 print("Starting iteration %d" % iteration)
-
+                timer = _ct.PhaseTimer()
+                lambdaK = 1.0
+                cngap = crgap = norm_gap_difference = 0.0
+                last_iteration = iteration
                 if iteration == 0:
                     strategies = self._prep_strategy_files(scenario, parameters, demand_matrix_list)
-                    zeroes = [0.0] * _bank.dimensions["transit_segments"]
-                    setattr(scenario._net.segment, "data3", zeroes)
-                    self._run_extended_transit_assignment(
-                        scenario,
-                        parameters,
-                        iteration,
-                        strategies,
-                        demand_matrix_list,
-                        headway_fraction_attribute_list,
-                        effective_headway_attribute_list,
-                        walk_time_perception_attribute_list,
-                        impedance_matrix_list,
-                    )
+                    network = self._prepare_network(scenario, parameters)
+                    warm_start = self._load_warm_start(scenario, parameters, network)
+                    if warm_start is None:
+                        zeroes = [0.0] * _bank.dimensions["transit_segments"]
+                        setattr(scenario._net.segment, "data3", zeroes)
+                    else:
+                        # The initial assignment already sees the congestion of the previous run
+                        warm_index, warm_volume, warm_cost, warm_source_iterations = warm_start
+                        warm_index.write(scenario, ["data3"], [warm_cost])
+                    with timer.measure("extended_assignment"):
+                        self._run_extended_transit_assignment(
+                            scenario,
+                            parameters,
+                            iteration,
+                            strategies,
+                            demand_matrix_list,
+                            headway_fraction_attribute_list,
+                            effective_headway_attribute_list,
+                            walk_time_perception_attribute_list,
+                            impedance_matrix_list,
+                        )
                     alphas = [1.0]
-                    assigned_class_demand = self._compute_assigned_class_demand(
-                        scenario, demand_matrix_list, self.number_of_processors
-                    )
+                    with timer.measure("matrix_reduction"):
+                        assigned_class_demand = self._compute_assigned_class_demand(scenario, demand_matrix_list)
                     assigned_total_demand = sum(assigned_class_demand)
-                    network = self._prepare_network(scenario, parameters, stsu_att)
+                    state = self._build_assignment_state(scenario, parameters, network)
+                    if warm_start is not None:
+                        warm_congestion = self._apply_warm_start(
+                            state, warm_volume, warm_cost, warm_source_iterations, assigned_total_demand
+                        )
+                    # The network was only needed to lay out the segment arrays
+                    network = None
+                    stsu_model = None
                     if parameters["surface_transit_speed"] == True:
-                        network = self._surface_transit_speed_update(scenario, parameters, network, 1, stsu_att)
-                    average_min_trip_impedance = self._compute_min_trip_impedance(
-                        scenario, demand_matrix_list, assigned_class_demand, impedance_matrix_list
-                    )
-                    congestion_costs = self._get_congestion_costs(parameters, network, assigned_total_demand)
+                        with timer.measure("stsu"):
+                            stsu_model = self._build_surface_transit_speed_model(
+                                scenario, parameters, stsu_att, index=state.index
+                            )
+                            self._update_state_dwell_times(scenario, state, stsu_model, 1)
+                    with timer.measure("matrix_reduction"):
+                        average_min_trip_impedance = self._compute_min_trip_impedance(
+                            scenario, demand_matrix_list, assigned_class_demand, impedance_matrix_list
+                        )
+                    if warm_start is None:
+                        congestion_costs = self._get_congestion_costs(state, assigned_total_demand)
+                    else:
+                        congestion_costs = warm_congestion
                     average_impedance = average_min_trip_impedance + congestion_costs
-                    if parameters["csvfile"].lower() is not "":
-                        self._write_csv_files(iteration, network, "", "", "")
+                    telemetry.write(iteration, timer, **{"lambda": lambdaK})
                 else:
-                    excess_km = self._compute_segment_costs(scenario, parameters, network)
-                    self._run_extended_transit_assignment(
-                        scenario,
-                        parameters,
-                        iteration,
-                        strategies,
-                        demand_matrix_list,
-                        headway_fraction_attribute_list,
-                        effective_headway_attribute_list,
-                        walk_time_perception_attribute_list,
-                        impedance_matrix_list,
-                    )
-                    network = self._update_network(scenario, network)
-                    average_min_trip_impedance = self._compute_min_trip_impedance(
-                        scenario, demand_matrix_list, assigned_class_demand, impedance_matrix_list
-                    )
-                    find_step_size = self._find_step_size(
-                        parameters,
-                        network,
-                        average_min_trip_impedance,
-                        average_impedance,
-                        assigned_total_demand,
-                        alphas,
-                    )
+                    with timer.measure("segment_cost"):
+                        excess_km = self._compute_segment_costs(scenario, state)
+                    with timer.measure("extended_assignment"):
+                        self._run_extended_transit_assignment(
+                            scenario,
+                            parameters,
+                            iteration,
+                            strategies,
+                            demand_matrix_list,
+                            headway_fraction_attribute_list,
+                            effective_headway_attribute_list,
+                            walk_time_perception_attribute_list,
+                            impedance_matrix_list,
+                        )
+                        state.refresh(scenario)
+                    with timer.measure("matrix_reduction"):
+                        average_min_trip_impedance = self._compute_min_trip_impedance(
+                            scenario, demand_matrix_list, assigned_class_demand, impedance_matrix_list
+                        )
+                    with timer.measure("step_size"):
+                        find_step_size = self._find_step_size(
+                            parameters,
+                            state,
+                            average_min_trip_impedance,
+                            average_impedance,
+                            assigned_total_demand,
+                            alphas,
+                        )
                     lambdaK = find_step_size[0]
                     alphas = find_step_size[1]
-                    print("iteration %s  lambdaK %s" % (iteration, lambdaK))
+                    gradient_evaluations = find_step_size[2]
+                    print(
+                        "iteration %s  lambdaK %s  gradient evaluations %s" % (iteration, lambdaK, gradient_evaluations)
+                    )
                     if parameters["surface_transit_speed"] == True:
-                        network = self._surface_transit_speed_update(scenario, parameters, network, lambdaK, stsu_att)
-                    self._update_volumes(network, lambdaK)
+                        with timer.measure("stsu"):
+                            self._update_state_dwell_times(scenario, state, stsu_model, lambdaK)
+                    with timer.measure("volume_update"):
+                        state.update_volumes(lambdaK)
                     (average_impedance, cngap, crgap, norm_gap_difference, net_cost,) = self._compute_gaps(
                         parameters,
                         assigned_total_demand,
                         lambdaK,
                         average_min_trip_impedance,
                         average_impedance,
-                        network,
+                        state,
                     )
-                    if parameters["csvfile"].lower() is not "":
-                        self._write_csv_files(
-                            iteration,
-                            network,
-                            cngap,
-                            crgap,
-                            norm_gap_difference,
-                        )
-                    if crgap < parameters["rel_gap"] or norm_gap_difference >= 0:
-                        break
-        return (strategies, alphas, network)
+                    telemetry.write(
+                        iteration,
+                        timer,
+                        cngap=cngap,
+                        crgap=crgap,
+                        norm_gap_difference=norm_gap_difference,
+                        excess_km=excess_km,
+                        gradient_evaluations=gradient_evaluations,
+                        **{"lambda": lambdaK}
+                    )
+                    converged = crgap < parameters["rel_gap"] or norm_gap_difference >= 0
+                if write_checkpoints:
+                    strategies._save_config()
+                    _ct.write_checkpoint(
+                        checkpoint_path,
+                        state,
+                        iteration=iteration,
+                        converged=converged,
+                        alphas=alphas,
+                        lambdaK=lambdaK,
+                        cngap=cngap,
+                        crgap=crgap,
+                        norm_gap_difference=norm_gap_difference,
+                        average_impedance=average_impedance,
+                        assigned_class_demand=assigned_class_demand,
+                        class_names=[transit_class["name"] for transit_class in parameters["transit_classes"]],
+                        fingerprint=fingerprint,
+                    )
+        if warm_start is not None:
+            self._report_warm_start(parameters, warm_source_iterations, last_iteration)
+        return (strategies, alphas, state, stsu_model)
+
+    def _load_warm_start(self, scenario, parameters, network):
+        """
+        Loads the segment volumes to warm start the congested assignment from, either the
+        stored results of "warm_start_scenario" or the MSA volumes of the checkpoint file
+        "warm_start_checkpoint".
+
+        Returns: None when no warm start is requested, otherwise (index, volume, cost,
+            source_iterations) where volume and cost are line-ordered over index and
+            source_iterations is the number of iterations the source run took, if known.
+        """
+        source_number = int(parameters.get("warm_start_scenario", 0) or 0)
+        checkpoint_file = parameters.get("warm_start_checkpoint", "") or ""
+        if source_number == 0 and checkpoint_file == "":
+            return None
+        package = scenario.get_attribute_values("TRANSIT_SEGMENT", ["transit_volume"])
+        index = _ct.SegmentIndex(network, package[0], len(package[1]))
+        if checkpoint_file != "":
+            checkpoint = _ct.read_checkpoint(checkpoint_file)
+            if checkpoint is None:
+                raise Exception("The warm start checkpoint '%s' does not exist." % checkpoint_file)
+            checkpoint_index = _ct.checkpoint_package_index(checkpoint)
+            if checkpoint_index is None:
+                raise Exception(
+                    "The warm start checkpoint does not store the lines and nodes of its segments, write it again."
+                )
+            # Segments are matched by line and nodes, as for a warm start scenario
+            volume = _ct.SegmentIndex(network, checkpoint_index, int(checkpoint["sizes"][0])).gather(checkpoint["voltr"])
+            source_iterations = int(checkpoint["iteration"])
+        else:
+            source = _bank.scenario(source_number)
+            if source is None:
+                raise Exception("The warm start scenario %s does not exist." % source_number)
+            source_package = source.get_attribute_values("TRANSIT_SEGMENT", ["transit_volume"])
+            # Segments are matched by line and nodes, so the source may hold a different transit network
+            volume = _ct.SegmentIndex(network, source_package[0], len(source_package[1])).gather(source_package[1])
+            alphas = (source.transit_strategies.data or {}).get("alphas")
+            source_iterations = len(alphas) - 1 if alphas else None
+        kernel = _ct.SegmentCostKernel(index, parameters["ttf_definitions"])
+        return index, volume, kernel.cost(volume), source_iterations
+
+    def _apply_warm_start(self, state, warm_volume, warm_cost, source_iterations, assigned_total_demand):
+        """
+        Starts the MSA volumes of a warm started initial assignment, whose transit times include
+        the congestion of the warm start volumes, from the warm start volumes. The initial
+        assignment is averaged in with the MSA step the source run would have taken next,
+        1 / (source_iterations + 2), or 1 / 2 when the number of source iterations is unknown.
+
+        Only the segment volumes are carried over. Boardings, alightings and auxiliary transit
+        volumes start from the initial assignment, and the strategies (and so the alphas used
+        to extract the output matrices) only cover the assignments of this run.
+
+        Returns: The congestion cost to add to the average minimum trip impedance, which is
+            the change in cost from the warm start congestion to that of the averaged volumes.
+        """
+        step = 0.5 if source_iterations is None else 1.0 / (source_iterations + 2)
+        state.timtr = state.transit_time / (1.0 + warm_cost)
+        congestion_costs = state.kernel.network_costs(
+            step,
+            warm_volume,
+            state.transit_volume,
+            state.transit_time,
+            state.dwell_time,
+            warm_cost,
+            assigned_total_demand=assigned_total_demand,
+        )
+        state.voltr = warm_volume + step * (state.transit_volume - warm_volume)
+        state.current_voltr = state.voltr.copy()
+        return congestion_costs
+
+    def _report_warm_start(self, parameters, source_iterations, last_iteration):
+        if source_iterations is not None:
+            reference, reference_name = source_iterations, "the warm start source run"
+        else:
+            reference, reference_name = parameters["iterations"], "the iteration limit"
+        saved = max(0, reference - last_iteration)
+        message = "Warm start: converged after %d iterations, %d fewer than %s (%d)" % (
+            last_iteration,
+            saved,
+            reference_name,
+            reference,
+        )
+        print(message)
+        _write(message)
+
+    def _get_checkpoint_path(self, scenario):
+        """The congested assignment checkpoint is kept next to the scenario's strategy files."""
+        return os.path.join(
+            os.path.dirname(scenario.emmebank.path), "STRATS_s%s" % scenario.number, "congested_checkpoint.npz"
+        )
+
+    def _resume_from_checkpoint(self, scenario, parameters, stsu_att, checkpoint, fingerprint):
+        """
+        Rebuilds the congested assignment from the last completed iteration of a checkpoint,
+        reusing the strategy files of the earlier iterations. fingerprint is the
+        checkpoint_fingerprint of this run's demand matrices and TTF definitions.
+        """
+        class_names = [transit_class["name"] for transit_class in parameters["transit_classes"]]
+        if [str(name) for name in checkpoint["class_names"]] != class_names:
+            raise Exception("The checkpoint was written for different transit classes and cannot be resumed.")
+        if "fingerprint" not in checkpoint or str(checkpoint["fingerprint"]) != fingerprint:
+            raise Exception(
+                "The checkpoint was written for different demand matrices or TTF definitions and cannot be resumed."
+            )
+        strategies = scenario.transit_strategies
+        network = self._prepare_network(scenario, parameters)
+        state = self._build_assignment_state(scenario, parameters, network)
+        state.restore(checkpoint)
+        state.index.write(scenario, ["dwell_time"], [state.dwell_time])
+        stsu_model = None
+        if parameters["surface_transit_speed"] == True:
+            stsu_model = self._build_surface_transit_speed_model(scenario, parameters, stsu_att, index=state.index)
+        return (
+            strategies,
+            [float(alpha) for alpha in checkpoint["alphas"]],
+            state,
+            stsu_model,
+            [float(demand) for demand in checkpoint["assigned_class_demand"]],
+            float(checkpoint["average_impedance"]),
+        )
 
     def _run_spec_uncongested(
         self,
@@ -972,40 +1163,6 @@ class AssignTransit(_m.Tool()):
         ]
         return base_spec
 
-    def _surface_transit_speed_update(self, scenario, parameters, network, lambdaK, stsu_att):
-        if "transit_alightings" not in network.attributes("TRANSIT_SEGMENT"):
-            network.create_attribute("TRANSIT_SEGMENT", "transit_alightings", 0.0)
-        has_doors = scenario.extra_attribute("@doors") is not None
-        for line in network.transit_lines():            
-            index = line[stsu_att.id]
-            if index <= 0.0:
-                continue
-            stsu = parameters["surface_transit_speeds"][int(index) - 1]
-            boarding_duration = stsu["boarding_duration"]
-            alighting_duration = stsu["alighting_duration"]
-            default_duration = stsu["default_duration"]
-
-            door_pairs = max(1.0, segment.line["@doors"] / 2.0) if has_doors else 1.0
-            inv_door_pair_runs = 1.0 / (door_pairs * parameters["assignment_period"] * 60.0 / line.headway)
-            prev_volume = 0.0
-            for segment in line.segments(include_hidden=False):
-                segment_number = segment.number
-                if segment_number > 0 and segment.j_node is not None:
-                    segment.transit_alightings = max(
-                        prev_volume + segment.transit_boardings - segment.transit_volume,
-                        0.0)
-                else:
-                    continue
-                # prev_volume is used above for the previous segments volume, the first segment is always ignored.
-                prev_volume = segment.transit_volume
-                segment_dwell_time = min(99.8, ((boarding_duration * segment.transit_boardings * inv_door_pair_runs)
-                    + (alighting_duration * segment.transit_alightings * inv_door_pair_runs)
-                    + (segment["@tstop"] * default_duration)) / 60)
-                segment.dwell_time = segment.dwell_time * (1 - lambdaK) + segment_dwell_time * lambdaK
-        data = network.get_attribute_values("TRANSIT_SEGMENT", ["dwell_time"])
-        scenario.set_attribute_values("TRANSIT_SEGMENT", ["dwell_time"], data)
-        return network
-
     def _add_cong_term_to_func(self, scenario):
         used_functions = set()
         any_non_zero = False
@@ -1052,30 +1209,19 @@ class AssignTransit(_m.Tool()):
     def _get_func_spec(self, parameters):
         partial_spec = (
             "import math \ndef calc_segment_cost(transit_volume, capacity, segment):"
-            + "\n    one_minus_vc = (1 - transit_volume / capacity)"
+            + "\n    vc = transit_volume / capacity"
+            + "\n    one_minus_vc = (1 - vc)"
         )
         i = 0
         for ttf_def in parameters["ttf_definitions"]:
             ttf = str(ttf_def["ttf"])
-            alpha = ttf_def["congestion_exponent"]
-            beta = (2 * alpha - 1) / (2 * alpha - 2)
-            perception = ttf_def["congestion_perception"]
+            function = _ct.get_congestion_function(ttf_def)
             partial_spec += (
-                    ("\n    if segment.transit_time_func == " if i == 0 else 
-                     "\n    elif segment.transit_time_func == ")  
-                    + ttf
-                    + ": \n        return max(0,("
-                    + f"{perception}"
-                    + " * (1 + math.sqrt("
-                    + str(alpha * alpha)
-                    + " * one_minus_vc * one_minus_vc + "
-                    + str(beta * beta)
-                    + ") - "
-                    + str(alpha)
-                    + " * one_minus_vc - "
-                    + str(beta)
-                    + ")))"
-                )
+                ("\n    if segment.transit_time_func == " if i == 0 else "\n    elif segment.transit_time_func == ")
+                + ttf
+                + ": \n        return "
+                + function.source()
+            )
             i += 1
         partial_spec += '\n    raise Exception("ttf=%s congestion values not defined in input" %segment.transit_time_func)'
         func_spec = {
@@ -1283,108 +1429,87 @@ class AssignTransit(_m.Tool()):
         strategies.data = data
         return strategies
 
-    def _compute_assigned_class_demand(self, scenario, demand_matrix_list, number_of_processors):
+    def _get_class_demand(self, scenario, demand_matrix):
+        """
+        Returns the demand of a class as a float64 array. Demand does not change
+        across iterations so each matrix is only read from the bank once per run.
+        """
+        demand = self._class_demand_cache.get(demand_matrix.id)
+        if demand is None:
+            data = demand_matrix.get_data(scenario.number).to_numpy()
+            demand = np.asarray(data, dtype=np.float64)
+            self._class_demand_cache[demand_matrix.id] = demand
+        return demand
+
+    def _compute_assigned_class_demand(self, scenario, demand_matrix_list):
         assigned_demand = []
-        for i in range(0, len(demand_matrix_list)):
-            matrix_calc_spec = {
-                "type": "MATRIX_CALCULATION",
-                "expression": str(demand_matrix_list[i]) + " * (p.ne.q)",
-                "aggregation": {"origins": "+", "destinations": "+"},
-            }
-            report = matrix_calc_tool(
-                specification=matrix_calc_spec,
-                scenario=scenario,
-                num_processors=number_of_processors,
-            )
-            trips = report["result"]
+        for demand_matrix in demand_matrix_list:
+            demand = self._get_class_demand(scenario, demand_matrix)
+            # Intrazonal trips are not assigned, so the diagonal is left out
+            trips = float(demand.sum() - np.trace(demand))
             if trips <= 0:
                 raise Exception("Invalid number of trips assigned")
             assigned_demand.append(trips)
         return assigned_demand
 
     def _compute_min_trip_impedance(self, scenario, demand_matrix_list, assigned_class_demand, impedance_matrix_list):
-        average_min_trip_impedance = 0.0
-        class_imped = []
-        for i in range(0, len(assigned_class_demand)):
-            matrix_calc_spec = {
-                "type": "MATRIX_CALCULATION",
-                "expression": str(impedance_matrix_list[i].id)
-                + "*"
-                + str(demand_matrix_list[i])
-                + "/"
-                + str(assigned_class_demand[i]),
-                "aggregation": {"origins": "+", "destinations": "+"},
-            }
-            report = matrix_calc_tool(
-                specification=matrix_calc_spec,
-                scenario=scenario,
-                num_processors=self.number_of_processors,
-            )
-            class_imped.append(float(report["result"]))
-        for i in range(0, len(assigned_class_demand)):
-            average_min_trip_impedance += class_imped[i] * assigned_class_demand[i]
-        average_min_trip_impedance = average_min_trip_impedance / sum(assigned_class_demand)
+        total_impedance = 0.0
+        for demand_matrix, impedance_matrix in zip(demand_matrix_list, impedance_matrix_list):
+            demand = self._get_class_demand(scenario, demand_matrix)
+            impedance = impedance_matrix.get_data(scenario.number).to_numpy()
+            total_impedance += float(np.vdot(demand, impedance))
+        average_min_trip_impedance = total_impedance / sum(assigned_class_demand)
         return average_min_trip_impedance
 
-    def _get_congestion_costs(self, parameters, network, assigned_total_demand):
-        congestion_cost = 0.0
-        for line in network.transit_lines():
-            capacity = float(line.total_capacity)
-            for segment in line.segments():
-                flow_X_time = float(segment.voltr) * (float(segment.timtr) - float(segment.dwell_time))
-                congestion = self._calculate_segment_cost(parameters, float(segment.voltr), capacity, segment)
-                congestion_cost += flow_X_time * congestion
-        return congestion_cost / assigned_total_demand
-
-    def _prepare_network(self, scenario, parameters, stsu_att):
+    def _get_congestion_costs(self, state, assigned_total_demand):
+        return state.kernel.congestion_costs(state.voltr, state.timtr, state.dwell_time, assigned_total_demand)
+
+    def _prepare_network(self, scenario, parameters):
         network = scenario.get_partial_network(
             ["LINK", "TRANSIT_SEGMENT", "TRANSIT_LINE", "TRANSIT_VEHICLE"],
             include_attributes=False,
         )
         attributes_to_copy = {
             "TRANSIT_VEHICLE": ["total_capacity"],
-            "NODE": ["initial_boardings", "final_alightings"],
-            "LINK": ["length", "aux_transit_volume", "auto_time"],
-            "TRANSIT_LINE": ["headway", str(stsu_att.id), "data2", "@doors"],
-            "TRANSIT_SEGMENT": [
-                "dwell_time",
-                "transit_volume",
-                "transit_time",
-                "transit_boardings",
-                "transit_time_func",
-                "@tstop",
-            ],
+            "LINK": ["length"],
+            "TRANSIT_LINE": ["headway"],
+            "TRANSIT_SEGMENT": ["transit_time_func"],
         }
-        if scenario.extra_attribute("@tstop") is None:
-            if parameters["surface_transit_speed"] is False:
-                attributes_to_copy["TRANSIT_SEGMENT"].remove("@tstop")
-            else:
+        if parameters["surface_transit_speed"] == True:
+            if scenario.extra_attribute("@tstop") is None:
                 raise Exception(
                     "@tstop attribute needs to be defined. @tstop is an integer that shows how many transit stops are on each transit segment."
                 )
-        if "auto_time" not in scenario.attributes("LINK"):
-            if parameters["surface_transit_speed"] == False:
-                attributes_to_copy["LINK"].remove("auto_time")
-            else:
+            if "auto_time" not in scenario.attributes("LINK"):
                 raise Exception("An auto assignment needs to be present on the scenario")
-        if scenario.extra_attribute("@doors") is None:
-            attributes_to_copy["TRANSIT_LINE"].remove("@doors")
         for type, atts in attributes_to_copy.items():
             atts = list(atts)
             data = scenario.get_attribute_values(type, atts)
             network.set_attribute_values(type, atts, data)
-        for type, mapping in self._attribute_mapping().items():
-            for source, dest in mapping.items():
-                network.copy_attribute(type, source, dest)
-        network.create_attribute("TRANSIT_SEGMENT", "current_voltr")
-        network.create_attribute("TRANSIT_SEGMENT", "cost")
         network.create_attribute("TRANSIT_LINE", "total_capacity")
-        network.copy_attribute("TRANSIT_SEGMENT", "transit_time", "uncongested_time")
-        network.copy_attribute("TRANSIT_SEGMENT", "dwell_time", "base_dwell_time")
         for line in network.transit_lines():
             line.total_capacity = 60.0 * parameters["assignment_period"] * line.vehicle.total_capacity / line.headway
         return network
 
+    def _build_assignment_state(self, scenario, parameters, network):
+        """
+        Loads the results of the initial assignment into the array-backed MSA state. The
+        network is only walked once here, to lay out the transit segments.
+        """
+        return _ct.CongestedAssignmentState(
+            scenario, network, parameters["ttf_definitions"], reference=self.use_reference_kernel
+        )
+
+    def _update_state_dwell_times(self, scenario, state, stsu_model, lambdaK):
+        """
+        Runs the surface transit speed update for the latest assignment and keeps the
+        resulting dwell times in the state.
+        """
+        state.dwell_time, _ = stsu_model.dwell_times(
+            state.transit_volume, state.transit_boardings, state.dwell_time, lambdaK
+        )
+        state.index.write(scenario, ["dwell_time"], [state.dwell_time])
+
     def _get_transit_assignment_spec(
         self,
         scenario,
@@ -1504,132 +1629,34 @@ class AssignTransit(_m.Tool()):
         ]
         return base_spec
 
-    def _attribute_mapping(self):
-        atts = {
-            "NODE": {"initial_boardings": "inboa", "final_alightings": "fiali"},
-            "LINK": {"aux_transit_volume": "volax"},
-            "TRANSIT_SEGMENT": {
-                "transit_time": "timtr",
-                "transit_volume": "voltr",
-                "transit_boardings": "board",
-            },
-        }
-        return atts
-
-    def _calculate_segment_cost(self, parameters, transit_volume, capacity, segment):
-        ttf = segment.transit_time_func
-        for ttf_def in parameters["ttf_definitions"]:
-            if ttf == ttf_def["ttf"]:
-                alpha = ttf_def["congestion_exponent"]
-                beta = (2 * alpha - 1) / (2 * alpha - 2)
-                alpha_square = alpha * alpha
-                beta_square = beta * beta
-
-                return max(
-                    0,
-                    ttf_def["congestion_perception"]
-                    * (
-                        1
-                        + math.sqrt(alpha_square * (1 - transit_volume / capacity) ** 2 + beta_square)
-                        - alpha * (1 - transit_volume / capacity)
-                        - beta
-                    ),
-                )
-        raise Exception("TTF definitions do not contain TTF%s" % str(ttf))
-
-    def _compute_segment_costs(self, scenario, parameters, network):
-        excess_km = 0.0
-        for line in network.transit_lines():
-            capacity = line.total_capacity
-            for segment in line.segments():
-                volume = segment.current_voltr = segment.voltr
-                length = segment.link.length
-                if volume >= capacity:
-                    excess = volume - capacity
-                    excess_km += excess * length
-                segment.cost = self._calculate_segment_cost(parameters, segment.voltr, capacity, segment)
-        values = network.get_attribute_values("TRANSIT_SEGMENT", ["cost"])
-        scenario.set_attribute_values("TRANSIT_SEGMENT", ["data3"], values)
+    def _compute_segment_costs(self, scenario, state):
+        excess_km = state.update_segment_costs()
+        state.index.write(scenario, ["data3"], [state.cost])
         return excess_km
 
-    def _update_network(self, scenario, network):
-        attribute_mapping = self._attribute_mapping()
-        attribute_mapping["TRANSIT_SEGMENT"]["dwell_time"] = "dwell_time"
-        for type, mapping in attribute_mapping.items():
-            attributes = mapping.keys()
-            data = scenario.get_attribute_values(type, attributes)
-            network.set_attribute_values(type, attributes, data)
-        return network
-
     def _find_step_size(
-        self, parameters, network, average_min_trip_impedance, average_impedance, assigned_total_demand, alphas
+        self, parameters, state, average_min_trip_impedance, average_impedance, assigned_total_demand, alphas
     ):
-        approx1 = 0.0
-        approx2 = 0.5
-        approx3 = 1.0
-        grad1 = average_min_trip_impedance - average_impedance
-        grad2 = self._compute_gradient(parameters, assigned_total_demand, approx2, network)
-        grad2 += average_min_trip_impedance - average_impedance
-        grad3 = self._compute_gradient(parameters, assigned_total_demand, approx3, network)
-        grad3 += average_min_trip_impedance - average_impedance
-        # print("m_step lambdak")
-        for m_steps in range(0, 21):
-            h1 = approx2 - approx1
-            h2 = approx3 - approx2
-            delta1 = (grad2 - grad1) / h1
-            delta2 = (grad3 - grad2) / h2
-            d = (delta2 - delta1) / (h1 + h2)
-            b = h2 * d + delta2
-            t1 = grad3 * d * 4
-            t2 = b ** 2
-            if t2 > t1:
-                temp = math.sqrt(t2 - t1)
-            else:
-                temp = 0.0
-            if abs(b - temp) < abs(b + temp):
-                temp = b + temp
-            else:
-                temp = b - temp
-            if temp == 0.0:
-                raise Exception(
-                    "Congested transit assignment cannot be applied to this transit network, please use Capacitated transit assignment instead."
-                )
-            temp = -2 * grad3 / temp
-            lambdaK = approx3 + temp
-            temp = abs(temp) * 100000.0
-            if temp < 100:
-                break
-            grad = self._compute_gradient(parameters, assigned_total_demand, lambdaK, network)
-            grad += average_min_trip_impedance - average_impedance
-            approx1 = approx2
-            approx2 = approx3
-            approx3 = lambdaK
-            grad1 = grad2
-            grad2 = grad3
-            grad3 = grad
-        lambdaK = max(0.0, min(1.0, lambdaK))
+        terms = state.volume_terms()
+
+        def compute_gradients(lambdas, derivative=False):
+            return state.kernel.gradient_batch(
+                lambdas, *terms, assigned_total_demand=assigned_total_demand, derivative=derivative
+            )
+
+        search = _ct.StepSizeSearch(
+            tolerance=parameters.get("step_size_tolerance", 0.001),
+            # 0 uses the default number of passes of the method
+            max_passes=parameters.get("step_size_max_passes", None) or None,
+            method=parameters.get("step_size_method", "newton"),
+        )
+        lambdaK, evaluations = search.solve(compute_gradients, average_min_trip_impedance - average_impedance)
+        if self.check_step_size:
+            difference = search.check(compute_gradients, average_min_trip_impedance - average_impedance, lambdaK)
+            print("step size difference from the Muller search %g" % difference)
         alphas = [a * (1 - lambdaK) for a in alphas]
         alphas.append(lambdaK)
-        return lambdaK, alphas
-
-    def _compute_gradient(self, parameters, assigned_total_demand, lambdaK, network):
-        value = 0.0
-        for line in network.transit_lines():
-            capacity = float(line.total_capacity)
-            for segment in line.segments():
-                assigned_volume = float(segment.current_voltr)
-                cumulative_volume = float(segment.transit_volume)
-                t0 = (segment.transit_time - segment.dwell_time) / (1 + segment.cost)
-                volume_difference = cumulative_volume - assigned_volume
-                if lambdaK == 1:
-                    adjusted_volume = cumulative_volume
-                else:
-                    adjusted_volume = assigned_volume + lambdaK * (cumulative_volume - assigned_volume)
-                cost_difference = self._calculate_segment_cost(
-                    parameters, adjusted_volume, capacity, segment
-                ) - self._calculate_segment_cost(parameters, assigned_volume, capacity, segment)
-                value += t0 * cost_difference * volume_difference
-        return value / assigned_total_demand
+        return lambdaK, alphas, evaluations
 
     def _create_journey_level_modes(self, modes, partial_network, level):
         mode_list = []
@@ -1648,21 +1675,6 @@ class AssignTransit(_m.Tool()):
                     mode_list.append({"mode": mode.id, "next_journey_level": level})
         return mode_list
 
-    def _update_volumes(self, network, lambdaK):
-        alpha = 1 - lambdaK
-        for node in network.regular_nodes():
-            node.inboa = node.inboa * alpha + node.initial_boardings * lambdaK
-            node.fiali = node.fiali * alpha + node.final_alightings * lambdaK
-        for link in network.links():
-            link.volax = link.volax * alpha + link.aux_transit_volume * lambdaK
-        for line in network.transit_lines():
-            capacity = float(line.total_capacity)
-            congested = False
-            for segment in line.segments():
-                segment.voltr = segment.voltr * alpha + segment.transit_volume * lambdaK
-                segment.board = segment.board * alpha + segment.transit_boardings * lambdaK
-        return
-
     def _compute_gaps(
         self,
         parameters,
@@ -1670,10 +1682,10 @@ class AssignTransit(_m.Tool()):
         lambdaK,
         average_min_trip_impedance,
         previous_average_min_trip_impedance,
-        network,
+        state,
     ):
         cngap = previous_average_min_trip_impedance - average_min_trip_impedance
-        net_costs = self._compute_network_costs(parameters, assigned_total_demand, lambdaK, network)
+        net_costs = state.kernel.network_costs(lambdaK, *state.volume_terms(), assigned_total_demand=assigned_total_demand)
         average_impedance = (
             lambdaK * average_min_trip_impedance + (1 - lambdaK) * previous_average_min_trip_impedance + net_costs
         )
@@ -1681,62 +1693,26 @@ class AssignTransit(_m.Tool()):
         norm_gap_difference = (parameters["norm_gap"] - cngap) * 100000.0
         return (average_impedance, cngap, crgap, norm_gap_difference, net_costs)
 
-    def _compute_network_costs(self, parameters, assigned_total_demand, lambdaK, network):
-        value = 0.0
-        for line in network.transit_lines():
-            capacity = float(line.total_capacity)
-            for segment in line.segments():
-                assigned_volume = segment.current_voltr
-                cumulative_volume = segment.transit_volume
-                t0 = (segment.transit_time - segment.dwell_time) / (1 + segment.cost)
-                volume_difference = assigned_volume + lambdaK * (cumulative_volume - assigned_volume)
-                adjusted_volume = assigned_volume + lambdaK * (cumulative_volume - assigned_volume)
-                cost_difference = self._calculate_segment_cost(
-                    parameters, adjusted_volume, capacity, segment
-                ) - self._calculate_segment_cost(parameters, assigned_volume, capacity, segment)
-                value += t0 * cost_difference * volume_difference
-        return value / assigned_total_demand
-
-    def _save_results(self, scenario, parameters, network, alphas, strategies, stsu_att):
+    def _save_results(self, scenario, parameters, state, stsu_model, alphas, strategies):
         if scenario.extra_attribute("@ccost") is not None:
-            ccost = scenario.extra_attribute("@ccost")
             scenario.delete_extra_attribute("@ccost")
-            network.delete_attribute(ccost.type, "@ccost")
         type = "TRANSIT_SEGMENT"
         congestion_attribute = scenario.create_extra_attribute(type, "@ccost")
         congestion_attribute.description = "congestion cost"
-        network.create_attribute(type, "@ccost")
-        for line in network.transit_lines():
-            capacity = float(line.total_capacity)
-            i = 0
-            for segment in line.segments():
-                volume = float(segment.voltr)
-                congestion_term = self._calculate_segment_cost(parameters, volume, capacity, segment)
-                base_time = float(segment.uncongested_time) - float(line.segment(i + 1).base_dwell_time)
-                segment.transit_time = (base_time + float(line.segment(i + 1).dwell_time)) * (1 + congestion_term)
-                segment["@ccost"] = segment.transit_time - base_time
-                i += 1
-        attribute_mapping = self._attribute_mapping()
-        attribute_mapping["TRANSIT_SEGMENT"]["@ccost"] = "@ccost"
-        attribute_mapping["TRANSIT_SEGMENT"]["transit_time"] = "transit_time"
-        for type, mapping in attribute_mapping.items():
-            data = network.get_attribute_values(type, mapping.values())
-            scenario.set_attribute_values(type, mapping.keys(), data)
+        transit_time, congestion_cost = state.congested_times()
+        state.write_volumes(scenario)
+        state.index.write(scenario, ["transit_time", "@ccost"], [transit_time, congestion_cost])
         if parameters["surface_transit_speed"] is True:
-            data = scenario.get_attribute_values("TRANSIT_SEGMENT", ["transit_volume", "transit_boardings"])
-            network.set_attribute_values("TRANSIT_SEGMENT", ["transit_volume", "transit_boardings"], data)
-            net_edit.create_segment_alightings_attribute(network)
-            network = self._surface_transit_speed_update(scenario, parameters, network, 1, stsu_att)
-            data = network.get_attribute_values("TRANSIT_SEGMENT", ["transit_boardings", "transit_alightings"])
-            scenario.set_attribute_values("TRANSIT_SEGMENT", ["@boardings", "@alightings"], data)
+            dwell_time, alightings = stsu_model.dwell_times(state.voltr, state.board, state.dwell_time, 1)
+            state.index.write(
+                scenario, ["dwell_time", "@boardings", "@alightings"], [dwell_time, state.board, alightings]
+            )
         strategies.data["alphas"] = alphas
         strategies._save_config()
 
-    def _extract_output_matrices(
+    def _plan_output_extraction(
         self,
-        scenario,
         parameters,
-        demand_matrix_list,
         walk_time_matrix_list,
         wait_time_matrix_list,
         board_penalty_matrix_list,
@@ -1744,154 +1720,121 @@ class AssignTransit(_m.Tool()):
         congestion_matrix_list,
         fare_matrix_list,
     ):
+        """
+        Builds, for each transit class, the matrix results and strategy analyses needed to
+        fill only the output matrices that were requested. In-vehicle times that are the
+        actual segment times come out of the same matrix results traversal as the walk,
+        wait and boarding times instead of needing a strategy analysis of their own.
+
+        Returns: A list with a (matrix_results, strategy_analyses) tuple per class, where
+            matrix_results maps result keys to matrices and strategy_analyses maps
+            (in_vehicle, aux_transit) components to the result matrix.
+        """
+        congested = parameters["congested_assignment"] is True
+        actual_in_vehicle_times = parameters["calculate_congested_ivtt_flag"] is True or not congested
+        plans = []
         for i, transit_class in enumerate(parameters["transit_classes"]):
-            if walk_time_matrix_list[i] or wait_time_matrix_list or board_penalty_matrix_list[i]:
-                self._extract_times_matrices(
-                    i, scenario, transit_class, wait_time_matrix_list, board_penalty_matrix_list, walk_time_matrix_list
-                )
+            matrix_results = {}
+            strategy_analyses = {}
+            for key, matrix in (
+                ("actual_total_waiting_times", wait_time_matrix_list[i]),
+                ("actual_aux_transit_times", walk_time_matrix_list[i]),
+                ("actual_total_boarding_times", board_penalty_matrix_list[i]),
+            ):
+                if matrix is not None:
+                    matrix_results[key] = matrix
             if in_vehicle_time_matrix_list[i] is not None:
-                with _util.temp_extra_attribute_manager(scenario, "TRANSIT_SEGMENT") as temp_in_vehicle_times_attribute:
-                    if parameters["calculate_congested_ivtt_flag"] is True:
-                        self._extract_in_vehicle_times(
-                            i,
-                            scenario,
-                            parameters,
-                            transit_class,
-                            temp_in_vehicle_times_attribute,
-                            demand_matrix_list,
-                            in_vehicle_time_matrix_list,
-                            True,
-                        )
-                    else:
-                        self._extract_in_vehicle_times(
-                            i,
-                            scenario,
-                            parameters,
-                            transit_class,
-                            temp_in_vehicle_times_attribute,
-                            demand_matrix_list,
-                            in_vehicle_time_matrix_list,
-                            False,
-                        )
-            if parameters["congested_assignment"] is True:
-                if congestion_matrix_list[i] is not None:
-                    self._extract_congestion_matrix(
-                        i, scenario, transit_class, congestion_matrix_list[i], demand_matrix_list
-                    )
-            if fare_matrix_list[i]:
-                self._extract_cost_matrix(i, scenario, transit_class, demand_matrix_list, fare_matrix_list)
-
-    def _extract_times_matrices(
-        self, i, scenario, transit_class, wait_time_matrix_list, board_penalty_matrix_list, walk_time_matrix_list
-    ):
-        spec = {
-            "by_mode_subset": {
-                "modes": ["*"],
-                "actual_aux_transit_times": wait_time_matrix_list[i],
-                "actual_total_boarding_times": board_penalty_matrix_list[i],
-            },
-            "type": "EXTENDED_TRANSIT_MATRIX_RESULTS",
-            "actual_total_waiting_times": walk_time_matrix_list[i],
-        }
-        self._tracker.run_tool(matrix_results_tool, spec, scenario=scenario, class_name=transit_class["name"])
+                if actual_in_vehicle_times:
+                    matrix_results["actual_in_vehicle_times"] = in_vehicle_time_matrix_list[i]
+                else:
+                    strategy_analyses[(_UNCONGESTED_IN_VEHICLE_TIMES, None)] = in_vehicle_time_matrix_list[i]
+            if congested and congestion_matrix_list[i] is not None:
+                strategy_analyses[("@ccost", None)] = congestion_matrix_list[i]
+            if fare_matrix_list[i] is not None:
+                components = (transit_class["segment_fare_attribute"], transit_class["link_fare_attribute_id"])
+                strategy_analyses[components] = fare_matrix_list[i]
+            plans.append((matrix_results, strategy_analyses))
+        return plans
 
-    def _extract_in_vehicle_times(
+    def _extract_output_matrices(
         self,
-        i,
         scenario,
         parameters,
-        transit_class,
-        attribute,
         demand_matrix_list,
+        walk_time_matrix_list,
+        wait_time_matrix_list,
+        board_penalty_matrix_list,
         in_vehicle_time_matrix_list,
-        congested,
+        congestion_matrix_list,
+        fare_matrix_list,
     ):
-        if congested is True or parameters["congested_assignment"] is False:
-            spec = {
-                "result": str(attribute.id),
-                "expression": "timtr",
-                "aggregation": None,
-                "selections": {"link": "all", "transit_line": "all"},
-                "type": "NETWORK_CALCULATION",
-            }
-            self._tracker.run_tool(network_calc_tool, spec, scenario=scenario)
+        plans = self._plan_output_extraction(
+            parameters,
+            walk_time_matrix_list,
+            wait_time_matrix_list,
+            board_penalty_matrix_list,
+            in_vehicle_time_matrix_list,
+            congestion_matrix_list,
+            fare_matrix_list,
+        )
+        # Each requested in-vehicle, congestion and fare matrix used to get its own strategy analysis
+        requested_lists = [in_vehicle_time_matrix_list, fare_matrix_list]
+        if parameters["congested_assignment"] is True:
+            requested_lists.append(congestion_matrix_list)
+        requested = sum(1 for matrix_list in requested_lists for matrix in matrix_list if matrix is not None)
+        planned = sum(len(analyses) for _, analyses in plans)
+        if any((_UNCONGESTED_IN_VEHICLE_TIMES, None) in analyses for _, analyses in plans):
+            with _util.temp_extra_attribute_manager(scenario, "TRANSIT_SEGMENT") as in_vehicle_attribute:
+                self._compute_uncongested_in_vehicle_times(scenario, in_vehicle_attribute)
+                self._run_extraction_plans(scenario, parameters, plans, demand_matrix_list, in_vehicle_attribute.id)
         else:
-            spec = {
-                "result": str(attribute.id),
-                "expression": "timtr-@ccost",
-                "aggregation": None,
-                "selections": {"link": "all", "transit_line": "all"},
-                "type": "NETWORK_CALCULATION",
-            }
-            self._tracker.run_tool(network_calc_tool, spec, scenario=scenario)
+            self._run_extraction_plans(scenario, parameters, plans, demand_matrix_list, None)
+        _write(
+            "Output matrix extraction ran %d strategy analyses, %d were avoided" % (planned, requested - planned)
+        )
+
+    def _run_extraction_plans(self, scenario, parameters, plans, demand_matrix_list, in_vehicle_attribute_id):
+        for i, transit_class in enumerate(parameters["transit_classes"]):
+            matrix_results, strategy_analyses = plans[i]
+            if matrix_results:
+                self._extract_times_matrices(scenario, transit_class, matrix_results)
+            for (in_vehicle, aux_transit), matrix in strategy_analyses.items():
+                if in_vehicle == _UNCONGESTED_IN_VEHICLE_TIMES:
+                    in_vehicle = in_vehicle_attribute_id
+                self._run_strategy_analysis(
+                    scenario, transit_class, demand_matrix_list[i], in_vehicle, aux_transit, matrix
+                )
+
+    def _extract_times_matrices(self, scenario, transit_class, matrix_results):
         spec = {
-            "trip_components": {
-                "boarding": None,
-                "in_vehicle": str(attribute.id),
-                "aux_transit": None,
-                "alighting": None,
-            },
-            "sub_path_combination_operator": "+",
-            "sub_strategy_combination_operator": "average",
-            "selected_demand_and_transit_volumes": {
-                "sub_strategies_to_retain": "ALL",
-                "selection_threshold": {"lower": -999999, "upper": 999999},
-            },
-            "analyzed_demand": demand_matrix_list[i].id,
-            "constraint": None,
-            "results": {
-                "strategy_values": in_vehicle_time_matrix_list[i],
-                "selected_demand": None,
-                "transit_volumes": None,
-                "aux_transit_volumes": None,
-                "total_boardings": None,
-                "total_alightings": None,
+            "by_mode_subset": {
+                "modes": ["*"],
+                "actual_in_vehicle_times": matrix_results.get("actual_in_vehicle_times"),
+                "actual_aux_transit_times": matrix_results.get("actual_aux_transit_times"),
+                "actual_total_boarding_times": matrix_results.get("actual_total_boarding_times"),
             },
-            "type": "EXTENDED_TRANSIT_STRATEGY_ANALYSIS",
+            "type": "EXTENDED_TRANSIT_MATRIX_RESULTS",
+            "actual_total_waiting_times": matrix_results.get("actual_total_waiting_times"),
         }
-        self._tracker.run_tool(
-            strategy_analysis_tool,
-            spec,
-            scenario=scenario,
-            class_name=transit_class["name"],
-            num_processors=self.number_of_processors,
-        )
+        self._tracker.run_tool(matrix_results_tool, spec, scenario=scenario, class_name=transit_class["name"])
 
-    def _extract_congestion_matrix(self, i, scenario, transit_class, congestion_matrix_id, demand_matrix_list):
+    def _compute_uncongested_in_vehicle_times(self, scenario, attribute):
+        """The segment times without the congestion term, shared by all classes"""
         spec = {
-            "trip_components": {"boarding": None, "in_vehicle": "@ccost", "aux_transit": None, "alighting": None},
-            "sub_path_combination_operator": "+",
-            "sub_strategy_combination_operator": "average",
-            "selected_demand_and_transit_volumes": {
-                "sub_strategies_to_retain": "ALL",
-                "selection_threshold": {"lower": -999999, "upper": 999999},
-            },
-            "analyzed_demand": demand_matrix_list[i].id,
-            "constraint": None,
-            "results": {
-                "strategy_values": congestion_matrix_id,
-                "selected_demand": None,
-                "transit_volumes": None,
-                "aux_transit_volumes": None,
-                "total_boardings": None,
-                "total_alightings": None,
-            },
-            "type": "EXTENDED_TRANSIT_STRATEGY_ANALYSIS",
+            "result": str(attribute.id),
+            "expression": "timtr-@ccost",
+            "aggregation": None,
+            "selections": {"link": "all", "transit_line": "all"},
+            "type": "NETWORK_CALCULATION",
         }
-        self._tracker.run_tool(
-            strategy_analysis_tool,
-            spec,
-            scenario=scenario,
-            class_name=transit_class["name"],
-            num_processors=self.number_of_processors,
-        )
+        self._tracker.run_tool(network_calc_tool, spec, scenario=scenario)
 
-    def _extract_cost_matrix(self, i, scenario, transit_class, demand_matrix_list, fare_matrix_list):
+    def _run_strategy_analysis(self, scenario, transit_class, demand_matrix, in_vehicle, aux_transit, result_matrix):
         spec = {
             "trip_components": {
                 "boarding": None,
-                "in_vehicle": transit_class["segment_fare_attribute"],
-                "aux_transit": transit_class["link_fare_attribute_id"],
+                "in_vehicle": in_vehicle,
+                "aux_transit": aux_transit,
                 "alighting": None,
             },
             "sub_path_combination_operator": "+",
@@ -1900,10 +1843,10 @@ class AssignTransit(_m.Tool()):
                 "sub_strategies_to_retain": "ALL",
                 "selection_threshold": {"lower": -999999, "upper": 999999},
             },
-            "analyzed_demand": demand_matrix_list[i].id,
+            "analyzed_demand": demand_matrix.id,
             "constraint": None,
             "results": {
-                "strategy_values": fare_matrix_list[i],
+                "strategy_values": result_matrix,
                 "selected_demand": None,
                 "transit_volumes": None,
                 "aux_transit_volumes": None,
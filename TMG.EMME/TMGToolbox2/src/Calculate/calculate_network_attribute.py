@@ -36,6 +36,8 @@ Extract Transit Origin and Destination Vectors
     0.0.1 Created on 2015-10-06 by Trajce Nikolov
 
     2.0.0 Refactored & updated for XTMF2/TMGToolbox2 on 2021-10-14 by Williams Diogu
+
+    2.1.0 Added the return_sum option to send the sum of the report back to XTMF.
    
 """
 
@@ -51,22 +53,28 @@ _util = _MODELLER.module("tmg2.utilities.general_utilities")
 
 
 class CalculateNetworkAttribute(_m.Tool()):
+    version = "2.1.0"
+
     def __init__(self):
         self.scenario = _MODELLER.scenario
 
     def __call__(self, parameters):
         scenario = _util.load_scenario(parameters["scenario_number"])
         try:
-            self._execute(scenario, parameters)
+            total = self._execute(scenario, parameters)
         except Exception as e:
             raise Exception(_util.format_reverse_stack())
+        if parameters.get("return_sum", False):
+            return total
 
     def run_xtmf(self, parameters):
         scenario = _util.load_scenario(parameters["scenario_number"])
         try:
-            self._execute(scenario, parameters)
+            total = self._execute(scenario, parameters)
         except Exception as e:
             raise Exception(_util.format_reverse_stack())
+        if parameters.get("return_sum", False):
+            return total
 
     def _execute(self, scenario, parameters):
 
@@ -36,6 +36,9 @@ ExportBinaryMatrix
     1.0.0 Published on 2014-06-09
     
     1.0.1 Tool now checks that the matrix exists.
+
+    1.1.0 Added the return_array option to send the matrix data straight back
+        to XTMF instead of writing a file.
     
 """
 
@@ -54,7 +57,7 @@ _bank = _MODELLER.emmebank
 
 class ExportBinaryMatrix(_m.Tool()):
 
-    version = "1.0.1"
+    version = "1.1.0"
     tool_run_msg = ""
     number_of_tasks = 1  # For progress reporting, enter the integer number of tasks here
 
@@ -95,7 +98,8 @@ class ExportBinaryMatrix(_m.Tool()):
         # xtmf_MatrixType, xtmf_MatrixNumber, ExportFile, xtmf_ScenarioNumber
         xtmf_MatrixType = parameters["matrix_type"]
         xtmf_MatrixNumber = parameters["matrix_number"]
-        self.ExportFile = parameters["file_location"]
+        self.ReturnArray = parameters.get("return_array", False)
+        self.ExportFile = None if self.ReturnArray else parameters["file_location"]
         xtmf_ScenarioNumber = parameters["scenario_number"]
         if not xtmf_MatrixType in self.MATRIX_TYPES:
             raise IOError(
@@ -118,7 +122,7 @@ class ExportBinaryMatrix(_m.Tool()):
                 )
 
         try:
-            self._Execute()
+            return self._Execute()
         except Exception as e:
             msg = str() + "\n" + _traceback.format_exc()
             raise Exception(msg)
@@ -141,9 +145,10 @@ class ExportBinaryMatrix(_m.Tool()):
             else:
                 data = matrix.get_data()
 
-            data.save(self.ExportFile)
-
             self.TRACKER.complete_task()
+            if self.ReturnArray:
+                return _util.array_result(data)
+            data.save(self.ExportFile)
 
     ##########################################################################################################
 
@@ -153,6 +158,7 @@ class ExportBinaryMatrix(_m.Tool()):
         atts = {
             "Matrix": self.MatrixId,
             "Export File": self.ExportFile,
+            "Return Array": self.ReturnArray,
             "Version": self.version,
             "self": self.__MODELLER_NAMESPACE__,
         }
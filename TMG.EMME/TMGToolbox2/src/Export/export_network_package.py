@@ -19,7 +19,10 @@
 
 import inro.modeller as _m
 import traceback as _traceback
+from concurrent.futures import ThreadPoolExecutor as _ThreadPoolExecutor
 from contextlib import contextmanager
+import io as _io
+import os as _os
 from os import path as _path
 from datetime import datetime as _datetime
 import shutil as _shutil
@@ -44,9 +47,17 @@ _export_functions = _MODELLER.tool("inro.emme.data.function.export_functions")
 _pdu = _MODELLER.module("tmg2.utilities.pandas_utils")
 _tmgTPB = _MODELLER.module("tmg2.utilities.TMG_tool_page_builder")
 
+# Compression mode -> (zipfile compression, compression level)
+_COMPRESSION_MODES = {
+    "stored": (_zipfile.ZIP_STORED, None),
+    "fast": (_zipfile.ZIP_DEFLATED, 1),
+    "default": (_zipfile.ZIP_DEFLATED, None),
+    "max": (_zipfile.ZIP_DEFLATED, 9),
+}
+
 
 class ExportNetworkPackage(_m.Tool()):
-    version = "1.2.2"
+    version = "1.3.0"
     tool_run_msg = ""
     number_of_tasks = 11  # For progress reporting, enter the integer number of tasks here
 
@@ -56,6 +67,7 @@ class ExportNetworkPackage(_m.Tool()):
     AttributeIdsToExport = _m.Attribute(_m.ListType)
     ExportMetadata = _m.Attribute(str)
     ExportToEmmeOldVersion = _m.Attribute(bool)
+    Compression = _m.Attribute(str)
 
     export_attributes = _m.Attribute(str)
     scenario_number = _m.Attribute(int)
@@ -67,6 +79,7 @@ class ExportNetworkPackage(_m.Tool()):
         self.Scenario = _MODELLER.scenario  # Default is primary scenario
         self.ExportMetadata = ""
         self.ExportToEmmeOldVersion = False
+        self.Compression = "default"
 
     def page(self):
         pb = _tmgTPB.TmgToolPageBuilder(
@@ -96,6 +109,18 @@ class ExportNetworkPackage(_m.Tool()):
             note="Descriptions longer than 20 characters will be trimmed.",
         )
 
+        pb.add_select(
+            "Compression",
+            keyvalues=[
+                ("stored", "Stored (no compression)"),
+                ("fast", "Fast"),
+                ("default", "Default"),
+                ("max", "Maximum"),
+            ],
+            title="Compression",
+            note="Faster compression produces a larger package.",
+        )
+
         pb.add_checkbox("ExportAllFlag", label="Export all extra attributes?")
 
         pb.add_select(
@@ -158,16 +183,18 @@ class ExportNetworkPackage(_m.Tool()):
     def check_all_flag(self):
         return self.ExportAllFlag
 
-    def __call__(self, scenario_number, ExportFile, export_attributes):
+    def __call__(self, scenario_number, ExportFile, export_attributes, compression="default"):
 
         self.Scenario = _MODELLER.emmebank.scenario(scenario_number)
         if self.Scenario is None:
             raise Exception("Scenario %s was not found!" % scenario_number)
 
         self.ExportFile = ExportFile
+        self.Compression = compression
         if export_attributes.lower() == "all":
             self.ExportAllFlag = True  # if true, self.AttributeIdsToExport gets set in execute
         else:
+            self.ExportAllFlag = False
             cells = export_attributes.split(",")
             self.AttributeIdsToExport = [str(c.strip()) for c in cells if c.strip()]  # Clean out null values
 
@@ -184,10 +211,12 @@ class ExportNetworkPackage(_m.Tool()):
         if self.Scenario is None:
             raise Exception("Scenario %s was not found!" % self.scenario_number)
         xtmf_AttributeIdString = parameters["extra_attributes"]
+        self.Compression = parameters.get("compression", "default")
 
         if xtmf_AttributeIdString.lower() == "all":
             self.ExportAllFlag = True  # if true, self.AttributeIdsToExport gets set in execute
         else:
+            self.ExportAllFlag = False
             cells = xtmf_AttributeIdString.split(",")
             self.AttributeIdsToExport = [str(c.strip()) for c in cells if c.strip()]  # Clean out null values
         try:
@@ -201,6 +230,7 @@ class ExportNetworkPackage(_m.Tool()):
             "Scenario": str(self.Scenario.id),
             "Export File": _path.splitext(self.ExportFile)[0],
             "Version": self.version,
+            "Compression": self.Compression,
             "self": self.__MODELLER_NAMESPACE__,
         }
         with _m.logbook_trace(
@@ -221,55 +251,61 @@ class ExportNetworkPackage(_m.Tool()):
                         % (", ".join(missing_attributes), self.Scenario.number)
                     )
 
-            with _zipfile.ZipFile(self.ExportFile, "w", _zipfile.ZIP_DEFLATED) as zf, self._temp_file() as temp_folder:
-                version_file = _path.join(temp_folder, "version.txt")
-                with open(version_file, "w") as writer:
-                    writer.write("%s\n%s" % (str(5.0), _util.get_emme_version(returnType=str)))
-                zf.write(version_file, arcname="version.txt")
-
-                info_path = _path.join(temp_folder, "info.txt")
-                self._write_info_file(info_path)
-                zf.write(info_path, arcname="info.txt")
+            if self.Compression not in _COMPRESSION_MODES:
+                raise Exception(
+                    "Unknown compression mode '%s', expected one of %s"
+                    % (self.Compression, ", ".join(sorted(_COMPRESSION_MODES)))
+                )
+            compression, compression_level = _COMPRESSION_MODES[self.Compression]
+
+            with _zipfile.ZipFile(
+                self.ExportFile, "w", compression, compresslevel=compression_level
+            ) as zf, self._temp_file() as temp_folder, self._package_writer(zf) as package:
+                package.add_text(
+                    "version.txt",
+                    "%s\n%s" % (str(5.0), _util.get_emme_version(returnType=str)),
+                )
+                package.add_text("info.txt", self._get_info_text())
 
-                self._batchout_modes(temp_folder, zf)
-                self._batchout_vehicles(temp_folder, zf)
-                self._batchout_base(temp_folder, zf)
-                self._batchout_shapes(temp_folder, zf)
-                self._batchout_lines(temp_folder, zf)
-                self._batchout_turns(temp_folder, zf)
-                self._batchout_functions(temp_folder, zf)
+                self._batchout_modes(temp_folder, package)
+                self._batchout_vehicles(temp_folder, package)
+                self._batchout_base(temp_folder, package)
+                self._batchout_shapes(temp_folder, package)
+                self._batchout_lines(temp_folder, package)
+                self._batchout_turns(temp_folder, package)
+                self._batchout_functions(temp_folder, package)
 
                 if len(self.AttributeIdsToExport) > 0:
-                    self._batchout_extra_attributes(temp_folder, zf)
+                    self._batchout_extra_attributes(temp_folder, package)
                 else:
                     self.TRACKER.complete_task()
 
                 if self.Scenario.has_traffic_results:
-                    self._batchout_traffic_results(temp_folder, zf)
+                    self._batchout_traffic_results(package)
                 self.TRACKER.complete_task()
 
                 if self.Scenario.has_transit_results:
-                    self._batchout_transit_results(temp_folder, zf)
+                    self._batchout_transit_results(package)
                 self.TRACKER.complete_task()
 
     @_m.logbook_trace("Exporting modes")
-    def _batchout_modes(self, temp_folder, zf):
+    def _batchout_modes(self, temp_folder, package):
         export_file = _path.join(temp_folder, "modes.201")
         self.TRACKER.run_tool(_export_modes, export_file=export_file, scenario=self.Scenario)
-        zf.write(export_file, arcname="modes.201")
+        package.add_file(export_file, "modes.201")
 
     @_m.logbook_trace("Exporting vehicles")
-    def _batchout_vehicles(self, temp_folder, zf):
-        export_file = _path.join(temp_folder, "vehicles.202")
+    def _batchout_vehicles(self, temp_folder, package):
         if self.Scenario.element_totals["transit_vehicles"] == 0:
-            self._export_blank_batch_file(export_file, "vehicles")
+            package.add_text("vehicles.202", self._get_blank_batch_text("vehicles"))
             self.TRACKER.complete_task()
         else:
+            export_file = _path.join(temp_folder, "vehicles.202")
             self.TRACKER.run_tool(_export_vehicles, export_file=export_file, scenario=self.Scenario)
-        zf.write(export_file, arcname="vehicles.202")
+            package.add_file(export_file, "vehicles.202")
 
     @_m.logbook_trace("Exporting base network")
-    def _batchout_base(self, temp_folder, zf):
+    def _batchout_base(self, temp_folder, package):
         export_file = _path.join(temp_folder, "base.211")
         self.TRACKER.run_tool(
             _export_base_network,
@@ -277,19 +313,18 @@ class ExportNetworkPackage(_m.Tool()):
             scenario=self.Scenario,
             export_format="ENG_DATA_FORMAT",
         )
-        zf.write(export_file, arcname="base.211")
+        package.add_file(export_file, "base.211")
 
     @_m.logbook_trace("Exporting link shapes")
-    def _batchout_shapes(self, temp_folder, zf):
+    def _batchout_shapes(self, temp_folder, package):
         export_file = _path.join(temp_folder, "shapes.251")
         self.TRACKER.run_tool(_export_link_shapes, export_file=export_file, scenario=self.Scenario)
-        zf.write(export_file, arcname="shapes.251")
+        package.add_file(export_file, "shapes.251")
 
     @_m.logbook_trace("Exporting transit lines")
-    def _batchout_lines(self, temp_folder, zf):
-        export_file = _path.join(temp_folder, "transit.221")
+    def _batchout_lines(self, temp_folder, package):
         if self.Scenario.element_totals["transit_lines"] == 0:
-            self._export_blank_batch_file(export_file, "lines")
+            package.add_text("transit.221", self._get_blank_batch_text("lines"))
             self.TRACKER.complete_task()
         else:
             # check if the description is empty or has single quote
@@ -303,16 +338,17 @@ class ExportNetworkPackage(_m.Tool()):
                         line.description = line.description[0:19]
             self.Scenario.publish_network(network)
 
+            export_file = _path.join(temp_folder, "transit.221")
             self.TRACKER.run_tool(
                 _export_transit_lines,
                 export_file=export_file,
                 scenario=self.Scenario,
                 export_format="ENG_DATA_FORMAT",
             )
-        zf.write(export_file, arcname="transit.221")
+            package.add_file(export_file, "transit.221")
 
     @_m.logbook_trace("Exporting turns")
-    def _batchout_turns(self, temp_folder, zf):
+    def _batchout_turns(self, temp_folder, package):
         export_file = _path.join(temp_folder, "turns.231")
         if self.Scenario.element_totals["turns"] == 0:
             self.TRACKER.complete_task()
@@ -323,16 +359,16 @@ class ExportNetworkPackage(_m.Tool()):
                 scenario=self.Scenario,
                 export_format="ENG_DATA_FORMAT",
             )
-            zf.write(export_file, arcname="turns.231")
+            package.add_file(export_file, "turns.231")
 
     @_m.logbook_trace("Exporting Functions")
-    def _batchout_functions(self, temp_folder, zf):
+    def _batchout_functions(self, temp_folder, package):
         export_file = _path.join(temp_folder, "functions.411")
         self.TRACKER.run_tool(_export_functions, export_file=export_file)
-        zf.write(export_file, arcname="functions.411")
+        package.add_file(export_file, "functions.411")
 
     @_m.logbook_trace("Exporting extra attributes")
-    def _batchout_extra_attributes(self, temp_folder, zf):
+    def _batchout_extra_attributes(self, temp_folder, package):
         _m.logbook_write("List of attributes: %s" % self.AttributeIdsToExport)
 
         extra_attributes = [self.Scenario.extra_attribute(id_) for id_ in self.AttributeIdsToExport]
@@ -350,38 +386,28 @@ class ExportNetworkPackage(_m.Tool()):
             if t == "transit_segment":
                 t = "segment"
             filename = _path.join(temp_folder, "extra_%ss_%s.csv" % (t, self.Scenario.number))
-            zf.write(filename, arcname="exatt_%ss.241" % t)
-        summary_file = _path.join(temp_folder, "exatts.241")
-        self._export_attribute_definition_file(summary_file, extra_attributes)
-        zf.write(summary_file, arcname="exatts.241")
-
-    def _batchout_traffic_results(self, temp_folder, zf):
-        link_filepath = _path.join(temp_folder, "link_results.csv")
-        turn_filepath = _path.join(temp_folder, "turn_results.csv")
+            package.add_file(filename, "exatt_%ss.241" % t)
+        package.add_text("exatts.241", self._get_attribute_definition_text(extra_attributes))
+
+    def _batchout_traffic_results(self, package):
         traffic_result_attributes = ["auto_volume", "additional_volume", "auto_time"]
 
         links = _pdu.load_link_dataframe(self.Scenario)[traffic_result_attributes]
-        links.to_csv(link_filepath, index=True)
-        zf.write(link_filepath, arcname=_path.basename(link_filepath))
+        package.add_csv("link_results.csv", links)
 
         turns = _pdu.load_turn_dataframe(self.Scenario)
         if not (turns is None):
             turns = turns[traffic_result_attributes]
-            turns.to_csv(turn_filepath)
-            zf.write(turn_filepath, arcname=_path.basename(turn_filepath))
+            package.add_csv("turn_results.csv", turns)
 
-    def _batchout_transit_results(self, temp_folder, zf):
-        segment_filepath = _path.join(temp_folder, "segment_results.csv")
+    def _batchout_transit_results(self, package):
         result_attributes = ["transit_boardings", "transit_time", "transit_volume"]
         segments = _pdu.load_transit_segment_dataframe(self.Scenario)[result_attributes]
-        segments.to_csv(segment_filepath)
-        zf.write(segment_filepath, arcname=_path.basename(segment_filepath))
+        package.add_csv("segment_results.csv", segments)
 
-        aux_transit_filepath = _path.join(temp_folder, "aux_transit_results.csv")
         aux_result_attributes = ["aux_transit_volume"]
         aux_transit = _pdu.load_link_dataframe(self.Scenario)[aux_result_attributes]
-        aux_transit.to_csv(aux_transit_filepath)
-        zf.write(aux_transit_filepath, arcname=_path.basename(aux_transit_filepath))
+        package.add_csv("aux_transit_results.csv", aux_transit)
 
     @contextmanager
     def _temp_file(self):
@@ -393,36 +419,43 @@ class ExportNetworkPackage(_m.Tool()):
             _shutil.rmtree(foldername, True)
             _m.logbook_write("Deleted temporary directory at `%s`" % foldername)
 
+    @contextmanager
+    def _package_writer(self, zf):
+        package = _PackageWriter(zf)
+        try:
+            yield package
+            package.wait()
+        finally:
+            package.close()
+
     @staticmethod
-    def _export_blank_batch_file(filename, t_record):
-        with open(filename, "w") as file_:
-            file_.write("t %s init" % t_record)
+    def _get_blank_batch_text(t_record):
+        return "t %s init" % t_record
 
     @staticmethod
-    def _export_attribute_definition_file(filename, attribute_list):
-        with open(filename, "w") as writer:
-            writer.write("name,type, default")
-            for att in attribute_list:
-                writer.write(
-                    "\n{name},{type},{default},'{desc}'".format(
-                        name=att.name,
-                        type=att.type,
-                        default=att.default_value,
-                        desc=att.description,
-                    )
+    def _get_attribute_definition_text(attribute_list):
+        lines = ["name,type, default"]
+        for att in attribute_list:
+            lines.append(
+                "{name},{type},{default},'{desc}'".format(
+                    name=att.name,
+                    type=att.type,
+                    default=att.default_value,
+                    desc=att.description,
                 )
-
-    def _write_info_file(self, fp):
-        with open(fp, "w") as writer:
-            bank = _MODELLER.emmebank
-            lines = [
-                str(bank.title),
-                str(bank.path),
-                "%s - %s" % (self.Scenario, self.Scenario.title),
-                _datetime.now().strftime("%Y-%m-%d %H:%M"),
-                self.ExportMetadata,
-            ]
-            writer.write("\n".join(lines))
+            )
+        return "\n".join(lines)
+
+    def _get_info_text(self):
+        bank = _MODELLER.emmebank
+        lines = [
+            str(bank.title),
+            str(bank.path),
+            "%s - %s" % (self.Scenario, self.Scenario.title),
+            _datetime.now().strftime("%Y-%m-%d %H:%M"),
+            self.ExportMetadata,
+        ]
+        return "\n".join(lines)
 
     def _get_select_attribute_options_json(self):
         keyval = {}
@@ -447,3 +480,56 @@ class ExportNetworkPackage(_m.Tool()):
     @_m.method(return_type=str)
     def tool_run_msg_status(self):
         return self.tool_run_msg
+
+
+class _PackageWriter(object):
+    """
+    Adds components to a network package on a background thread, in the order they
+    were queued, so that compressing one component overlaps with Emme exporting the
+    next. A ZipFile only allows one entry to be written at a time, so the pool has
+    a single worker. Emme's API is only used from the calling thread: components are
+    fully prepared (files exported, text or data frames built) before being queued.
+    """
+
+    def __init__(self, zf):
+        self.zf = zf
+        self._executor = _ThreadPoolExecutor(max_workers=1)
+        self._pending = []
+
+    def add_file(self, filename, arcname):
+        """Archive a file written by an Emme exporter, deleting it once it is in the package."""
+        self._submit(self._write_file, filename, arcname)
+
+    def add_text(self, arcname, text):
+        """Write text straight into a package entry."""
+        self._submit(self._write_entry, arcname, None, lambda writer: writer.write(text))
+
+    def add_csv(self, arcname, frame):
+        """Write a data frame, with its index, straight into a package entry."""
+        # pandas expects handles opened with newline="" so it controls the line endings
+        self._submit(self._write_entry, arcname, "", lambda writer: frame.to_csv(writer))
+
+    def wait(self):
+        """Block until every queued component is in the package, raising the first failure."""
+        pending, self._pending = self._pending, []
+        for future in pending:
+            future.result()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def _submit(self, function, *args):
+        # Report a failed component now rather than after the rest of the export
+        for future in self._pending:
+            if future.done() and future.exception() is not None:
+                future.result()
+        self._pending.append(self._executor.submit(function, *args))
+
+    def _write_file(self, filename, arcname):
+        self.zf.write(filename, arcname=arcname)
+        _os.remove(filename)
+
+    def _write_entry(self, arcname, newline, write):
+        # The size is not known up front, so allow the entry to grow past 2GB
+        with _io.TextIOWrapper(self.zf.open(arcname, "w", force_zip64=True), newline=newline) as writer:
+            write(writer)
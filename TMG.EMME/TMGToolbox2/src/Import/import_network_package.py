@@ -20,11 +20,16 @@
 import inro.modeller as _m
 import traceback as _traceback
 from contextlib import contextmanager
+import hashlib as _hashlib
+import json as _json
+import numpy as _np
+import pandas as _pd
 import zipfile as _zipfile
 import os
 from os import path as _path
 import shutil as _shutil
 import tempfile as _tf
+import time as _time
 
 _m.InstanceType = object
 _m.TupleType = object
@@ -43,6 +48,13 @@ import_lines = _MODELLER.tool("inro.emme.data.network.transit.transit_line_trans
 import_turns = _MODELLER.tool("inro.emme.data.network.turn.turn_transaction")
 import_attributes = _MODELLER.tool("inro.emme.data.network.import_attribute_values")
 
+# The number of leading key columns in each results file, identifying the element of the row
+_RESULT_KEY_COLUMNS = {"LINK": 2, "TURN": 3, "TRANSIT_SEGMENT": 4}
+# The numbers of leading key columns an extra attribute file of each domain may have
+_EXTRA_ATTRIBUTE_KEY_COLUMNS = {"NODE": (1,), "LINK": (2,), "TURN": (3,), "TRANSIT_LINE": (1,), "TRANSIT_SEGMENT": (3, 4)}
+# The number of unmatched rows to show in the logbook
+_MISMATCH_EXAMPLES = 10
+
 
 class ComponentContainer(object):
     """A simple data container. It's fully written out so I can get auto-completion"""
@@ -79,8 +91,121 @@ class ComponentContainer(object):
         self.transit_results_files = None
 
 
+class ExtractionCache(object):
+    """
+    An on-disk cache of extracted network package components, so that importing the
+    same package into several scenarios only extracts (and upgrades) each component
+    once. Entries are keyed by the package's content hash and the member's CRC, so a
+    package that changes on disk never gets stale components. Once the cache grows
+    past max_size bytes the least recently used entries are removed.
+    """
+
+    STAGING_PREFIX = ".staging-"
+    # Staging directories left behind by a crashed import are removed after a day
+    STALE_STAGING_SECONDS = 24 * 60 * 60
+
+    # Package path -> ((size, modified time), content hash), so a package is hashed once per session
+    _package_hashes = {}
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._used = set()
+        if not _path.isdir(directory):
+            os.makedirs(directory)
+
+    @classmethod
+    def package_hash(cls, package_file):
+        package_file = _path.abspath(package_file)
+        stat = os.stat(package_file)
+        signature = (stat.st_size, stat.st_mtime)
+        known = cls._package_hashes.get(package_file)
+        if known is not None and known[0] == signature:
+            return known[1]
+        digest = _hashlib.sha1()
+        with open(package_file, "rb") as reader:
+            for chunk in iter(lambda: reader.read(1 << 20), b""):
+                digest.update(chunk)
+        cls._package_hashes[package_file] = (signature, digest.hexdigest())
+        return digest.hexdigest()
+
+    def extract(self, zf, member, package_hash, transform=None, variant=""):
+        """
+        Returns the path of the extracted member, extracting it on a miss. transform is
+        called with the path of a freshly extracted file to upgrade it in place, and
+        variant must name the transform so upgraded files are kept apart from raw ones.
+        """
+        info = zf.getinfo(member)
+        key = _hashlib.sha1(
+            ("%s|%s|%08x|%d|%s" % (package_hash, member, info.CRC, info.file_size, variant)).encode("utf-8")
+        ).hexdigest()
+        entry = _path.join(self.directory, key)
+        filename = _path.join(entry, _path.basename(member))
+        self._used.add(entry)
+        if _path.isfile(filename):
+            self.hits += 1
+            os.utime(entry, None)
+            return filename
+
+        self.misses += 1
+        if _path.isdir(entry):
+            # An incomplete entry, for example one being evicted by another process
+            _shutil.rmtree(entry, True)
+        staging = _tf.mkdtemp(prefix=self.STAGING_PREFIX, dir=self.directory)
+        try:
+            staged_file = _path.join(staging, _path.basename(member))
+            with zf.open(member) as source, open(staged_file, "wb") as destination:
+                _shutil.copyfileobj(source, destination, 1 << 20)
+            if transform is not None:
+                transform(staged_file)
+            try:
+                os.rename(staging, entry)
+            except OSError:
+                # Another import committed the same entry first
+                if not _path.isfile(filename):
+                    raise
+        finally:
+            _shutil.rmtree(staging, True)
+        return filename
+
+    def trim(self):
+        """Remove the least recently used entries until the cache fits, returning how many were removed."""
+        entries = []
+        now = _time.time()
+        for name in os.listdir(self.directory):
+            entry = _path.join(self.directory, name)
+            if not _path.isdir(entry):
+                continue
+            try:
+                modified = _path.getmtime(entry)
+                if name.startswith(self.STAGING_PREFIX):
+                    if now - modified > self.STALE_STAGING_SECONDS:
+                        _shutil.rmtree(entry, True)
+                    continue
+                size = sum(_path.getsize(_path.join(entry, f)) for f in os.listdir(entry))
+            except OSError:
+                # Removed by another process while we were looking at it
+                continue
+            entries.append((modified, size, entry))
+
+        total_size = sum(size for modified, size, entry in entries)
+        removed = 0
+        for modified, size, entry in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            # Entries used by the current import are never evicted by it
+            if entry in self._used:
+                continue
+            _shutil.rmtree(entry, True)
+            total_size -= size
+            removed += 1
+        return removed
+
+
 class ImportNetworkPackage(_m.Tool()):
-    version = "1.2.2"
+    version = "1.5.0"
     tool_run_msg = ""
     number_of_tasks = 9  # For progress reporting, enter the integer number of tasks here
 
@@ -98,6 +223,8 @@ class ImportNetworkPackage(_m.Tool()):
     add_function = _m.Attribute(bool)
     scenario_name = _m.Attribute(str)
     skip_merging_functions = _m.Attribute(bool)
+    extraction_cache_directory = _m.Attribute(str)
+    extraction_cache_size = _m.Attribute(int)  # In MB, 0 to disable the cache
 
     def __init__(self):
 
@@ -113,6 +240,11 @@ class ImportNetworkPackage(_m.Tool()):
         self.merge_functions = None
         self.has_exception = False
         self.skip_merging_functions = False
+        self.extraction_cache_directory = _path.join(_tf.gettempdir(), "tmg_network_package_cache")
+        self.extraction_cache_size = 0
+        self._cache = None
+        self._cache_statistics = None
+        self._package_hash = None
 
     def page(self):
         # merge_functions = _MODELLER.tool("tmg2.utilities.merge_functions")
@@ -522,12 +654,19 @@ class ImportNetworkPackage(_m.Tool()):
         self.scenario_Id = parameters["scenario_number"]
         self.overwrite_scenario_flag = True
         self.conflict_option = parameters["conflict_option"]
+        self.extraction_cache_directory = parameters.get(
+            "extraction_cache_directory", self.extraction_cache_directory
+        )
+        self.extraction_cache_size = parameters.get("extraction_cache_size", self.extraction_cache_size)
 
         try:
             self._execute()
         except Exception as e:
             msg = str(e) + "\n" + _traceback.format_exc()
             raise Exception(msg)
+        # With the extraction cache on, report how many files it served
+        if self._cache_statistics is not None:
+            return _json.dumps(self._cache_statistics)
 
     def _execute(self):
         with _m.logbook_trace(
@@ -541,7 +680,8 @@ class ImportNetworkPackage(_m.Tool()):
 
             self._components.reset()  # Clear any held-over contents from previous run
 
-            with _zipfile.ZipFile(self.network_package_file) as zf, self._temp_file() as temp_folder:
+            with _zipfile.ZipFile(self.network_package_file) as zf, self._temp_file() as temp_folder, \
+                    self._extraction_cache():
 
                 self._check_network_package(zf)  # Check the file format.
 
@@ -591,88 +731,148 @@ class ImportNetworkPackage(_m.Tool()):
 
     @_m.logbook_trace("Reading modes")
     def _batchin_modes(self, scenario, temp_folder, zf):
-        fileName = zf.extract(self._components.mode_file, temp_folder)
+        fileName = self._extract(zf, self._components.mode_file, temp_folder)
         self.TRACKER.run_tool(import_modes, transaction_file=fileName, scenario=scenario)
 
     @_m.logbook_trace("Reading vehicles")
     def _batchin_vehicles(self, scenario, temp_folder, zf):
-        zf.extract(self._components.vehicles_file, temp_folder)
         self.TRACKER.run_tool(
             import_vehicles,
-            transaction_file=_path.join(temp_folder, self._components.vehicles_file),
+            transaction_file=self._extract(zf, self._components.vehicles_file, temp_folder),
             scenario=scenario,
         )
 
     @_m.logbook_trace("Reading base network")
     def _batchin_base(self, scenario, temp_folder, zf):
-        zf.extract(self._components.base_file, temp_folder)
         self.TRACKER.run_tool(
             import_base,
-            transaction_file=_path.join(temp_folder, self._components.base_file),
+            transaction_file=self._extract(zf, self._components.base_file, temp_folder),
             scenario=scenario,
         )
 
     @_m.logbook_trace("Reading link shapes")
     def _batchin_link_shapes(self, scenario, temp_folder, zf):
-        zf.extract(self._components.shape_file, temp_folder)
         self.TRACKER.run_tool(
             import_link_shape,
-            transaction_file=_path.join(temp_folder, self._components.shape_file),
+            transaction_file=self._extract(zf, self._components.shape_file, temp_folder),
             scenario=scenario,
         )
 
     @_m.logbook_trace("Reading transit lines")
     def _batchin_lines(self, scenario, temp_folder, zf):
-        zf.extract(self._components.lines_file, temp_folder)
         if self.transit_file_change is True:
-            self._transit_line_file_update(temp_folder)
+            lines_file = self._extract(
+                zf, self._components.lines_file, temp_folder, transform=self._transit_line_file_update
+            )
+        else:
+            lines_file = self._extract(zf, self._components.lines_file, temp_folder)
         self.TRACKER.run_tool(
             import_lines,
-            transaction_file=_path.join(temp_folder, self._components.lines_file),
+            transaction_file=lines_file,
             scenario=scenario,
         )
 
     @_m.logbook_trace("Reading turns")
     def _batchin_turns(self, scenario, temp_folder, zf):
         if self._components.turns_file is not None and (self._components.turns_file in zf.namelist()):
-            zf.extract(self._components.turns_file, temp_folder)
             self.TRACKER.run_tool(
                 import_turns,
-                transaction_file=_path.join(temp_folder, self._components.turns_file),
+                transaction_file=self._extract(zf, self._components.turns_file, temp_folder),
                 scenario=scenario,
             )
 
     @_m.logbook_trace("Reading extra attributes")
     def _batchin_extra_attributes(self, scenario, temp_folder, zf):
-        types = self._load_extra_attributes(zf, temp_folder, scenario)
+        attributes = self._load_extra_attributes(zf, temp_folder, scenario)
         contents = zf.namelist()
         processed = [self._getZipFileName(x) for x in contents]
-        self.TRACKER.start_process(len(types))
-        for t in types:
+        self.TRACKER.start_process(len(attributes))
+        for t, defaults in attributes.items():
             if t == "TRANSIT_SEGMENT":
                 filename = "exatt_segments.241"
             else:
                 filename = "exatt_%ss.241" % t.lower()
             newfilename = self._getZipOriginalString(processed, contents, filename)
             if newfilename is not None:
-                try:
-                    import_attributes(
-                        file_path=_path.join(temp_folder, zf.extract(newfilename, temp_folder)),
-                        field_separator=",",
-                        scenario=scenario,
-                    )
-                except:
-                    import_attributes(
-                        file_path=_path.join(temp_folder, zf.extract(newfilename, temp_folder)),
-                        field_separator=" ",
-                        scenario=scenario,
-                    )
+                self._load_extra_attribute_file(scenario, t, self._extract(zf, newfilename, temp_folder), defaults)
                 self.TRACKER.complete_subtask()
 
+    def _load_extra_attribute_file(self, scenario, domain, filepath, defaults):
+        """
+        Reads an exatt_*.241 file, sniffing whether it is comma or space separated from its
+        header, and sets all of its attributes with a single call. defaults maps the name of
+        each attribute defined in exatts.241 to its default value. Files that can't be read
+        this way are given to Emme's importer instead.
+        """
+        with open(filepath) as reader:
+            header = reader.readline()
+        separator = "," if "," in header else " "
+        columns = [c.strip() for c in header.split(separator if separator == "," else None)]
+        key_count = 0
+        while key_count < len(columns) and not columns[key_count].startswith("@"):
+            key_count += 1
+        attribute_names = [name for name in columns[key_count:] if name in defaults]
+        undefined = [name for name in columns[key_count:] if name not in defaults]
+        if len(undefined) > 0:
+            _m.logbook_write(
+                "Attributes %s of '%s' are not defined in the package and were skipped"
+                % (", ".join(undefined), _path.basename(filepath))
+            )
+        try:
+            if key_count not in _EXTRA_ATTRIBUTE_KEY_COLUMNS[domain]:
+                raise ValueError("%d key columns for %s attributes" % (key_count, domain.lower()))
+            dtype = None
+            if domain in ("TRANSIT_LINE", "TRANSIT_SEGMENT"):
+                # Line names that look like numbers must still match the line ids
+                dtype = {columns[0]: str}
+            # Emme quotes and pads the line ids, and writes None for the j node of hidden segments
+            frame = _pd.read_csv(
+                filepath,
+                sep=separator if separator == "," else r"\s+",
+                header=0,
+                names=columns,
+                dtype=dtype,
+                quotechar="'",
+                skipinitialspace=True,
+                na_values=["None", ""],
+                keep_default_na=False,
+            )
+            frame = self._clean_key_columns(domain, frame[columns[:key_count] + attribute_names], key_count)
+        except (ValueError, KeyError, TypeError) as e:
+            _m.logbook_write(
+                "Could not read '%s' directly (%s), importing it with Emme instead" % (_path.basename(filepath), e)
+            )
+            import_attributes(file_path=filepath, field_separator=separator, scenario=scenario)
+            return
+        self._set_values_from_frame(
+            scenario,
+            domain,
+            frame,
+            key_count,
+            attribute_names,
+            [defaults[name] for name in attribute_names],
+            _path.basename(filepath),
+            fallback=lambda: import_attributes(file_path=filepath, field_separator=separator, scenario=scenario),
+        )
+
+    @staticmethod
+    def _clean_key_columns(domain, frame, key_count):
+        """
+        Strips the line ids and converts the node (and loop) key columns to integers, leaving
+        missing j nodes as NA.
+        """
+        frame = frame.copy()
+        node_columns = list(frame.columns[:key_count])
+        if domain in ("TRANSIT_LINE", "TRANSIT_SEGMENT"):
+            line_column = node_columns.pop(0)
+            frame[line_column] = frame[line_column].str.strip()
+        for column in node_columns:
+            frame[column] = frame[column].astype("Int64")
+        return frame
+
     @_m.logbook_trace("Reading functions")
     def _batchin_functions(self, temp_folder, zf):
-        zf.extract(self._components.functions_file, temp_folder)
-        merge_functions.function_file = _path.join(temp_folder, self._components.functions_file)
+        merge_functions.function_file = self._extract(zf, self._components.functions_file, temp_folder)
         merge_functions.conflict_option = self.conflict_option
         merge_functions.run()
         # zf.extract(self._components.functions_file, temp_folder)
@@ -758,84 +958,126 @@ class ImportNetworkPackage(_m.Tool()):
         scenario.has_traffic_results = True
 
         links_filename, turns_filename = self._components.traffic_results_files
-        zf.extract(links_filename, temp_folder)
-        zf.extract(turns_filename, temp_folder)
-
-        links_filepath = _path.join(temp_folder, links_filename)
-        turns_filepath = _path.join(temp_folder, turns_filename)
-
-        attribute_names = "auto_volume", "additional_volume", "auto_time"
-
-        index, _ = scenario.get_attribute_values("LINK", ["data1"])
-        tables = []
-        with _util.temp_extra_attribute_manager(scenario, "LINK", returnId=True) as temp_attribute:
-            column_labels = {0: "i_node", 1: "j_node"}
-            for i, attribute_name in enumerate(attribute_names):
-                column_labels[i + 2] = temp_attribute
-                import_attributes(links_filepath, ",", column_labels, scenario=scenario)
-                del column_labels[i + 2]
-
-                _, table = scenario.get_attribute_values("LINK", [temp_attribute])
-                tables.append(table)
-        scenario.set_attribute_values("LINK", attribute_names, [index] + tables)
-
-        index, _ = scenario.get_attribute_values("TURN", ["data1"])
-        tables = []
-        with _util.temp_extra_attribute_manager(scenario, "TURN", returnId=True) as temp_attribute:
-            column_labels = {0: "i_node", 1: "j_node", 2: "k_node"}
-            for i, attribute_name in enumerate(attribute_names):
-                column_labels[i + 3] = temp_attribute
-                import_attributes(turns_filepath, ",", column_labels, scenario=scenario)
-                del column_labels[i + 3]
+        links_filepath = self._extract(zf, links_filename, temp_folder)
+        turns_filepath = self._extract(zf, turns_filename, temp_folder)
 
-                _, table = scenario.get_attribute_values("TURN", [temp_attribute])
-                tables.append(table)
-        scenario.set_attribute_values("TURN", attribute_names, [index] + tables)
+        attribute_names = ["auto_volume", "additional_volume", "auto_time"]
+        self._load_results_file(scenario, "LINK", links_filepath, attribute_names)
+        self._load_results_file(scenario, "TURN", turns_filepath, attribute_names)
 
     @_m.logbook_trace("Importing transit results")
     def _batchin_transit_results(self, scenario, temp_folder, zf):
         scenario.has_transit_results = True
 
         segments_filename = self._components.transit_results_files
-        zf.extract(segments_filename, temp_folder)
-        segments_filepath = _path.join(temp_folder, segments_filename)
+        segments_filepath = self._extract(zf, segments_filename, temp_folder)
 
         attribute_names = ["transit_boardings", "transit_time", "transit_volume"]
-        index, _ = scenario.get_attribute_values("TRANSIT_SEGMENT", ["data1"])
-        tables = []
-        with _util.temp_extra_attribute_manager(scenario, "TRANSIT_SEGMENT", returnId=True) as temp_attribute:
-            column_labels = {0: "line", 1: "i_node", 2: "j_node", 3: "loop_idx"}
-            for i, attribute_name in enumerate(attribute_names):
-                column_labels[i + 4] = temp_attribute
-                import_attributes(segments_filepath, ",", column_labels, scenario=scenario)
-                del column_labels[i + 4]
-
-                _, table = scenario.get_attribute_values("TRANSIT_SEGMENT", [temp_attribute])
-                tables.append(table)
-        scenario.set_attribute_values("TRANSIT_SEGMENT", attribute_names, [index] + tables)
+        self._load_results_file(scenario, "TRANSIT_SEGMENT", segments_filepath, attribute_names)
 
         # Technically, a file generated by 'export_network_package.py' should already have this file so long as there
         # are transit results. However, some older versions of the tool do NOT have this feature, but can actually have
         # transit results. So this conditional exists for backwards-compatibility.
         if self._components.aux_transit_results_file is not None:
             aux_transit_filename = self._components.aux_transit_results_file
-            zf.extract(aux_transit_filename, temp_folder)
-            aux_transit_filepath = _path.join(temp_folder, aux_transit_filename)
+            aux_transit_filepath = self._extract(zf, aux_transit_filename, temp_folder)
 
             aux_attribute_names = ["aux_transit_volume"]
-            index, _ = scenario.get_attribute_values("LINK", ["data1"])
+            self._load_results_file(scenario, "LINK", aux_transit_filepath, aux_attribute_names)
 
-            tables = []
-            with _util.temp_extra_attribute_manager(scenario, "LINK", returnId=True) as temp_attribute:
-                column_labels = {0: "i_node", 1: "j_node"}
-                for i, attribute_name in enumerate(aux_attribute_names):
-                    column_labels[i + 2] = temp_attribute
-                    import_attributes(aux_transit_filepath, ",", column_labels, scenario=scenario)
-                    del column_labels[i + 2]
+    def _load_results_file(self, scenario, domain, filepath, attribute_names):
+        """
+        Reads a results file written by ExportNetworkPackage and sets all of its columns on
+        the scenario with a single call. Elements without a row are set to 0.
+        """
+        dtype = None
+        if domain == "TRANSIT_SEGMENT":
+            # Line names that look like numbers must still match the line ids
+            dtype = {_pd.read_csv(filepath, nrows=0).columns[0]: str}
+        frame = _pd.read_csv(filepath, dtype=dtype)
+        self._set_values_from_frame(
+            scenario,
+            domain,
+            frame,
+            _RESULT_KEY_COLUMNS[domain],
+            attribute_names,
+            [0.0] * len(attribute_names),
+            _path.basename(filepath),
+        )
 
-                    _, table = scenario.get_attribute_values("LINK", [temp_attribute])
-                    tables.append(table)
-            scenario.set_attribute_values("LINK", aux_attribute_names, [index] + tables)
+    def _set_values_from_frame(
+        self, scenario, domain, frame, key_count, attribute_names, defaults, source_name, fallback=None
+    ):
+        """
+        Sets attribute_names on the scenario with a single call. The first key_count columns
+        of frame identify the element of each row and the following columns hold the values.
+        Elements without a row get the attribute's entry in defaults, and rows that do not
+        match an element of the scenario are reported to the logbook. If fallback is given,
+        it is called instead of setting any values whenever a row does not match.
+        """
+        index, template = scenario.get_attribute_values(domain, ["data1"])
+        positions = self._get_element_positions(domain, index)
+
+        key_columns = list(frame.columns[:key_count])
+        # Hidden segments have no j node, which is read back as NaN
+        keys = list(zip(*[frame[c].astype(object).where(frame[c].notnull(), None) for c in key_columns]))
+        if domain == "TRANSIT_SEGMENT" and key_count == 3:
+            keys = [key + (1,) for key in keys]
+        slots = _np.fromiter((positions.get(key, -1) for key in keys), dtype=_np.int64, count=len(keys))
+        matched = slots >= 0
+        unmatched = [key for key, is_matched in zip(keys, matched) if not is_matched]
+        if len(unmatched) > 0 and fallback is not None:
+            _m.logbook_write(
+                "%d of %d rows of '%s' do not match a %s in scenario %s, importing it with Emme instead"
+                % (len(unmatched), len(keys), source_name, domain.lower().replace("_", " "), scenario.number)
+            )
+            fallback()
+            return
+
+        tables = []
+        for column, default in zip(frame.columns[key_count : key_count + len(attribute_names)], defaults):
+            table = _np.full(len(template), default, dtype=_np.float64)
+            table[slots[matched]] = frame[column].values[matched]
+            tables.append(table)
+        scenario.set_attribute_values(domain, attribute_names, [index] + tables)
+
+        if len(unmatched) > 0:
+            _m.logbook_write(
+                "%d of %d rows of '%s' do not match a %s in scenario %s and were skipped, for example: %s"
+                % (
+                    len(unmatched),
+                    len(keys),
+                    source_name,
+                    domain.lower().replace("_", " "),
+                    scenario.number,
+                    ", ".join(str(key) for key in unmatched[:_MISMATCH_EXAMPLES]),
+                )
+            )
+
+    @staticmethod
+    def _get_element_positions(domain, index):
+        """
+        Flattens the index package returned by get_attribute_values into a dictionary of
+        the key columns of a file -> table position.
+        """
+        positions = {}
+        if domain == "NODE" or domain == "TRANSIT_LINE":
+            for key, pos in index.items():
+                positions[(key,)] = pos
+        elif domain == "LINK":
+            for i, outgoing_data in index.items():
+                for j, pos in outgoing_data.items():
+                    positions[(i, j)] = pos
+        elif domain == "TURN":
+            for (i, j), outgoing_data in index.items():
+                for k, pos in outgoing_data.items():
+                    positions[(i, j, k)] = pos
+        else:
+            for line_id, segment_data in index.items():
+                for key, pos in segment_data.items():
+                    loop = key[2] if len(key) == 3 else 1
+                    positions[(line_id, key[0], key[1], loop)] = pos
+        return positions
 
     @contextmanager
     def _temp_file(self):
@@ -847,6 +1089,36 @@ class ImportNetworkPackage(_m.Tool()):
             _shutil.rmtree(foldername, True)
             _m.logbook_write("Deleted temporary directory at '%s'" % foldername)
 
+    @contextmanager
+    def _extraction_cache(self):
+        self._cache_statistics = None
+        if not self.extraction_cache_directory or self.extraction_cache_size <= 0:
+            self._cache = None
+            yield None
+            return
+        self._cache = ExtractionCache(self.extraction_cache_directory, self.extraction_cache_size * 1024 * 1024)
+        self._package_hash = ExtractionCache.package_hash(self.network_package_file)
+        try:
+            yield self._cache
+        finally:
+            removed = self._cache.trim()
+            _m.logbook_write(
+                "Extraction cache at '%s': %d hits, %d misses, %d entries evicted"
+                % (self._cache.directory, self._cache.hits, self._cache.misses, removed)
+            )
+            self._cache_statistics = {"hits": self._cache.hits, "misses": self._cache.misses, "evicted": removed}
+            self._cache = None
+
+    def _extract(self, zf, member, temp_folder, transform=None):
+        """Returns the path to the extracted member, upgraded in place by transform if given."""
+        if self._cache is not None:
+            variant = "" if transform is None else "%s-%s" % (transform.__name__, self.version)
+            return self._cache.extract(zf, member, self._package_hash, transform, variant)
+        filename = zf.extract(member, temp_folder)
+        if transform is not None:
+            transform(filename)
+        return filename
+
     def _getZipOriginalString(self, processed, contents, objective):
         for i in range(len(processed)):
             if processed[i] == objective:
@@ -929,9 +1201,9 @@ class ImportNetworkPackage(_m.Tool()):
         return atts
 
     def _load_extra_attributes(self, zf, temp_folder, scenario):
-        zf.extract(self._components.attribute_header_file, temp_folder)
-        types = set()
-        with open(_path.join(temp_folder, self._components.attribute_header_file)) as reader:
+        """Creates the attributes defined in exatts.241, returning {domain: {name: default value}}."""
+        attributes = {}
+        with open(self._extract(zf, self._components.attribute_header_file, temp_folder)) as reader:
             reader.readline()  # toss first line
             for line in reader.readlines():
                 cells = line.split(",", 3)
@@ -939,14 +1211,12 @@ class ImportNetworkPackage(_m.Tool()):
                     att = scenario.create_extra_attribute(cells[1], cells[0], default_value=float(cells[2]))
                     att.description = cells[3].strip().strip("'")
                     # strip called twice: once to remove the '\n' character, and once to remove both ' characters
-                    types.add(att.type)
-        return types
-
-    def _transit_line_file_update(self, temp_folder):
-        lines = []
-        with open(_path.join(temp_folder, self._components.lines_file), "r") as infile, open(
-            _path.join(temp_folder, "temp.221"), "w"
-        ) as outfile:
+                    attributes.setdefault(att.type, {})[att.name] = float(cells[2])
+        return attributes
+
+    def _transit_line_file_update(self, lines_file):
+        temp_file = _path.join(_path.dirname(lines_file), "temp.221")
+        with open(lines_file, "r") as infile, open(temp_file, "w") as outfile:
             for line in infile:
                 if line[0] == "c":
                     outfile.write(line.replace("'", ""))
@@ -982,11 +1252,8 @@ class ImportNetworkPackage(_m.Tool()):
                 else:
                     outfile.write(line)
         outfile.close()
-        os.remove(_path.join(temp_folder, self._components.lines_file))
-        os.renames(
-            _path.join(temp_folder, "temp.221"),
-            _path.join(temp_folder, self._components.lines_file),
-        )
+        os.remove(lines_file)
+        os.renames(temp_file, lines_file)
         return None
 
     # @_m.method(return_type=_m.TupleType)
@@ -0,0 +1,1166 @@
+"""
+    Copyright 2022 Travel Modelling Group, Department of Civil Engineering, University of Toronto
+
+    This file is part of the TMG Toolbox.
+
+    The TMG Toolbox is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    The TMG Toolbox is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with the TMG Toolbox.  If not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+Vectorized kernels used by the congested transit assignment (tmg2.Assign.assign_transit).
+
+The congested loop evaluates the segment congestion function several times per
+iteration for every transit segment in the network. Instead of walking the
+Network object in Python, the segments are laid out once in flat NumPy arrays
+(ordered line by line) and every evaluation is done as a whole-array operation.
+"""
+import csv
+import hashlib
+import json
+import math
+import os
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import inro.modeller as _m
+
+_MODELLER = _m.Modeller()
+
+
+class Face(_m.Tool()):
+    def page(self):
+        pb = _m.ToolPageBuilder(
+            self,
+            runnable=False,
+            title="Congested Transit Utilities",
+            description="Vectorized segment kernels for the congested transit assignment",
+            branding_text="- TMG Toolbox",
+        )
+
+        pb.add_text_element("To import, call inro.modeller.Modeller().module('%s')" % str(self))
+
+        return pb.render()
+
+
+# -------------------------------------------------------------------------------------------
+
+
+def _segment_positions(package_index):
+    """
+    Flattens the TRANSIT_SEGMENT index package returned by get_attribute_values into
+    a dictionary of (line_id, i_node, j_node, loop_index) -> table position.
+    """
+    positions = {}
+    for line_id, segment_data in package_index.items():
+        for key, pos in segment_data.items():
+            loop = key[2] if len(key) == 3 else 1
+            positions[(line_id, key[0], key[1], loop)] = pos
+    return positions
+
+
+class SegmentIndex(object):
+    """
+    Line-ordered layout of every transit segment (hidden segments included) of a
+    network. Built once per assignment; afterwards attribute tables are converted
+    to and from this layout with gather / scatter.
+
+    Args:
+        - network: The Emme Network object holding the transit lines.
+        - package_index: The TRANSIT_SEGMENT index package (first element of the
+            get_attribute_values return) of the object the tables will be read from.
+        - table_size: The length of the attribute tables that package_index refers to.
+        - capacity_attribute (="total_capacity"): The TRANSIT_LINE attribute holding the
+            capacity of the line for the assignment period. None to skip capacities.
+        - link_attributes (=()): LINK attributes of each segment's link to keep, in
+            link_values. Hidden segments get 0.
+    """
+
+    def __init__(self, network, package_index, table_size, capacity_attribute="total_capacity", link_attributes=()):
+        positions = _segment_positions(package_index)
+        order = []
+        line_start = [0]
+        line_ids = []
+        number = []
+        hidden = []
+        length = []
+        capacity = []
+        ttf = []
+        link_values = {name: [] for name in link_attributes}
+        for line in network.transit_lines():
+            line_capacity = float(line[capacity_attribute]) if capacity_attribute is not None else 0.0
+            for segment in line.segments(include_hidden=True):
+                j_node = segment.j_node
+                j = j_node.number if j_node is not None else None
+                order.append(positions.get((line.id, segment.i_node.number, j, segment.loop_index), -1))
+                number.append(segment.number)
+                is_hidden = j_node is None
+                hidden.append(is_hidden)
+                length.append(0.0 if is_hidden else float(segment.link.length))
+                capacity.append(line_capacity)
+                ttf.append(int(segment.transit_time_func))
+                for name, values in link_values.items():
+                    values.append(0.0 if is_hidden else float(segment.link[name]))
+            line_ids.append(line.id)
+            line_start.append(len(order))
+        self.package_index = package_index
+        self.table_size = table_size
+        self.order = np.array(order, dtype=np.int64)
+        self.valid = self.order >= 0
+        self.line_start = np.array(line_start, dtype=np.int64)
+        self.line_ids = line_ids
+        self.number = np.array(number, dtype=np.int64)
+        self.hidden = np.array(hidden, dtype=bool)
+        self.active = ~self.hidden
+        self.length = np.array(length, dtype=np.float64)
+        self.capacity = np.array(capacity, dtype=np.float64)
+        self.ttf = np.array(ttf, dtype=np.int64)
+        self.link_values = {name: np.array(values, dtype=np.float64) for name, values in link_values.items()}
+
+    def __len__(self):
+        return len(self.order)
+
+    def gather(self, table):
+        """Converts an attribute table into the line-ordered layout."""
+        table = np.asarray(table, dtype=np.float64)
+        values = np.zeros(len(self.order), dtype=np.float64)
+        values[self.valid] = table[self.order[self.valid]]
+        return values
+
+    def scatter(self, values):
+        """Converts a line-ordered array back into an attribute table."""
+        table = np.zeros(self.table_size, dtype=np.float64)
+        table[self.order[self.valid]] = values[self.valid]
+        return table
+
+    def read(self, source, attributes):
+        """
+        Reads TRANSIT_SEGMENT attributes from a Scenario or Network in one call.
+
+        Returns: A dictionary of attribute name -> line-ordered array.
+        """
+        attributes = list(attributes)
+        package = source.get_attribute_values("TRANSIT_SEGMENT", attributes)
+        return {name: self.gather(table) for name, table in zip(attributes, package[1:])}
+
+    def write(self, target, attributes, arrays):
+        """Writes line-ordered arrays into TRANSIT_SEGMENT attributes of a Scenario or Network."""
+        tables = [self.scatter(values) for values in arrays]
+        target.set_attribute_values("TRANSIT_SEGMENT", list(attributes), [self.package_index] + tables)
+
+
+# -------------------------------------------------------------------------------------------
+
+
+def conical_cost(volume, capacity, alpha, beta, perception):
+    """
+    Vectorized conical congestion function used by the TMG congested transit assignment:
+
+        max(0, perception * (1 + sqrt(alpha^2 * (1 - v/c)^2 + beta^2) - alpha * (1 - v/c) - beta))
+    """
+    one_minus_vc = 1.0 - volume / capacity
+    cost = perception * (1.0 + np.sqrt(alpha * alpha * one_minus_vc * one_minus_vc + beta * beta) - alpha * one_minus_vc - beta)
+    return np.maximum(cost, 0.0)
+
+
+_CONGESTION_FUNCTIONS = {}
+
+
+def register_congestion_function(function_type):
+    """Class decorator adding a CongestionFunction to the registry under its name."""
+    _CONGESTION_FUNCTIONS[function_type.name] = function_type
+    return function_type
+
+
+def get_congestion_function(ttf_def):
+    """
+    Creates the congestion function of a TTF definition. The "congestion_function" key
+    selects it by name and defaults to "conical".
+    """
+    name = str(ttf_def.get("congestion_function", "") or "conical").lower()
+    if name not in _CONGESTION_FUNCTIONS:
+        raise Exception(
+            "Unknown congestion function '%s' for TTF%s. Available functions are %s"
+            % (name, ttf_def["ttf"], ", ".join(sorted(_CONGESTION_FUNCTIONS)))
+        )
+    return _CONGESTION_FUNCTIONS[name](ttf_def)
+
+
+class CongestionFunction(object):
+    """
+    A transit congestion function of the volume to capacity ratio. The value is the
+    congestion term multiplying the segment's base time, (1 + value) * base time.
+
+    Subclasses provide the vectorized value and its first derivative with respect to
+    the volume, and the Python source used by the Emme custom congestion function.
+    """
+
+    name = None
+
+    def __init__(self, ttf_def):
+        self.perception = float(ttf_def["congestion_perception"])
+
+    def value(self, volume, capacity):
+        raise NotImplementedError()
+
+    def derivative(self, volume, capacity):
+        raise NotImplementedError()
+
+    def source(self):
+        """
+        A Python expression of the congestion term, in terms of the variables vc and
+        one_minus_vc defined by the generated calc_segment_cost function.
+        """
+        raise NotImplementedError()
+
+
+@register_congestion_function
+class ConicalCongestion(CongestionFunction):
+    """Spiess' conical function, parameterised by congestion_exponent."""
+
+    name = "conical"
+
+    def __init__(self, ttf_def):
+        CongestionFunction.__init__(self, ttf_def)
+        self.alpha = float(ttf_def["congestion_exponent"])
+        self.beta = (2 * self.alpha - 1) / (2 * self.alpha - 2)
+
+    def value(self, volume, capacity):
+        return conical_cost(volume, capacity, self.alpha, self.beta, self.perception)
+
+    def derivative(self, volume, capacity):
+        alpha, beta = self.alpha, self.beta
+        one_minus_vc = 1.0 - volume / capacity
+        root = np.sqrt(alpha * alpha * one_minus_vc * one_minus_vc + beta * beta)
+        slope = self.perception * (alpha - alpha * alpha * one_minus_vc / root) / capacity
+        return np.where(self.value(volume, capacity) > 0.0, slope, 0.0)
+
+    def source(self):
+        return "max(0,(%s * (1 + math.sqrt(%s * one_minus_vc * one_minus_vc + %s) - %s * one_minus_vc - %s)))" % (
+            self.perception,
+            self.alpha * self.alpha,
+            self.beta * self.beta,
+            self.alpha,
+            self.beta,
+        )
+
+
+@register_congestion_function
+class BPRCongestion(CongestionFunction):
+    """BPR-style power function, congestion_perception * (v/c) ^ congestion_exponent."""
+
+    name = "bpr"
+
+    def __init__(self, ttf_def):
+        CongestionFunction.__init__(self, ttf_def)
+        self.exponent = float(ttf_def["congestion_exponent"])
+        if self.exponent < 1.0:
+            raise Exception("The BPR congestion exponent of TTF%s must be at least 1." % ttf_def["ttf"])
+
+    def value(self, volume, capacity):
+        vc = np.maximum(volume / capacity, 0.0)
+        return self.perception * vc ** self.exponent
+
+    def derivative(self, volume, capacity):
+        vc = np.maximum(volume / capacity, 0.0)
+        return self.perception * self.exponent * vc ** (self.exponent - 1.0) / capacity
+
+    def source(self):
+        return "%s * max(0, vc) ** %s" % (self.perception, self.exponent)
+
+
+@register_congestion_function
+class PiecewiseLinearCongestion(CongestionFunction):
+    """
+    Piecewise-linear crowding curve. crowding_curve lists (v/c, congestion term) break
+    points, either as pairs or as a "vc:value,vc:value" string. The term is flat below
+    the first break point and the last slope continues past the last one. The result is
+    scaled by congestion_perception.
+    """
+
+    name = "piecewise_linear"
+
+    def __init__(self, ttf_def):
+        CongestionFunction.__init__(self, ttf_def)
+        points = ttf_def.get("crowding_curve", [])
+        if isinstance(points, str):
+            points = [point.split(":") for point in points.replace(" ", "").split(",") if point]
+        points = [(float(x), float(y)) for x, y in points]
+        xs = np.array([x for x, _ in points], dtype=np.float64)
+        if len(points) < 2 or np.any(np.diff(xs) <= 0.0):
+            raise Exception(
+                "The crowding curve of TTF%s needs at least two break points with increasing v/c." % ttf_def["ttf"]
+            )
+        self.xs = xs
+        self.ys = np.array([y for _, y in points], dtype=np.float64)
+        self.slopes = np.diff(self.ys) / np.diff(self.xs)
+
+    def _locate(self, vc):
+        piece = np.clip(np.searchsorted(self.xs, vc, side="right") - 1, 0, len(self.slopes) - 1)
+        slope = np.where(vc < self.xs[0], 0.0, self.slopes[piece])
+        return piece, slope
+
+    def value(self, volume, capacity):
+        vc = volume / capacity
+        piece, slope = self._locate(vc)
+        curve = np.where(vc < self.xs[0], self.ys[0], self.ys[piece] + slope * (vc - self.xs[piece]))
+        return self.perception * curve
+
+    def derivative(self, volume, capacity):
+        _, slope = self._locate(volume / capacity)
+        return self.perception * slope / capacity
+
+    def source(self):
+        xs, ys, slopes = self.xs, self.ys, self.slopes
+        expression = "(%s + (vc - %s) * %s)" % (ys[-2], xs[-2], slopes[-1])
+        for i in range(len(slopes) - 2, -1, -1):
+            expression = "(%s + (vc - %s) * %s if vc < %s else %s)" % (ys[i], xs[i], slopes[i], xs[i + 1], expression)
+        return "%s * (%s if vc < %s else %s)" % (self.perception, ys[0], xs[0], expression)
+
+
+class SegmentCostKernel(object):
+    """
+    Evaluates segment costs, the step-size gradient and network costs of the congested
+    transit assignment as whole-array operations over a SegmentIndex.
+
+    Only segments visited by line.segments() (i.e. not hidden) contribute, matching
+    the reference implementation in AssignTransit.
+    """
+
+    def __init__(self, index, ttf_definitions):
+        self.index = index
+        self.functions = {}
+        # The first definition of a TTF wins, as it does in the reference implementation
+        for ttf_def in ttf_definitions:
+            ttf = int(ttf_def["ttf"])
+            if ttf not in self.functions:
+                self.functions[ttf] = get_congestion_function(ttf_def)
+        active = index.active
+        active_ttf = index.ttf[active]
+        used_ttfs = [int(ttf) for ttf in np.unique(active_ttf)]
+        for ttf in used_ttfs:
+            if ttf not in self.functions:
+                raise Exception("TTF definitions do not contain TTF%s" % str(ttf))
+        self.active = active
+        self._active_capacity = index.capacity[active]
+        # Positions (within the active segments) of the segments using each function
+        self._groups = [(self.functions[ttf], np.flatnonzero(active_ttf == ttf)) for ttf in used_ttfs]
+
+    def _evaluate(self, method, volume):
+        """
+        Applies the value or derivative of each TTF's function to active segment volumes,
+        with the segments on the last axis.
+        """
+        result = np.zeros(np.shape(volume), dtype=np.float64)
+        for function, members in self._groups:
+            result[..., members] = getattr(function, method)(volume[..., members], self._active_capacity[members])
+        return result
+
+    def cost(self, volume):
+        """The congestion term for every segment at the given segment volumes."""
+        cost = np.zeros(len(self.index), dtype=np.float64)
+        cost[self.active] = self._evaluate("value", volume[self.active])
+        return cost
+
+    def segment_costs(self, volume):
+        """
+        Returns: (cost, excess_km) where excess_km is the passenger-km travelled
+            over capacity.
+        """
+        capacity = self.index.capacity
+        over = self.active & (volume >= capacity)
+        excess_km = float(np.sum((volume[over] - capacity[over]) * self.index.length[over]))
+        return self.cost(volume), excess_km
+
+    def congestion_costs(self, volume, base_time, dwell_time, assigned_total_demand):
+        """The average congestion cost per trip at the given volumes."""
+        flow_x_time = volume * (base_time - dwell_time)
+        return float(np.sum((flow_x_time * self.cost(volume))[self.active])) / assigned_total_demand
+
+    def _free_flow_time(self, transit_time, dwell_time, cost):
+        return (transit_time - dwell_time) / (1.0 + cost)
+
+    def gradient(self, lambdaK, assigned_volume, cumulative_volume, transit_time, dwell_time, cost, assigned_total_demand):
+        """The derivative of the objective along the search direction at step lambdaK."""
+        t0 = self._free_flow_time(transit_time, dwell_time, cost)
+        volume_difference = cumulative_volume - assigned_volume
+        if lambdaK == 1:
+            adjusted_volume = cumulative_volume
+        else:
+            adjusted_volume = assigned_volume + lambdaK * volume_difference
+        cost_difference = self.cost(adjusted_volume) - self.cost(assigned_volume)
+        return float(np.sum((t0 * cost_difference * volume_difference)[self.active])) / assigned_total_demand
+
+    def gradient_batch(
+        self,
+        lambdas,
+        assigned_volume,
+        cumulative_volume,
+        transit_time,
+        dwell_time,
+        cost,
+        assigned_total_demand,
+        derivative=False,
+    ):
+        """
+        The gradient at every step in lambdas, evaluated in a single pass over the segments
+        as a (len(lambdas), active segments) array.
+
+        With derivative=True, returns (gradients, derivatives) where derivatives are the
+        analytic derivatives of the gradient with respect to the step.
+        """
+        lambdas = np.asarray(lambdas, dtype=np.float64)
+        active = self.active
+        t0 = self._free_flow_time(transit_time, dwell_time, cost)[active]
+        assigned = assigned_volume[active]
+        cumulative = cumulative_volume[active]
+        volume_difference = cumulative - assigned
+        adjusted_volume = assigned + lambdas[:, np.newaxis] * volume_difference
+        adjusted_volume[lambdas == 1] = cumulative
+        cost_difference = self._evaluate("value", adjusted_volume) - self._evaluate("value", assigned)
+        weight = t0 * volume_difference
+        gradients = np.dot(cost_difference, weight) / assigned_total_demand
+        if not derivative:
+            return gradients
+        derivatives = np.dot(self._evaluate("derivative", adjusted_volume), weight * volume_difference)
+        return gradients, derivatives / assigned_total_demand
+
+    def network_costs(self, lambdaK, assigned_volume, cumulative_volume, transit_time, dwell_time, cost, assigned_total_demand):
+        """The change in the network congestion cost after taking step lambdaK."""
+        t0 = self._free_flow_time(transit_time, dwell_time, cost)
+        adjusted_volume = assigned_volume + lambdaK * (cumulative_volume - assigned_volume)
+        cost_difference = self.cost(adjusted_volume) - self.cost(assigned_volume)
+        return float(np.sum((t0 * cost_difference * adjusted_volume)[self.active])) / assigned_total_demand
+
+
+class ReferenceSegmentCostKernel(SegmentCostKernel):
+    """
+    Pure-Python, segment-by-segment evaluation of the same quantities as SegmentCostKernel.
+    Kept for regression comparison of the vectorized kernel.
+    """
+
+    def __init__(self, index, ttf_definitions):
+        SegmentCostKernel.__init__(self, index, ttf_definitions)
+        self.ttf_definitions = ttf_definitions
+
+    def _segment_cost(self, transit_volume, capacity, ttf):
+        for ttf_def in self.ttf_definitions:
+            if ttf == ttf_def["ttf"]:
+                function = self.functions[ttf]
+                if not isinstance(function, ConicalCongestion):
+                    return float(function.value(np.float64(transit_volume), capacity))
+                alpha = ttf_def["congestion_exponent"]
+                beta = (2 * alpha - 1) / (2 * alpha - 2)
+                alpha_square = alpha * alpha
+                beta_square = beta * beta
+                return max(
+                    0,
+                    ttf_def["congestion_perception"]
+                    * (
+                        1
+                        + math.sqrt(alpha_square * (1 - transit_volume / capacity) ** 2 + beta_square)
+                        - alpha * (1 - transit_volume / capacity)
+                        - beta
+                    ),
+                )
+        raise Exception("TTF definitions do not contain TTF%s" % str(ttf))
+
+    def _active_segments(self):
+        index = self.index
+        for k in range(len(index)):
+            if index.active[k]:
+                yield k, float(index.capacity[k]), int(index.ttf[k])
+
+    def cost(self, volume):
+        cost = np.zeros(len(self.index), dtype=np.float64)
+        for k, capacity, ttf in self._active_segments():
+            cost[k] = self._segment_cost(float(volume[k]), capacity, ttf)
+        return cost
+
+    def segment_costs(self, volume):
+        excess_km = 0.0
+        for k, capacity, ttf in self._active_segments():
+            if volume[k] >= capacity:
+                excess_km += (volume[k] - capacity) * self.index.length[k]
+        return self.cost(volume), float(excess_km)
+
+    def congestion_costs(self, volume, base_time, dwell_time, assigned_total_demand):
+        congestion_cost = 0.0
+        for k, capacity, ttf in self._active_segments():
+            flow_x_time = float(volume[k]) * (float(base_time[k]) - float(dwell_time[k]))
+            congestion_cost += flow_x_time * self._segment_cost(float(volume[k]), capacity, ttf)
+        return congestion_cost / assigned_total_demand
+
+    def gradient(self, lambdaK, assigned_volume, cumulative_volume, transit_time, dwell_time, cost, assigned_total_demand):
+        value = 0.0
+        for k, capacity, ttf in self._active_segments():
+            t0 = (transit_time[k] - dwell_time[k]) / (1 + cost[k])
+            volume_difference = cumulative_volume[k] - assigned_volume[k]
+            if lambdaK == 1:
+                adjusted_volume = cumulative_volume[k]
+            else:
+                adjusted_volume = assigned_volume[k] + lambdaK * volume_difference
+            cost_difference = self._segment_cost(adjusted_volume, capacity, ttf) - self._segment_cost(
+                assigned_volume[k], capacity, ttf
+            )
+            value += t0 * cost_difference * volume_difference
+        return float(value) / assigned_total_demand
+
+    def _segment_cost_derivative(self, transit_volume, capacity, ttf):
+        return float(self.functions[ttf].derivative(np.float64(transit_volume), capacity))
+
+    def gradient_batch(
+        self,
+        lambdas,
+        assigned_volume,
+        cumulative_volume,
+        transit_time,
+        dwell_time,
+        cost,
+        assigned_total_demand,
+        derivative=False,
+    ):
+        terms = (assigned_volume, cumulative_volume, transit_time, dwell_time, cost, assigned_total_demand)
+        gradients = np.array([self.gradient(lambdaK, *terms) for lambdaK in lambdas], dtype=np.float64)
+        if not derivative:
+            return gradients
+        derivatives = []
+        for lambdaK in lambdas:
+            value = 0.0
+            for k, capacity, ttf in self._active_segments():
+                t0 = (transit_time[k] - dwell_time[k]) / (1 + cost[k])
+                volume_difference = cumulative_volume[k] - assigned_volume[k]
+                adjusted_volume = assigned_volume[k] + lambdaK * volume_difference
+                value += t0 * self._segment_cost_derivative(adjusted_volume, capacity, ttf) * volume_difference ** 2
+            derivatives.append(value / assigned_total_demand)
+        return gradients, np.array(derivatives, dtype=np.float64)
+
+    def network_costs(self, lambdaK, assigned_volume, cumulative_volume, transit_time, dwell_time, cost, assigned_total_demand):
+        value = 0.0
+        for k, capacity, ttf in self._active_segments():
+            t0 = (transit_time[k] - dwell_time[k]) / (1 + cost[k])
+            adjusted_volume = assigned_volume[k] + lambdaK * (cumulative_volume[k] - assigned_volume[k])
+            cost_difference = self._segment_cost(adjusted_volume, capacity, ttf) - self._segment_cost(
+                assigned_volume[k], capacity, ttf
+            )
+            value += t0 * cost_difference * adjusted_volume
+        return float(value) / assigned_total_demand
+
+
+# -------------------------------------------------------------------------------------------
+
+
+class StepSizeSearch(object):
+    """
+    Finds the MSA step size lambda in [0, 1] where the gradient of the objective
+    crosses zero.
+
+    The "newton" method takes safeguarded Newton steps using the analytic derivative of
+    the gradient, falling back to regula falsi whenever a step would leave the current
+    bracket; it needs one gradient evaluation per pass. The "bracket" method evaluates
+    the gradient at a vector of candidate steps per pass and narrows the bracket around
+    the first sign change; the step is then interpolated linearly inside the final bracket.
+    The "muller" method is the sequential Muller iteration the assignment used before,
+    one gradient evaluation per pass, kept as the reference for check().
+
+    The three methods stop at different points inside the tolerance, so their steps agree
+    to within the tolerance rather than exactly; differences of up to about 3.4e-5 have
+    been seen at the default tolerance.
+
+    Args:
+        - tolerance (=0.001): The bracket width (or Newton or Muller step length) at which
+            the search stops.
+        - max_passes (=None): The maximum number of passes over the segments. Defaults to
+            10 for "newton", 3 for "bracket" and 21 for "muller".
+        - candidates (=16): The number of steps evaluated per pass by "bracket".
+        - method (="newton"): "newton", "bracket" or "muller".
+    """
+
+    def __init__(self, tolerance=0.001, max_passes=None, candidates=16, method="newton"):
+        if method not in ("newton", "bracket", "muller"):
+            raise Exception("Unknown step size method '%s'. Use 'newton', 'bracket' or 'muller'." % method)
+        if max_passes is None:
+            max_passes = {"newton": 10, "bracket": 3, "muller": 21}[method]
+        if tolerance <= 0.0:
+            raise Exception("The step size tolerance must be positive.")
+        if max_passes < 1 or candidates < 1:
+            raise Exception("The step size search needs at least one pass and one candidate.")
+        self.tolerance = float(tolerance)
+        self.max_passes = int(max_passes)
+        self.candidates = int(candidates)
+        self.method = method
+
+    def _check_finite(self, values):
+        if not np.all(np.isfinite(values)):
+            raise Exception(
+                "Congested transit assignment cannot be applied to this transit network, please use Capacitated transit assignment instead."
+            )
+
+    def solve(self, gradient_batch, offset):
+        """
+        Args:
+            - gradient_batch: A function taking an array of steps and returning the
+                gradient (without offset) at each of them. The gradient is zero at step 0.
+                The "newton" method calls it with derivative=True and expects
+                (gradients, derivatives).
+            - offset: The constant part of the gradient (average minimum trip impedance
+                less the average impedance of the previous iteration).
+
+        Returns: (lambdaK, evaluations) where evaluations is the number of gradient
+            evaluations used.
+        """
+        if self.method == "newton":
+            return self._solve_newton(gradient_batch, offset)
+        if self.method == "muller":
+            return self._solve_muller(gradient_batch, offset)
+        return self._solve_bracket(gradient_batch, offset)
+
+    def check(self, gradient_batch, offset, lambdaK):
+        """
+        Regression check of a step found by this search against the Muller iteration run at
+        the same tolerance. Raises an exception if the two differ by more than the tolerance.
+
+        Returns: The absolute difference between the two steps.
+        """
+        reference, _ = StepSizeSearch(tolerance=self.tolerance, method="muller").solve(gradient_batch, offset)
+        difference = abs(lambdaK - reference)
+        if difference > self.tolerance:
+            raise Exception(
+                "The %s step size %g differs from the Muller step size %g by more than the tolerance %g."
+                % (self.method, lambdaK, reference, self.tolerance)
+            )
+        return difference
+
+    def _solve_newton(self, gradient_batch, offset):
+        low, high = 0.0, 1.0
+        g_low, g_high = offset, None
+        evaluations = 0
+        if g_low >= 0.0:
+            return 0.0, evaluations
+        step = 1.0
+        for _ in range(self.max_passes):
+            gradients, derivatives = gradient_batch(np.array([step]), derivative=True)
+            gradient = float(gradients[0]) + offset
+            slope = float(derivatives[0])
+            evaluations += 1
+            self._check_finite([gradient, slope])
+            if gradient == 0.0:
+                return step, evaluations
+            if gradient < 0.0:
+                if step == 1.0:
+                    # The objective still decreases at a full step
+                    return 1.0, evaluations
+                low, g_low = step, gradient
+            else:
+                high, g_high = step, gradient
+            next_step = step - gradient / slope if slope > 0.0 else -1.0
+            if not low < next_step < high:
+                next_step = low - g_low * (high - low) / (g_high - g_low)
+            converged = abs(next_step - step) <= self.tolerance
+            step = next_step
+            if converged:
+                break
+        return max(0.0, min(1.0, step)), evaluations
+
+    def _solve_muller(self, gradient_batch, offset):
+        steps = [0.0, 0.5, 1.0]
+        gradients = [offset] + [float(g) + offset for g in gradient_batch(np.array(steps[1:]))]
+        evaluations = 2
+        self._check_finite(gradients)
+        lambdaK = 1.0
+        for _ in range(self.max_passes):
+            h1 = steps[1] - steps[0]
+            h2 = steps[2] - steps[1]
+            delta1 = (gradients[1] - gradients[0]) / h1
+            delta2 = (gradients[2] - gradients[1]) / h2
+            d = (delta2 - delta1) / (h1 + h2)
+            b = h2 * d + delta2
+            t1 = gradients[2] * d * 4
+            t2 = b ** 2
+            root = math.sqrt(t2 - t1) if t2 > t1 else 0.0
+            denominator = b + root if abs(b - root) < abs(b + root) else b - root
+            if denominator == 0.0:
+                self._check_finite([np.inf])
+            change = -2 * gradients[2] / denominator
+            lambdaK = steps[2] + change
+            if abs(change) < self.tolerance:
+                break
+            gradient = float(gradient_batch(np.array([lambdaK]))[0]) + offset
+            evaluations += 1
+            self._check_finite([gradient])
+            steps = steps[1:] + [lambdaK]
+            gradients = gradients[1:] + [gradient]
+        return max(0.0, min(1.0, lambdaK)), evaluations
+
+    def _solve_bracket(self, gradient_batch, offset):
+        low, high = 0.0, 1.0
+        g_low, g_high = offset, None
+        evaluations = 0
+        if g_low >= 0.0:
+            return 0.0, evaluations
+        for _ in range(self.max_passes):
+            if g_high is None:
+                steps = np.linspace(low, high, self.candidates + 1)[1:]
+            else:
+                steps = np.linspace(low, high, self.candidates + 2)[1:-1]
+            gradients = np.asarray(gradient_batch(steps), dtype=np.float64) + offset
+            evaluations += len(steps)
+            self._check_finite(gradients)
+            if g_high is not None:
+                steps = np.append(steps, high)
+                gradients = np.append(gradients, g_high)
+            crossing = np.flatnonzero(gradients >= 0.0)
+            if len(crossing) == 0:
+                # The objective still decreases at a full step
+                return 1.0, evaluations
+            first = crossing[0]
+            if first > 0:
+                low, g_low = float(steps[first - 1]), float(gradients[first - 1])
+            high, g_high = float(steps[first]), float(gradients[first])
+            if g_high == 0.0:
+                return high, evaluations
+            if high - low <= self.tolerance:
+                break
+        lambdaK = low - g_low * (high - low) / (g_high - g_low)
+        return max(0.0, min(1.0, lambdaK)), evaluations
+
+
+# -------------------------------------------------------------------------------------------
+
+SEGMENT_RESULT_ATTRIBUTES = ["transit_volume", "transit_boardings", "transit_time", "dwell_time"]
+# The state needed to continue the MSA from a completed iteration
+CHECKPOINT_SEGMENT_ARRAYS = ["voltr", "board", "timtr", "base_dwell_time", "dwell_time"]
+CHECKPOINT_NETWORK_ARRAYS = ["inboa", "fiali", "volax"]
+NODE_RESULT_ATTRIBUTES = ["initial_boardings", "final_alightings"]
+LINK_RESULT_ATTRIBUTES = ["aux_transit_volume"]
+
+
+class CongestedAssignmentState(object):
+    """
+    The method of successive averages (MSA) state of the congested transit assignment,
+    held in contiguous float64 arrays instead of Network attributes.
+
+    Segment arrays are line-ordered (see SegmentIndex). Node and link arrays keep the
+    table order of the scenario's index packages, which are stored to write them back.
+
+    Args:
+        - scenario: The scenario holding the results of the initial (iteration 0) assignment.
+        - network: A network with the transit lines of the scenario, only used to build
+            the segment index. It is not referenced afterwards.
+        - ttf_definitions: The "ttf_definitions" parameter block.
+        - reference (=False): Set to True to evaluate segment costs with ReferenceSegmentCostKernel.
+    """
+
+    def __init__(self, scenario, network, ttf_definitions, reference=False):
+        package = scenario.get_attribute_values("TRANSIT_SEGMENT", SEGMENT_RESULT_ATTRIBUTES)
+        self.index = SegmentIndex(network, package[0], len(package[1]))
+        kernel_type = ReferenceSegmentCostKernel if reference else SegmentCostKernel
+        self.kernel = kernel_type(self.index, ttf_definitions)
+        self._set_segment_results(package)
+        self._set_node_results(scenario.get_attribute_values("NODE", NODE_RESULT_ATTRIBUTES))
+        self._set_link_results(scenario.get_attribute_values("LINK", LINK_RESULT_ATTRIBUTES))
+        # MSA volumes
+        self.voltr = self.transit_volume.copy()
+        self.board = self.transit_boardings.copy()
+        self.inboa = self.initial_boardings.copy()
+        self.fiali = self.final_alightings.copy()
+        self.volax = self.aux_transit_volume.copy()
+        # Uncongested times of the initial assignment
+        self.timtr = self.transit_time.copy()
+        self.base_dwell_time = self.dwell_time.copy()
+        self.current_voltr = self.voltr.copy()
+        self.cost = np.zeros(len(self.index), dtype=np.float64)
+
+    def _set_segment_results(self, package):
+        for name, table in zip(SEGMENT_RESULT_ATTRIBUTES, package[1:]):
+            setattr(self, name, self.index.gather(table))
+
+    def _set_node_results(self, package):
+        self.node_index = package[0]
+        for name, table in zip(NODE_RESULT_ATTRIBUTES, package[1:]):
+            setattr(self, name, np.array(table, dtype=np.float64))
+
+    def _set_link_results(self, package):
+        self.link_index = package[0]
+        for name, table in zip(LINK_RESULT_ATTRIBUTES, package[1:]):
+            setattr(self, name, np.array(table, dtype=np.float64))
+
+    def refresh(self, scenario):
+        """Loads the results of the latest extended transit assignment from the scenario."""
+        self._set_segment_results(scenario.get_attribute_values("TRANSIT_SEGMENT", SEGMENT_RESULT_ATTRIBUTES))
+        self._set_node_results(scenario.get_attribute_values("NODE", NODE_RESULT_ATTRIBUTES))
+        self._set_link_results(scenario.get_attribute_values("LINK", LINK_RESULT_ATTRIBUTES))
+
+    def update_segment_costs(self):
+        """
+        Freezes the current MSA volumes and evaluates their congestion costs.
+
+        Returns: The excess passenger-km over capacity.
+        """
+        self.current_voltr[:] = self.voltr
+        self.cost, excess_km = self.kernel.segment_costs(self.voltr)
+        return excess_km
+
+    def volume_terms(self):
+        """The segment arrays used by SegmentCostKernel.gradient and network_costs, in order."""
+        return (self.current_voltr, self.transit_volume, self.transit_time, self.dwell_time, self.cost)
+
+    def update_volumes(self, lambdaK):
+        """Averages the latest assignment into the MSA volumes with step lambdaK, in place."""
+        alpha = 1.0 - lambdaK
+        for averaged, latest in (
+            (self.voltr, self.transit_volume),
+            (self.board, self.transit_boardings),
+            (self.inboa, self.initial_boardings),
+            (self.fiali, self.final_alightings),
+            (self.volax, self.aux_transit_volume),
+        ):
+            averaged *= alpha
+            averaged += lambdaK * latest
+
+    def congested_times(self):
+        """
+        Computes the final congested segment times from the MSA volumes.
+
+        Returns: (transit_time, congestion_cost) line-ordered arrays. Hidden segments keep
+            the transit time of the latest assignment and have no congestion cost.
+        """
+        active = self.index.active
+        congestion_term = self.kernel.cost(self.voltr)
+        # The dwell time at the end of a segment is stored on the next segment of the line
+        next_base_dwell = np.roll(self.base_dwell_time, -1)
+        next_dwell = np.roll(self.dwell_time, -1)
+        base_time = self.timtr - next_base_dwell
+        transit_time = self.transit_time.copy()
+        transit_time[active] = ((base_time + next_dwell) * (1.0 + congestion_term))[active]
+        congestion_cost = np.zeros(len(self.index), dtype=np.float64)
+        congestion_cost[active] = (transit_time - base_time)[active]
+        return transit_time, congestion_cost
+
+    def restore(self, checkpoint):
+        """
+        Replaces the MSA state with the arrays of a checkpoint read by read_checkpoint.
+        Raises an exception if the checkpoint was written for a different network.
+        """
+        sizes = (self.index.table_size, len(self.inboa), len(self.volax))
+        if tuple(int(size) for size in checkpoint["sizes"]) != sizes:
+            raise Exception(
+                "The checkpoint does not match the network of the scenario (segments, nodes, links: %s, expected %s)."
+                % (tuple(int(size) for size in checkpoint["sizes"]), sizes)
+            )
+        for name in CHECKPOINT_SEGMENT_ARRAYS:
+            setattr(self, name, self.index.gather(checkpoint[name]))
+        for name in CHECKPOINT_NETWORK_ARRAYS:
+            setattr(self, name, np.array(checkpoint[name], dtype=np.float64))
+        self.current_voltr = self.voltr.copy()
+
+    def write_volumes(self, scenario):
+        """Publishes the MSA volumes to the scenario's assignment results."""
+        scenario.set_attribute_values("NODE", NODE_RESULT_ATTRIBUTES, [self.node_index, self.inboa, self.fiali])
+        scenario.set_attribute_values("LINK", LINK_RESULT_ATTRIBUTES, [self.link_index, self.volax])
+        self.index.write(scenario, ["transit_volume", "transit_boardings"], [self.voltr, self.board])
+
+
+# -------------------------------------------------------------------------------------------
+
+
+def _line_values(scenario, index, attributes):
+    """Reads TRANSIT_LINE attributes from the scenario, in the line order of the SegmentIndex."""
+    package = scenario.get_attribute_values("TRANSIT_LINE", list(attributes))
+    positions = np.array([package[0][line_id] for line_id in index.line_ids], dtype=np.int64)
+    return [np.asarray(table, dtype=np.float64)[positions] for table in package[1:]]
+
+
+class SurfaceTransitSpeedModel(object):
+    """
+    The surface transit speed update (STSU) dwell time model, evaluated over the
+    line-ordered segment arrays of a SegmentIndex.
+
+    Per-line inputs (the STSU parameter set of the line, headway and door count) are
+    spread over the segments of each line once, so every update is a handful of
+    whole-array operations.
+
+    Args:
+        - scenario: The Emme Scenario holding the transit lines and @tstop.
+        - index: The SegmentIndex of the transit segments.
+        - surface_transit_speeds: The "surface_transit_speeds" parameter block.
+        - line_attribute: The TRANSIT_LINE attribute holding the (1-based) STSU parameter
+            set of each line, 0 for lines without STSU.
+        - assignment_period: The assignment period, in hours.
+    """
+
+    def __init__(self, scenario, index, surface_transit_speeds, line_attribute, assignment_period):
+        self.index = index
+        has_doors = scenario.extra_attribute("@doors") is not None
+        attributes = [str(line_attribute), "headway"] + (["@doors"] if has_doors else [])
+        segments_per_line = np.diff(index.line_start)
+        line_values = [np.repeat(values, segments_per_line) for values in _line_values(scenario, index, attributes)]
+        parameter_set = line_values[0].astype(np.int64)
+        headway = line_values[1]
+        # Two doors (one door pair) per vehicle is assumed when @doors is not defined
+        door_pairs = np.maximum(1.0, line_values[2] / 2.0) if has_doors else np.ones(len(index))
+        self.lines = parameter_set > 0
+        selected = np.maximum(parameter_set - 1, 0)
+
+        def stsu_values(name):
+            values = np.array([float(stsu[name]) for stsu in surface_transit_speeds] + [0.0], dtype=np.float64)
+            return np.where(self.lines, values[selected], 0.0)
+
+        inv_door_pair_runs = np.zeros(len(index), dtype=np.float64)
+        inv_door_pair_runs[self.lines] = headway[self.lines] / (door_pairs[self.lines] * assignment_period * 60.0)
+        self.boarding_factor = stsu_values("boarding_duration") * inv_door_pair_runs
+        self.alighting_factor = stsu_values("alighting_duration") * inv_door_pair_runs
+        self.default_duration = stsu_values("default_duration")
+        self.correlation = stsu_values("transit_auto_correlation")
+        self.global_erow_speed = stsu_values("global_erow_speed")
+        self.stops = index.read(scenario, ["@tstop"])["@tstop"]
+        # The first segment of each line is left at its base dwell time
+        self.updated = self.lines & index.active & (index.number > 0)
+
+    def alightings(self, volume, boardings):
+        """The alightings at the start of each segment, from the volumes of consecutive segments."""
+        previous_volume = np.concatenate(([0.0], volume[:-1]))
+        alightings = np.maximum(previous_volume + boardings - volume, 0.0)
+        alightings[self.index.number == 0] = 0.0
+        return alightings
+
+    def dwell_times(self, volume, boardings, dwell_time, lambdaK):
+        """
+        Blends the dwell times implied by the given volumes and boardings into dwell_time
+        with step lambdaK.
+
+        Returns: (dwell_time, alightings) as new line-ordered arrays.
+        """
+        alightings = self.alightings(volume, boardings)
+        segment_dwell_time = np.minimum(
+            99.8,
+            (self.boarding_factor * boardings + self.alighting_factor * alightings + self.stops * self.default_duration)
+            / 60.0,
+        )
+        updated = self.updated
+        result = dwell_time.copy()
+        result[updated] = dwell_time[updated] * (1.0 - lambdaK) + segment_dwell_time[updated] * lambdaK
+        return result, alightings
+
+    def base_speeds(self, scenario, stsu_ttf_map, ttfs_xrow, erow_defined):
+        """
+        Sets the initial dwell times, STSU transit time functions and base speeds (data1)
+        of the segments of STSU lines. The index must have been built with the
+        "auto_time" link attribute.
+        """
+        index = self.index
+        attributes = ["dwell_time", "transit_time_func", "data1", "allow_alightings", "allow_boardings"]
+        if erow_defined:
+            attributes.append("@erow_speed")
+        values = index.read(scenario, attributes)
+        lines = self.lines & index.active
+        number = index.number
+        # Every line ends with one hidden segment
+        visible_segments = np.repeat(np.diff(index.line_start) - 1, np.diff(index.line_start))
+
+        dwell_time = values["dwell_time"].copy()
+        allowed = (values["allow_alightings"] != 0) & (values["allow_boardings"] != 0)
+        dwell_time[lines] = np.where(allowed, 0.01, 0.0)[lines]
+        stops = lines & (number > 0)
+        dwell_time[stops] = (self.stops * self.default_duration / 60.0)[stops]
+
+        ttf = values["transit_time_func"].astype(np.int64)
+        mapped_ttf = ttf.copy()
+        for original, stsu_ttf in stsu_ttf_map.items():
+            mapped_ttf[lines & (ttf == int(original))] = stsu_ttf
+        unmapped = lines & ~np.isin(ttf, [int(original) for original in stsu_ttf_map])
+        if unmapped.any():
+            raise Exception("TTF definitions do not contain TTF%s" % str(ttf[unmapped][0]))
+
+        erow_speed = values["@erow_speed"] if erow_defined else np.zeros(len(index))
+        has_erow = erow_speed > 0.0
+        auto_time = index.link_values["auto_time"]
+        moving = auto_time > 0.0
+        auto_speed = np.zeros(len(index), dtype=np.float64)
+        timed = lines & moving
+        auto_speed[timed] = index.length[timed] * 60.0 / (auto_time[timed] * self.correlation[timed])
+        xrow = np.isin(mapped_ttf, list(ttfs_xrow))
+        terminal = (number <= 1) | (number >= visible_segments - 1)
+        speed = np.where(
+            moving,
+            np.where(xrow, np.where(has_erow, erow_speed, self.global_erow_speed), auto_speed),
+            np.where(has_erow, erow_speed, np.where(terminal, 20.0, self.global_erow_speed)),
+        )
+        data1 = values["data1"].copy()
+        data1[lines] = speed[lines]
+        index.write(scenario, ["dwell_time", "transit_time_func", "data1"], [dwell_time, mapped_ttf, data1])
+
+
+# -------------------------------------------------------------------------------------------
+
+
+def _segment_keys(package_index, table_size):
+    """
+    The line ids and (i_node, j_node, loop_index) keys of the segments in a TRANSIT_SEGMENT
+    table, by table position. The j_node of hidden segments is -1.
+    """
+    lines = [""] * table_size
+    keys = np.zeros((table_size, 3), dtype=np.int64)
+    for (line_id, i, j, loop), pos in _segment_positions(package_index).items():
+        lines[pos] = line_id
+        keys[pos] = (i, -1 if j is None else j, loop)
+    return np.array(lines, dtype=np.str_), keys
+
+
+def checkpoint_package_index(checkpoint):
+    """
+    Rebuilds the TRANSIT_SEGMENT index package of the scenario a checkpoint was written
+    from, so its segment arrays can be matched to another network by line and nodes with
+    SegmentIndex. Returns None for a checkpoint that does not store its segment keys.
+    """
+    if "segment_lines" not in checkpoint:
+        return None
+    package_index = {}
+    for pos, (line_id, key) in enumerate(zip(checkpoint["segment_lines"], checkpoint["segment_keys"])):
+        if line_id:
+            j = int(key[1])
+            package_index.setdefault(str(line_id), {})[(int(key[0]), None if j < 0 else j, int(key[2]))] = pos
+    return package_index
+
+
+def write_checkpoint(path, state, **values):
+    """
+    Writes the MSA state and the given values (numbers or lists) to a NumPy .npz
+    checkpoint. Segment arrays are stored in the scenario's table order, along with the
+    line and nodes of each segment. The file is replaced atomically, so an interrupted
+    write leaves the previous checkpoint intact.
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    arrays = {name: state.index.scatter(getattr(state, name)) for name in CHECKPOINT_SEGMENT_ARRAYS}
+    for name in CHECKPOINT_NETWORK_ARRAYS:
+        arrays[name] = getattr(state, name)
+    arrays["sizes"] = np.array([state.index.table_size, len(state.inboa), len(state.volax)], dtype=np.int64)
+    arrays["segment_lines"], arrays["segment_keys"] = _segment_keys(state.index.package_index, state.index.table_size)
+    for name, value in values.items():
+        arrays[name] = np.asarray(value)
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as checkpoint_file:
+        np.savez(checkpoint_file, **arrays)
+    os.replace(temp_path, path)
+
+
+def checkpoint_fingerprint(class_demands, ttf_definitions):
+    """
+    A digest of the class demand matrices and TTF definitions that a checkpoint's MSA
+    state was computed from, so a checkpoint is not resumed after either has changed.
+    """
+    digest = hashlib.sha1()
+    for demand in class_demands:
+        demand = np.ascontiguousarray(demand, dtype=np.float64)
+        digest.update(np.asarray(demand.shape, dtype=np.int64).tobytes())
+        digest.update(demand.tobytes())
+    digest.update(json.dumps(ttf_definitions, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def read_checkpoint(path):
+    """
+    Reads a checkpoint written by write_checkpoint.
+
+    Returns: A dictionary of the stored arrays (0-d arrays for scalar values), or None
+        if there is no checkpoint at path.
+    """
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as checkpoint:
+        return {name: checkpoint[name] for name in checkpoint.files}
+
+
+# -------------------------------------------------------------------------------------------
+
+
+class PhaseTimer(object):
+    """Accumulates wall-clock seconds per named phase of an iteration."""
+
+    def __init__(self):
+        self.seconds = {}
+        self.start = time.perf_counter()
+
+    def elapsed(self):
+        """The wall-clock seconds since the timer was created."""
+        return time.perf_counter() - self.start
+
+    @contextmanager
+    def measure(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[phase] = self.seconds.get(phase, 0.0) + time.perf_counter() - start
+
+
+TELEMETRY_FIELDS = [
+    "iteration",
+    "lambda",
+    "cngap",
+    "crgap",
+    "norm_gap_difference",
+    "excess_km",
+    "gradient_evaluations",
+    "extended_assignment_seconds",
+    "matrix_reduction_seconds",
+    "segment_cost_seconds",
+    "step_size_seconds",
+    "stsu_seconds",
+    "volume_update_seconds",
+    "iteration_seconds",
+]
+
+
+class TelemetryWriter(object):
+    """
+    Appends one row of convergence and phase-timing telemetry per congested iteration.
+    Files ending in .jsonl or .json get one JSON object per line, anything else is
+    written as CSV with a header row. Each row is flushed to disk as it is written.
+
+    Args:
+        - path: The file to write to. An empty path disables the writer.
+        - append (=False): Set to True to keep the rows already in the file, e.g. when
+            resuming from a checkpoint.
+    """
+
+    def __init__(self, path, append=False):
+        self.path = (path or "").strip()
+        self.enabled = self.path != ""
+        self.json = os.path.splitext(self.path)[1].lower() in (".jsonl", ".json")
+        if self.enabled and not append and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def write(self, iteration, timer, **values):
+        """Writes the row of an iteration, with the phase times of timer."""
+        if not self.enabled:
+            return
+        row = {name: values.get(name) for name in TELEMETRY_FIELDS}
+        for name, value in row.items():
+            if isinstance(value, np.generic):
+                row[name] = value.item()
+        row["iteration"] = iteration
+        for phase, seconds in timer.seconds.items():
+            row[phase + "_seconds"] = round(seconds, 6)
+        row["iteration_seconds"] = round(timer.elapsed(), 6)
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        with open(self.path, "a", newline="") as telemetry_file:
+            if self.json:
+                telemetry_file.write(json.dumps(row) + "\n")
+            else:
+                writer = csv.DictWriter(telemetry_file, fieldnames=TELEMETRY_FIELDS)
+                if new_file:
+                    writer.writeheader()
+                writer.writerow(row)
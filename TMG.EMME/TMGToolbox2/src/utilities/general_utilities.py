@@ -31,7 +31,7 @@ import sys as _sys
 import traceback as _tb
 import subprocess as _sp
 import six
-import random
+import numpy as _np
 
 if six.PY2:
     from itertools import izip
@@ -321,6 +321,196 @@ TEMP_ATT_PREFIXES = {
 }
 
 
+SCRATCH_DESCRIPTION = "TMG scratch"
+SCRATCH_LEASED_DESCRIPTION = "TMG scratch (leased)"
+
+
+class ScratchPool(object):
+    """
+    Process-wide pool of temporary matrices and extra attribute ids. Tools lease
+    scratch matrices from the pool and return them when they are done, instead of
+    creating and deleting databank objects on every call. Returned matrices are kept
+    as they are (up to max_idle per key) and set to the default of the next lease.
+    clear() deletes the idle matrices, and is called when the XTMF bridge exits.
+
+    Matrices are pooled per emmebank and matrix type. Idle matrices carry
+    SCRATCH_DESCRIPTION, so that those left in a databank by an earlier process are
+    adopted on first use rather than leaked. Leased matrices carry the caller's
+    description or SCRATCH_LEASED_DESCRIPTION, so that a matrix still in use, or left
+    behind by a process that stopped part way through, is never adopted.
+
+    Temporary extra attributes are deleted when they are returned, since idle ones
+    would take up the scenario's extra attribute space and be copied and exported
+    along with it. Only their ids are kept, per scenario and domain, so a free id is
+    found without scanning the scenario's attributes on every call.
+    """
+
+    def __init__(self, max_idle=32):
+        self.max_idle = max_idle
+        self._idle_matrices = {}
+        self._leased_matrices = set()
+        self._attribute_ids = {}
+        self.hits = {"matrix": 0}
+        self.misses = {"matrix": 0}
+
+    # ---Matrices
+
+    def lease_matrix(self, matrix_type="FULL", default=0.0, description=None):
+        """
+        Returns an existing scratch matrix of the given type, or a new one if the pool
+        is empty. The matrix is set to default.
+        """
+        emmebank = _MODELLER.emmebank
+        idle = self._matrix_list(emmebank, matrix_type)
+        while idle:
+            matrix = emmebank.matrix(idle.pop())
+            # The id may have been deleted, or reused for a real matrix, since it was released
+            if (
+                matrix is None
+                or matrix.description != SCRATCH_DESCRIPTION
+                or matrix.read_only
+            ):
+                continue
+            matrix.initialize(value=default)
+            matrix.description = _scratch_description(description)
+            self._leased_matrices.add((emmebank.path, matrix.id))
+            self.hits["matrix"] += 1
+            return matrix
+        matrix = emmebank.create_matrix(
+            emmebank.available_matrix_identifier(matrix_type), default_value=default
+        )
+        matrix.description = _scratch_description(description)
+        self._leased_matrices.add((emmebank.path, matrix.id))
+        self.misses["matrix"] += 1
+        return matrix
+
+    def release_matrix(self, matrix):
+        """
+        Keeps a leased matrix for the next lease, which sets its values. Matrices that
+        were not leased from the pool are deleted.
+        """
+        emmebank = _MODELLER.emmebank
+        key = (emmebank.path, matrix.id)
+        if key not in self._leased_matrices:
+            _m.logbook_write("Deleting temporary matrix '%s': " % matrix.id)
+            emmebank.delete_matrix(matrix.id)
+            return
+        self._leased_matrices.discard(key)
+        idle = self._matrix_list(emmebank, matrix.type)
+        if len(idle) >= self.max_idle or matrix.read_only:
+            emmebank.delete_matrix(matrix.id)
+            return
+        matrix.name = ""
+        matrix.description = SCRATCH_DESCRIPTION
+        idle.append(matrix.id)
+
+    def _matrix_list(self, emmebank, matrix_type):
+        key = (emmebank.path, matrix_type)
+        if key not in self._idle_matrices:
+            self._idle_matrices[key] = [
+                matrix.id
+                for matrix in emmebank.matrices()
+                if matrix.type == matrix_type
+                and matrix.description == SCRATCH_DESCRIPTION
+            ]
+        return self._idle_matrices[key]
+
+    # ---Extra attributes
+
+    def lease_attribute(self, scenario, domain, default=0.0, description=None):
+        """
+        Creates a temporary extra attribute of the given domain in scenario, named like
+        @tl123 and set to default.
+        """
+        domain = str(domain).upper()
+        if not domain in TEMP_ATT_PREFIXES:
+            raise TypeError(
+                "Domain '%s' is not a recognized extra attribute domain." % domain
+            )
+        attribute = scenario.create_extra_attribute(
+            domain, self._next_attribute_id(scenario, domain), default
+        )
+        attribute.description = _scratch_description(description)
+        return attribute
+
+    def release_attribute(self, scenario, attribute_id):
+        """
+        Deletes a temporary extra attribute, keeping its id for the next lease if it is
+        named like a scratch attribute.
+        """
+        attribute = scenario.extra_attribute(attribute_id)
+        if attribute is None:
+            return
+        domain = attribute.type
+        scenario.delete_extra_attribute(attribute_id)
+        prefix = "@" + TEMP_ATT_PREFIXES.get(domain, "")
+        if attribute_id.startswith(prefix) and attribute_id[len(prefix) :].isdigit():
+            self._attribute_id_state(scenario, domain)[1].append(
+                int(attribute_id[len(prefix) :])
+            )
+
+    def _scenario_key(self, scenario, domain):
+        return (scenario.emmebank.path, scenario.number, domain)
+
+    def _attribute_id_state(self, scenario, domain):
+        key = self._scenario_key(scenario, domain)
+        if key not in self._attribute_ids:
+            # The next index to try, and the indices freed by deleted scratch attributes
+            self._attribute_ids[key] = [1, []]
+        return self._attribute_ids[key]
+
+    def _next_attribute_id(self, scenario, domain):
+        prefix = TEMP_ATT_PREFIXES[domain]
+        next_index, free = self._attribute_id_state(scenario, domain)
+        while free:
+            id = "@%s%s" % (prefix, free.pop())
+            if scenario.extra_attribute(id) is None:
+                return id
+        index = next_index
+        while scenario.extra_attribute("@%s%s" % (prefix, index)) is not None:
+            index += 1
+            if index > 999:
+                raise Exception(
+                    "Scenario %s already has 999 temporary extra attributes" % scenario
+                )
+        self._attribute_id_state(scenario, domain)[0] = index + 1
+        return "@%s%s" % (prefix, index)
+
+    # ---Reporting
+
+    def stats(self):
+        """Returns the lease hit and miss counts of matrices."""
+        return {
+            "matrix_hits": self.hits["matrix"],
+            "matrix_misses": self.misses["matrix"],
+        }
+
+    def report(self):
+        _m.logbook_write(
+            "Scratch pool: matrices %(matrix_hits)d hits / %(matrix_misses)d misses"
+            % self.stats()
+        )
+
+    def clear(self):
+        """Deletes every idle scratch matrix held by the pool."""
+        for (path, matrix_type), idle in self._idle_matrices.items():
+            emmebank = _MODELLER.emmebank
+            if emmebank.path != path:
+                continue
+            for matrix_id in idle:
+                if emmebank.matrix(matrix_id) is not None:
+                    emmebank.delete_matrix(matrix_id)
+            del idle[:]
+
+
+def _scratch_description(description):
+    # Leased objects never carry the idle description, so they can't be adopted while in use
+    return SCRATCH_LEASED_DESCRIPTION if description is None else description
+
+
+SCRATCH_POOL = ScratchPool()
+
+
 @contextmanager
 def temp_extra_attribute_manager(
     scenario, domain, default=0.0, description=None, returnId=False
@@ -348,32 +538,10 @@ def temp_extra_attribute_manager(
     Yields: The Extra Attribute object created (or its ID as indicated by the returnId arg).
     """
 
-    domain = str(domain).upper()
-    if not domain in TEMP_ATT_PREFIXES:
-        raise TypeError(
-            "Domain '%s' is not a recognized extra attribute domain." % domain
-        )
-    prefix = TEMP_ATT_PREFIXES[domain]
-
-    existingAttributeSet = set(
-        [att.name for att in scenario.extra_attributes() if att.type == domain]
+    tempAttribute = SCRATCH_POOL.lease_attribute(
+        scenario, domain, default=default, description=description
     )
-
-    index = 1
-    id = "@%s%s" % (prefix, index)
-    while id in existingAttributeSet:
-        index += 1
-        id = "@%s%s" % (prefix, index)
-        if index > 999:
-            raise Exception(
-                "Scenario %s already has 999 temporary extra attributes" % scenario
-            )
-    tempAttribute = scenario.create_extra_attribute(domain, id, default)
-    msg = "Created temporary extra attribute %s in scenario %s" % (id, scenario)
-    if description:
-        tempAttribute.description = description
-        msg += ": %s" % description
-    _m.logbook_write(msg)
+    id = tempAttribute.id
 
     if returnId:
         retval = tempAttribute.id
@@ -383,8 +551,7 @@ def temp_extra_attribute_manager(
     try:
         yield retval
     finally:
-        scenario.delete_extra_attribute(id)
-        _m.logbook_write("Deleted extra attribute %s" % id)
+        SCRATCH_POOL.release_attribute(scenario, id)
 
 
 # -------------------------------------------------------------------------------------------
@@ -404,22 +571,14 @@ def temp_matrix_manager(
         - default (=0.0): The matrix's default value.
     """
 
-    mtx = initialize_matrix(
-        default=default,
-        description="Temporary %s" % description,
-        matrix_type=matrix_type,
+    mtx = SCRATCH_POOL.lease_matrix(
+        matrix_type, default=default, description="Temporary %s" % description
     )
 
-    if mtx is None:
-        raise Exception("Could not create temporary matrix: %s" % description)
-
     try:
         yield mtx
     finally:
-        _DATABANK.delete_matrix(mtx.id)
-
-        s = "Deleted matrix %s." % mtx.id
-        _m.logbook_write(s)
+        SCRATCH_POOL.release_matrix(mtx)
 
 
 # -------------------------------------------------------------------------------------------
@@ -498,18 +657,11 @@ def process_transit_attribute(
 
 def process_traffic_attribute(scenario, prefix, attribute_type, default_value):
     if prefix != "@tvph" and prefix != "tvph":
-        while True:
-            suffix = random.randint(1, 999999)
-            if prefix.startswith("@"):
-                traffic_attrib_id = "%s%s" % (prefix, suffix)
-            else:
-                traffic_attrib_id = "@%s%s" % (prefix, suffix)
-
-            if scenario.extra_attribute(traffic_attrib_id) is None:
-                temp_traffic_attrib = scenario.create_extra_attribute(
-                    attribute_type, traffic_attrib_id, default_value
-                )
-                break
+        # Only @tvph is referenced by name, the others can come from the scratch pool
+        temp_traffic_attrib = SCRATCH_POOL.lease_attribute(
+            scenario, attribute_type, default=default_value
+        )
+        traffic_attrib_id = temp_traffic_attrib.id
     else:
         traffic_attrib_id = prefix
         if prefix.startswith("@"):
@@ -531,33 +683,56 @@ def process_traffic_attribute(scenario, prefix, attribute_type, default_value):
 # -------------------------------------------------------------------------------------------
 
 
+class TemporaryMatrixList(list):
+    """
+    The list of temporary matrices yielded by temporary_matrix_manager. Matrices can
+    be leased from the scratch pool with lease(), or created elsewhere and appended.
+    """
+
+    def lease(self, matrix_type="FULL", default=0.0, name="", description=""):
+        """Leases a scratch matrix, adding it to the list, and returns it."""
+        mtx = SCRATCH_POOL.lease_matrix(
+            matrix_type, default=default, description=description[:80] or None
+        )
+        if name:
+            mtx.name = name[:40]
+        self.append(mtx)
+        return mtx
+
+
 @contextmanager
 def temporary_matrix_manager():
     """
-    Matrix objects created & added to this matrix list are deleted when this manager exits.
+    Matrix objects leased through or added to this matrix list are released when this
+    manager exits. Leased matrices return to the scratch pool, others are deleted.
     """
-    temp_matrix_list = []
+    temp_matrix_list = TemporaryMatrixList()
     try:
         yield temp_matrix_list
     finally:
+        released = set()
         for matrix in temp_matrix_list:
-            if matrix is not None:
-                _m.logbook_write("Deleting temporary matrix '%s': " % matrix.id)
-                _MODELLER.emmebank.delete_matrix(matrix.id)
+            if matrix is not None and matrix.id not in released:
+                SCRATCH_POOL.release_matrix(matrix)
+                released.add(matrix.id)
+        SCRATCH_POOL.report()
 
 
 @contextmanager
 def temporary_attribute_manager(scenario):
+    """
+    Extra attributes added to this list are deleted when this manager exits. The ids
+    of scratch attributes are kept by the scratch pool for reuse.
+    """
     temp_attribute_list = []
     try:
         yield temp_attribute_list
     finally:
+        released = set()
         for temp_attribute in temp_attribute_list:
-            if temp_attribute is not None:
-                scenario.delete_extra_attribute(temp_attribute.id)
-                _m.logbook_write(
-                    "Deleted temporary '%s' link attribute" % temp_attribute.id
-                )
+            if temp_attribute is not None and temp_attribute.id not in released:
+                SCRATCH_POOL.release_attribute(scenario, temp_attribute.id)
+                released.add(temp_attribute.id)
 
 
 # -------------------------------------------------------------------------------------------
@@ -734,6 +909,36 @@ def fastLoadLinkAttributes(scenario, list_of_attributes):
     return retval
 
 
+# -------------------------------------------------------------------------------------------
+
+# Element types that XTMF can rebuild from an array returned through the bridge
+_XTMF_ARRAY_KINDS = "fiub"
+
+
+def array_result(data, dtype=None):
+    """
+    Prepares numeric data to be returned from a tool's run_xtmf. The bridge
+    sends arrays back to XTMF as raw little-endian bytes along with their
+    type and shape, instead of converting them to a string.
+
+    Args:
+        - data: A numpy array, an Emme MatrixData object (or anything else
+            with a to_numpy method), or a sequence of numbers.
+        - dtype (=None): Optional. The numpy type to convert the data to,
+            for example "float32" to halve the size of a float64 skim.
+
+    Returns: A C-contiguous, little-endian numpy array.
+    """
+    if hasattr(data, "to_numpy"):
+        data = data.to_numpy()
+    array = _np.asarray(data, dtype=dtype)
+    if array.dtype.kind not in _XTMF_ARRAY_KINDS:
+        raise TypeError("Arrays of type '%s' can not be returned to XTMF." % array.dtype)
+    if array.dtype.byteorder == ">":
+        array = array.astype(array.dtype.newbyteorder("<"))
+    return _np.ascontiguousarray(array)
+
+
 # -------------------------------------------------------------------------------------------
 
 